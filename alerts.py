@@ -92,6 +92,8 @@ class EventDict(object):
     else: 
       self.eventdict['alert_icon'] = 'wi-na.svg'
 
+    self.eventdict['alert_icon_ref'] = wsvg.icon_ref(self.eventdict['alert_icon'],
+                                                     self.data['output_dir'])
     logging.debug('Warning summary: %s', self.eventdict['warning_summary'])
     return self.eventdict
 
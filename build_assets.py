@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""
+build_assets.py: pack the dashboard's icons into one SVG sprite.
+
+Every icon the generated JSON can name -- the icon_match icons, the moon
+phases, the Beaufort icons, the alert icons and everything in assets/svg --
+is copied into a single minified sprite, as a nested <svg> per icon that is
+only shown when it is the URL fragment (icons.<hash>.svg#wi-day-sunny works
+as an <img> or <object> source). Precompressed .gz (and .br, if the brotli
+module is installed) copies are written next to it for the web server, and
+sprite_manifest.json maps icon file names to their fragments. The python
+run then adds *_icon_ref fields ('icons.<hash>.svg#wi-rain') to its JSON
+output, and the page needs one icon request instead of dozens.
+
+Run it once after installing the icons, and again when defaults.yml or
+the icon set changes:
+
+  ./build_assets.py [--icons static/icons/weather-icons-master/svg] [--output DIR]
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import copy
+import gzip
+import glob
+import json
+import hashlib
+import logging
+import argparse
+from io import BytesIO
+from lxml import etree
+import weather_functions as wf
+from moon_phase import PHASES
+from weathersvg import SPRITE_MANIFEST
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+SETTINGS_DIR = os.path.dirname(os.path.realpath(__file__))
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+
+# Only the targeted icon is displayed.
+SPRITE_STYLE = 'svg>svg:not(:target){display:none}'
+
+# Icons named by the dashboard scripts rather than by defaults.yml.
+EXTRA_ICONS = ['wi-na.svg', 'warning.svg', 'watch.svg', 'compass.svg'] + \
+              ['wi-wind-beaufort-{0}.svg'.format(force) for force in range(0, 13)]
+
+CSS_RULE = re.compile(r'([^{}]+)\{')
+
+
+def icon_names(defaults):
+  """
+  File names of every icon the JSON outputs and dashboard can refer to.
+  """
+  names = set(defaults['icon_match'].keys())
+  names.update(PHASES.values())
+  names.update(EXTRA_ICONS)
+  return sorted(names)
+
+
+def fragment_id(name):
+  """
+  The sprite fragment for an icon file name: 'wi-day-sunny.svg' -> 'wi-day-sunny'.
+  """
+  return re.sub(r'[^A-Za-z0-9_-]', '-', os.path.splitext(name)[0])
+
+
+def scope_css(css, scope):
+  """
+  Prefix every selector in a (simple) style sheet with '#scope ', so that
+  one icon's styles do not apply to the others in the sprite.
+  """
+  def prefix(match):
+    selectors = [sel.strip() for sel in match.group(1).split(',')]
+    return '{0}{{'.format(','.join(['#{0} {1}'.format(scope, sel) for sel in selectors]))
+  return CSS_RULE.sub(prefix, re.sub(r'\s+', ' ', css).strip())
+
+
+def sprite_entry(path, fragment):
+  """
+  One icon file as a nested <svg id=fragment>, without comments, metadata
+  or whitespace, with its ids prefixed by the fragment and its styles scoped
+  to it.
+  """
+  parser = etree.XMLParser(remove_comments=True, remove_blank_text=True,
+                           remove_pis=True)
+  root = etree.parse(path, parser).getroot()
+  viewbox = root.get('viewBox')
+  if viewbox is None:
+    viewbox = '0 0 {0} {1}'.format(re.sub(r'[a-z]+$', '', root.get('width', '30')),
+                                   re.sub(r'[a-z]+$', '', root.get('height', '30')))
+
+  entry = etree.Element('{%s}svg' % SVG_NS, nsmap={None: SVG_NS})
+  entry.set('id', fragment)
+  entry.set('viewBox', viewbox)
+  for child in root:
+    if not isinstance(child.tag, str) or etree.QName(child).namespace != SVG_NS:
+      continue
+    if etree.QName(child).localname in ['metadata', 'title', 'desc']:
+      continue
+    entry.append(copy.deepcopy(child))
+
+  ids = [element.get('id') for element in entry.iter() if element is not entry and element.get('id')]
+  renames = dict([(old, '{0}-{1}'.format(fragment, old)) for old in ids])
+  for element in entry.iter():
+    if element is not entry and element.get('id') in renames:
+      element.set('id', renames[element.get('id')])
+    for attr in ['href', XLINK_HREF]:
+      target = element.get(attr, '')
+      if target.startswith('#') and target[1:] in renames:
+        element.set(attr, '#' + renames[target[1:]])
+    for attr, value in element.attrib.items():
+      if 'url(#' in value:
+        element.set(attr, re.sub(r'url\(#([\w-]+)\)',
+                                 lambda m: 'url(#{0})'.format(renames.get(m.group(1), m.group(1))),
+                                 value))
+    if etree.QName(element).localname == 'style' and element.text:
+      text = element.text
+      for old, new in renames.items():
+        text = re.sub(r'#{0}(?![\w-])'.format(re.escape(old)), '#' + new, text)
+      element.text = scope_css(text, fragment)
+  return entry
+
+
+def build_sprite(paths):
+  """
+  Sprite markup (bytes) for {fragment: icon path}.
+  """
+  sprite = etree.Element('{%s}svg' % SVG_NS, nsmap={None: SVG_NS})
+  style = etree.SubElement(sprite, '{%s}style' % SVG_NS)
+  style.text = SPRITE_STYLE
+  for fragment in sorted(paths.keys()):
+    try:
+      sprite.append(sprite_entry(paths[fragment], fragment))
+    except (IOError, etree.XMLSyntaxError) as exc:
+      logging.error('Unable to add %s to the sprite: %s', paths[fragment], exc)
+  return etree.tostring(sprite, encoding='utf-8')
+
+
+def write_bytes(path, content):
+  """
+  Write a file by renaming a temporary copy over it.
+  """
+  partial = '{0}.tmp'.format(path)
+  with open(partial, 'wb') as out_file:
+    out_file.write(content)
+  os.rename(partial, path)
+
+
+def gzip_bytes(content):
+  """
+  Gzip content at the highest level, with a fixed timestamp so that the same
+  sprite always compresses to the same bytes.
+  """
+  buf = BytesIO()
+  with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0) as gz_file:
+    gz_file.write(content)
+  return buf.getvalue()
+
+
+def build_assets(defaults, icon_dir, output_dir, asset_dir=None):
+  """
+  Build the sprite, its compressed copies and the manifest. Returns the
+  manifest dict.
+  """
+  asset_dir = asset_dir or os.path.join(SETTINGS_DIR, 'assets', 'svg')
+  sources = dict()
+  for path in sorted(glob.glob(os.path.join(asset_dir, '*.svg'))):
+    sources[os.path.basename(path)] = path
+  missing = []
+  for name in icon_names(defaults):
+    path = os.path.join(icon_dir, name)
+    if os.path.exists(path):
+      sources.setdefault(name, path)
+    elif name not in sources:
+      missing.append(name)
+  if missing:
+    logging.warning('Icons not found in %s: %s', icon_dir, ', '.join(missing))
+
+  icons = dict([(name, fragment_id(name)) for name in sources])
+  content = build_sprite(dict([(icons[name], path) for name, path in sources.items()]))
+  sprite_name = 'icons.{0}.svg'.format(hashlib.sha1(content).hexdigest()[:12])
+
+  for old in glob.glob(os.path.join(output_dir, 'icons.*.svg*')):
+    if os.path.basename(old).split('.svg')[0] + '.svg' != sprite_name:
+      os.remove(old)
+  write_bytes(os.path.join(output_dir, sprite_name), content)
+  write_bytes(os.path.join(output_dir, sprite_name + '.gz'), gzip_bytes(content))
+  if brotli is not None:
+    write_bytes(os.path.join(output_dir, sprite_name + '.br'),
+                brotli.compress(content, quality=11))
+  else:
+    logging.info('brotli is not installed; skipping the .br sprite.')
+
+  manifest = dict(sprite=sprite_name, icons=icons, missing=missing)
+  write_bytes(os.path.join(output_dir, SPRITE_MANIFEST),
+              json.dumps(manifest, sort_keys=True).encode('utf-8'))
+  logging.info('Wrote %s (%s icons, %s bytes).', sprite_name, len(icons), len(content))
+  return manifest
+
+
+def parse_args(argv=None):
+  """
+  Command line options.
+  """
+  parser = argparse.ArgumentParser(description='Build the dashboard icon sprite.')
+  parser.add_argument('--icons', default=None,
+                      help='weather-icons SVG directory (default: icon_source_dir)')
+  parser.add_argument('--output', default=None,
+                      help='output directory (default: output_dir in settings.yml)')
+  return parser.parse_args(argv)
+
+
+def main(argv=None):
+  """
+  Build the sprite from the settings files.
+  """
+  args = parse_args(argv)
+  logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+  settings = wf.load_yaml(SETTINGS_DIR, 'settings.yml')
+  defaults = wf.load_yaml(SETTINGS_DIR, 'defaults.yml')
+  if not (settings and defaults):
+    sys.exit('settings files are required and could not be loaded successfully.')
+  icon_dir = args.icons or defaults['icon_source_dir']
+  if not os.path.isabs(icon_dir):
+    icon_dir = os.path.join(SETTINGS_DIR, icon_dir)
+  manifest = build_assets(defaults, icon_dir, args.output or settings['output_dir'])
+  print('{0}: {1} icons, {2} missing'.format(manifest['sprite'], len(manifest['icons']),
+                                            len(manifest['missing'])))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -18,20 +18,40 @@ from __future__ import print_function
 import sys
 import os
 import logging
+import argparse
+import datetime
+import sqlite3
 import weather_functions as wf
-from imagery import Imagery
+from imagery import MultiBandImagery
 from alerts import Alerts
 from radar import Radar
 from obs import Observation
-from forecast import Forecast, ZoneForecast
-import weathersvg as wsvg
+from history import ObservationHistory
+from stations import StationNetwork
+from forecast import Forecast, ZoneForecast, TimeSeriesForecast
+import profiling
 
 # Pull settings in from two YAML files:
 SETTINGS_DIR = os.path.dirname(os.path.realpath(__file__))
 # OUTPUT_DIR = os.path.join(os.environ['HOME'], 'Library/Caches/weatherwidget/')
 
 
-def main():
+def parse_args(argv=None):
+  """
+  Command line options. Everything else lives in the YAML settings files.
+  """
+  parser = argparse.ArgumentParser(description='Retrieve and write out NWS weather data.')
+  parser.add_argument('--profile', action='store_true',
+                      help='profile each stage with cProfile and tracemalloc')
+  parser.add_argument('--profile-sample', type=float, default=None, dest='profile_sample',
+                      help='fraction of runs to profile (default: profile_sample_rate)')
+  parser.add_argument('--backfill', type=float, default=None, metavar='HOURS',
+                      help='fill the observation archive with the last HOURS of '
+                           'station observations, then exit')
+  return parser.parse_args(argv)
+
+
+def main(args=None):
   """
   - Parse user-specified data from YaML
   - Check to see that the needed graphics are available. If not, get them.
@@ -44,6 +64,8 @@ def main():
     and runs the overlays with -bash-.
   - Check for and acquire current multi-band GOES-x imagery of a given resolution.
   """
+  if args is None:
+    args = parse_args([])
   if os.path.exists('weatherwidget.log'):
     os.remove('weatherwidget.log')
   logging.basicConfig(filename='weatherwidget.log', level=logging.DEBUG,
@@ -54,76 +76,139 @@ def main():
     logging.error('Unable to load settings files. These are required.')
     sys.exit('settings files are required and could not be loaded successfully.')
 
-  logging.info('Checking for radar outage.')
-  wf.outage_check(data)
-
-  logging.info('Retrieving current weather observations.')
-  right_now = Observation(data)
-  right_now.get_current_conditions()
-  right_now.get_backup_obs(use_json=False)
-  right_now.merge_good_observations()
-  logging.debug('Merged current conditions: %s', right_now.con1.obs)
-  sum_con = right_now.conditions_summary()
-
-  if right_now.con1.obs and sum_con:
-    text_conditions, nice_con = right_now.format_current_conditions()
-    logging.debug('Current conditions from primary source: %s', nice_con)
-    wf.write_json(some_dict=nice_con,
-                  outputdir=data['output_dir'],
-                  filename='current_conditions.json'
-                 )
-  else:
-    logging.error('Something went wrong getting the current conditions. Halting.')
-    return 1
-
-  wf.write_text(os.path.join(data['output_dir'], 'current_conditions.txt'), text_conditions)
+  if args.backfill:
+    return backfill_history(data, hours=args.backfill)
 
-# Get radar image:
-  current_radar = Radar(data)
-  current_radar.check_assets()
-  current_radar.get_radar()
-  current_radar.get_warnings_box()
-  if current_radar.problem:
-    logging.error('Unable to retrieve weather radar image. Halting now.')
+  profiler = profiling.from_settings(data, force=args.profile, sample_rate=args.profile_sample)
+  try:
+    return run_stages(data, profiler)
+  finally:
+    profiler.finish()
 
-  # Hazardous Weather Outlook and alerts:
-  today_alerts = Alerts(data)
-  today_alerts.get_alerts()
 
-  # Get hydrograph image.
-  if wf.get_hydrograph(abbr=data['river_gauge_abbr'],
-                       hydro_url=data['defaults']['water_url'],
-                       outputdir=data['output_dir']).ok:
-    logging.info('Requesting hydrograph for station %s, gauge "%s".',
-                 data['radar_station'], data['river_gauge_abbr'])
-  else:
-    logging.error('Failed to get hydrograph information.')
+def backfill_history(data, hours):
+  """
+  Fill holes in the observation archive (e.g. after downtime) from the
+  station's observation list, in one paginated request and one bulk insert.
+  """
+  end = datetime.datetime.utcnow()
+  start = end - datetime.timedelta(hours=hours)
+  logging.info('Backfilling observations from %s to %s.', start, end)
+  station = Observation(data)
+  records = station.parse_observation_list(station.get_observation_list(start, end))
+
+  archive = ObservationHistory.from_settings(data)
+  try:
+    added = archive.append_many(records)
+  except sqlite3.Error as exc:
+    logging.error('Unable to backfill the observation archive: %s', exc)
     return 1
+  finally:
+    archive.close()
 
-  forecast_obj = Forecast(data=data)
-  logging.debug('Getting the forecasts.')
-  forecast_obj.get_forecast()
-  forecastdict = forecast_obj.parse_forecast()
-  if forecastdict is None:
-    logging.error('Unable to parse forecast!')
-    return 1
-  forecast_obj.write_forecast(outputdir=data['output_dir'])
-  logging.debug('Getting area forecast discussion.')
-  forecast_obj.get_afd()
+  logging.info('Backfill added %s observations.', added)
+  return 0
+
+
+def run_stages(data, profiler):
+  """
+  Run each stage of the program in order. Each stage is wrapped by the
+  profiler, which is a no-op unless profiling is on for this run.
+  """
+  with profiler.stage('outage'):
+    logging.info('Checking for radar outage.')
+    wf.outage_check(data)
+
+  with profiler.stage('observations'):
+    logging.info('Retrieving current weather observations.')
+    right_now = Observation(data)
+    right_now.get_current_conditions()
+    if data.get('nearby_stations'):
+      network = StationNetwork(data, right_now)
+      network.fetch_all()
+      network.merge()
+    if right_now.needs_backup():
+      right_now.get_backup_obs(use_json=False)
+    right_now.merge_good_observations()
+    logging.debug('Merged current conditions: %s', right_now.con1.obs)
+    sum_con = right_now.conditions_summary()
+
+    if right_now.record and sum_con:
+      text_conditions, nice_con = right_now.format_current_conditions()
+      logging.debug('Current conditions from primary source: %s', nice_con)
+      wf.write_json(some_dict=nice_con,
+                    outputdir=data['output_dir'],
+                    filename='current_conditions.json'
+                   )
+    else:
+      logging.error('Something went wrong getting the current conditions. Halting.')
+      return 1
+
+    wf.write_text(os.path.join(data['output_dir'], 'current_conditions.txt'), text_conditions)
+
+    archive = ObservationHistory.from_settings(data)
+    try:
+      archive.append(right_now.record)
+    except sqlite3.Error as exc:
+      logging.error('Unable to archive the current observation: %s', exc)
+    finally:
+      archive.close()
+
+  # Get radar image:
+  with profiler.stage('radar'):
+    current_radar = Radar(data)
+    current_radar.check_assets()
+    current_radar.get_radar()
+    current_radar.get_warnings_box()
+    if current_radar.problem:
+      logging.error('Unable to retrieve weather radar image. Halting now.')
 
-  logging.debug('Getting zone forecast.')
-  zoneforecast = ZoneForecast(data)
-  zoneforecast.get()
+  # Hazardous Weather Outlook and alerts:
+  with profiler.stage('alerts'):
+    today_alerts = Alerts(data)
+    today_alerts.get_alerts()
 
-  wf.write_json(some_dict=forecastdict,
-                outputdir=data['output_dir'],
-                filename='forecast.json'
-               )
-  wsvg.make_forecast_icons(forecastdict, outputdir=data['output_dir'])
+  # Get hydrograph image.
+  with profiler.stage('hydrograph'):
+    if wf.get_hydrograph(abbr=data['river_gauge_abbr'],
+                         hydro_url=data['defaults']['water_url'],
+                         outputdir=data['output_dir']).ok:
+      logging.info('Requesting hydrograph for station %s, gauge "%s".',
+                   data['radar_station'], data['river_gauge_abbr'])
+    else:
+      logging.error('Failed to get hydrograph information.')
+      return 1
+
+  with profiler.stage('forecast'):
+    forecast_obj = Forecast(data=data)
+    logging.debug('Getting the forecasts.')
+    forecast_obj.get_forecast()
+    forecastdict = forecast_obj.parse_forecast()
+    if forecastdict is None:
+      logging.error('Unable to parse forecast!')
+      return 1
+    forecast_obj.write_forecast(outputdir=data['output_dir'])
+    forecast_obj.parse_point_forecasts()
+    logging.debug('Getting area forecast discussion.')
+    forecast_obj.get_afd()
+
+    logging.debug('Getting zone forecast.')
+    zoneforecast = ZoneForecast(data)
+    zoneforecast.get()
+
+    logging.debug('Getting hourly forecast for the meteogram.')
+    TimeSeriesForecast(data).get()
+
+    wf.write_json(some_dict=forecastdict,
+                  outputdir=data['output_dir'],
+                  filename='forecast.json'
+                 )
 
   # Satellite imagery:
-  current_image = Imagery(band='GEOCOLOR', data=data)
-  current_image.get_all()
+  with profiler.stage('imagery'):
+    current_image = MultiBandImagery(bands=data.get('goes_current_bands') or ['GEOCOLOR'],
+                                     data=data)
+    current_image.get_all()
 
   logging.info('Finished program run.')
 
@@ -131,4 +216,4 @@ def main():
 
 
 if __name__ == '__main__':
-  sys.exit(main())
+  sys.exit(main(parse_args()))
@@ -0,0 +1,158 @@
+"""
+derived.py: derived meteorological quantities (wind chill, heat index,
+dewpoint depression, Beaufort number and 16-point cardinal direction),
+computed on NumPy arrays so that a whole series of observations or forecast
+periods is handled in one call. Scalars work too; the *_scalar wrappers
+return plain Python values for the existing single-observation call sites.
+"""
+
+from __future__ import division
+
+import numpy as np
+
+CARDINALS = np.array(['N', 'NNE', 'NE', 'ENE', 'E', 'ESE', 'SE', 'SSE',
+                      'S', 'SSW', 'SW', 'WSW', 'W', 'WNW', 'NW', 'NNW'], dtype=object)
+
+SECTOR = 360.0 / len(CARDINALS)
+
+# Upper bound (inclusive, mph) of Beaufort numbers 0-12, as in defaults.yml.
+BEAUFORT_HIGH_MPH = np.array([1, 3, 7, 12, 18, 24, 31, 38, 46, 54, 63, 72, 83], dtype=float)
+
+_EDGE_CACHE = {}
+
+
+def as_float_array(values):
+  """
+  Coerce a scalar, list or array to a float array; None and unparseable
+  entries become NaN.
+  """
+  try:
+    return np.asarray(values, dtype=float)
+  except (TypeError, ValueError):
+    flat = []
+    for value in np.ravel(np.asarray(values, dtype=object)):
+      try:
+        flat.append(float(value))
+      except (TypeError, ValueError):
+        flat.append(np.nan)
+    return np.asarray(flat, dtype=float).reshape(np.shape(values))
+
+
+def beaufort_edges(table):
+  """
+  Sorted upper bounds (mph) of each Beaufort number, from the beaufort_scale
+  table in defaults.yml. Built once per table object.
+  """
+  cached = _EDGE_CACHE.get(id(table))
+  if cached is not None and cached[0] is table:
+    return cached[1]
+  ranks = sorted([int(key) for key in table.keys()])
+  edges = np.array([float(table[str(rank)][1]) for rank in ranks])
+  _EDGE_CACHE[id(table)] = (table, edges)
+  return edges
+
+
+def beaufort(speed_mph, edges=BEAUFORT_HIGH_MPH):
+  """
+  Beaufort number for each (whole-mph) wind speed: the first class whose
+  upper bound is at least the speed, clamped to 0-12. Missing speeds give -1.
+  """
+  speed = as_float_array(speed_mph)
+  missing = np.isnan(speed)
+  whole = np.floor(np.where(missing, 0.0, np.maximum(speed, 0.0)))
+  rank = np.minimum(np.searchsorted(edges, whole, side='left'), len(edges) - 1)
+  return np.where(missing, -1, rank)
+
+
+def cardinal_index(azimuth):
+  """
+  Index into CARDINALS for each azimuth (degrees the wind blows from). Each
+  point covers the half-open sector (center - 11.25, center + 11.25].
+  Missing azimuths give -1.
+  """
+  azimuth = as_float_array(azimuth)
+  missing = np.isnan(azimuth)
+  index = np.ceil((np.where(missing, 0.0, azimuth) - SECTOR / 2.0) / SECTOR) % len(CARDINALS)
+  return np.where(missing, -1, index.astype(int))
+
+
+def cardinal_direction(azimuth):
+  """
+  16-point compass names for an array of azimuths (None where missing).
+  """
+  index = cardinal_index(azimuth)
+  names = CARDINALS[np.where(index < 0, 0, index)]
+  return np.where(index < 0, None, names)
+
+
+def wind_chill(temp_f, wind_mph):
+  """
+  NWS wind chill (deg F) from temperature (deg F) and wind speed (mph):
+  35.74 + 0.6215 T - 35.75 V**0.16 + 0.4275 T V**0.16
+  """
+  temp = as_float_array(temp_f)
+  wind = as_float_array(wind_mph)
+  with np.errstate(invalid='ignore'):
+    wind_term = np.power(wind, 0.16)
+  return 35.74 + (0.6215 * temp) - (35.75 * wind_term) + (0.4275 * temp * wind_term)
+
+
+def heat_index(temp_f, humidity):
+  """
+  NWS heat index (deg F) from temperature (deg F) and relative humidity (%),
+  using Steadman's simple formula below 80 F and the Rothfusz regression
+  (with its low- and high-humidity adjustments) above.
+  """
+  temp = as_float_array(temp_f)
+  rh = as_float_array(humidity)
+
+  simple = 0.5 * (temp + 61.0 + ((temp - 68.0) * 1.2) + (rh * 0.094))
+  full = (-42.379 + 2.04901523 * temp + 10.14333127 * rh
+          - 0.22475541 * temp * rh - 0.00683783 * temp * temp
+          - 0.05481717 * rh * rh + 0.00122874 * temp * temp * rh
+          + 0.00085282 * temp * rh * rh - 0.00000199 * temp * temp * rh * rh)
+
+  with np.errstate(invalid='ignore'):
+    dry = (rh < 13.0) & (temp >= 80.0) & (temp <= 112.0)
+    full = full - np.where(dry, ((13.0 - rh) / 4.0) *
+                           np.sqrt(np.abs(17.0 - np.abs(temp - 95.0)) / 17.0), 0.0)
+    humid = (rh > 85.0) & (temp >= 80.0) & (temp <= 87.0)
+    full = full + np.where(humid, ((rh - 85.0) / 10.0) * ((87.0 - temp) / 5.0), 0.0)
+    return np.where((simple + temp) / 2.0 < 80.0, simple, full)
+
+
+def dewpoint_depression(temp, dewpoint):
+  """
+  Temperature minus dewpoint, in whatever (common) units they are given.
+  """
+  return as_float_array(temp) - as_float_array(dewpoint)
+
+
+def beaufort_scalar(speed_mph, edges=BEAUFORT_HIGH_MPH):
+  """
+  Beaufort number for one speed, or None if it is missing.
+  """
+  rank = int(beaufort(speed_mph, edges))
+  if rank < 0:
+    return None
+  return rank
+
+
+def cardinal_scalar(azimuth):
+  """
+  16-point compass name for one azimuth, or None if it is missing.
+  """
+  index = int(cardinal_index(azimuth))
+  if index < 0:
+    return None
+  return CARDINALS[index]
+
+
+def wind_chill_scalar(temp_f, wind_mph):
+  """
+  Wind chill for one temperature and wind speed, or None if either is missing.
+  """
+  chill = float(wind_chill(temp_f, wind_mph))
+  if np.isnan(chill):
+    return None
+  return chill
@@ -5,11 +5,42 @@ Simple application to serve up JSON data using a few API endpoints.
 """
 import sys
 import os
-from flask import Flask
+import json
+import sqlite3
+import yaml
+from flask import Flask, Response, request
 from flask_cors import CORS
+SETTINGS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SETTINGS_DIR)
+from textarchive import TextArchive
+from history import ObservationHistory, COLUMNS as HISTORY_COLUMNS
+import weathersvg as wsvg
 app = Flask(__name__)
 CORS(app)
 
+with open(os.path.join(SETTINGS_DIR, 'defaults.yml'), 'r') as defaults_file:
+  DEFAULTS = yaml.safe_load(defaults_file)
+
+# The archives are wherever the python run writes them.
+with open(os.path.join(SETTINGS_DIR, 'settings.yml'), 'r') as settings_file:
+  SETTINGS = yaml.load(settings_file, Loader=yaml.Loader)
+SETTINGS['defaults'] = DEFAULTS
+HISTORY_DB = ObservationHistory.from_settings(SETTINGS).path
+TEXT_ARCHIVE_DB = TextArchive.from_settings(SETTINGS).path
+
+
+def query_history(sql, params=()):
+  """
+  Run a read-only query against the observation archive and return the
+  column names and rows.
+  """
+  conn = sqlite3.connect('file:{0}?mode=ro'.format(HISTORY_DB), uri=True)
+  try:
+    cursor = conn.execute(sql, params)
+    return [col[0] for col in cursor.description], cursor.fetchall()
+  finally:
+    conn.close()
+
 @app.route('/current_conditions')
 def current_conditions():
   """
@@ -81,3 +112,96 @@ def zoneforecast():
   with open('/var/www/html/dist/zoneforecast.json', 'r') as cc:
     zoneforecastdict = cc.read()
     return zoneforecastdict
+
+
+@app.route('/meteogram')
+def meteogram():
+  """
+  The hourly forecast for the next week in one columnar document: a list of
+  times (epoch seconds) and one list per element, ready for charting.
+  """
+  with open('/var/www/html/dist/meteogram.json', 'r') as cc:
+    return cc.read()
+
+
+@app.route('/zoneforecasts')
+def zoneforecasts():
+  """
+  Text forecasts for every configured zone, keyed by zone code, or just one
+  zone's forecast with ?zone=TXZ103.
+  """
+  with open('/var/www/html/dist/zoneforecasts.json', 'r') as cc:
+    forecasts = json.load(cc)
+  zone = request.args.get('zone')
+  if zone:
+    return json.dumps(forecasts.get(zone.upper(), []))
+  return json.dumps(forecasts)
+
+
+@app.route('/history')
+def history():
+  """
+  Recent observations straight from the SQLite archive, one list per column
+  (convenient for plotting). Optional ?hours=N, default 24.
+  """
+  hours = request.args.get('hours', 24, type=float)
+  columns, rows = query_history('SELECT {0} FROM observations WHERE epoch >= '
+                                '(SELECT MAX(epoch) FROM observations) - ? '
+                                'ORDER BY epoch'.format(HISTORY_COLUMNS),
+                                (int(hours * 3600),))
+  series = dict([(col, list(values)) for col, values in zip(columns, zip(*rows))])
+  return json.dumps(series)
+
+
+@app.route('/trends')
+def trends():
+  """
+  Rolling min/max/mean statistics and pressure tendency, as maintained by
+  the observation archive.
+  """
+  _, rows = query_history('SELECT name, value FROM trends')
+  return json.dumps(dict(rows))
+
+
+@app.route('/search')
+def search():
+  """
+  Full-text search of archived text products, best matches first:
+  ?q=dryline (FTS5 query syntax), optional &product=AFD, &days=90, &limit=20.
+  """
+  query = request.args.get('q', '')
+  if not query:
+    return json.dumps({'error': 'missing q'}), 400
+  archive = TextArchive(TEXT_ARCHIVE_DB)
+  try:
+    results = archive.search(query,
+                             product=request.args.get('product'),
+                             days=request.args.get('days', type=float),
+                             limit=request.args.get('limit', 20, type=int))
+  except sqlite3.Error as exc:
+    return json.dumps({'error': str(exc)}), 400
+  finally:
+    archive.close()
+  return json.dumps(results)
+
+
+@app.route('/icon/<kind>')
+def icon(kind):
+  """
+  A forecast icon rendered on request, without touching disk:
+  /icon/temp?high=81&low=62, /icon/precip?morning=20&evening=60 or
+  /icon/compass?degrees=225.
+  """
+  if kind == 'compass':
+    markup = wsvg.draw_compass_svg(request.args.get('degrees'), {'defaults': DEFAULTS})
+    if markup is None:
+      return json.dumps({'error': 'missing degrees'}), 400
+    return Response(markup, mimetype='image/svg+xml')
+  if kind == 'temp':
+    args = (request.args.get('high', ''), request.args.get('low', ''))
+  elif kind == 'precip':
+    args = (request.args.get('morning', 0, type=int), request.args.get('evening', 0, type=int))
+  else:
+    return json.dumps({'error': 'unknown icon type'}), 404
+  markup = wsvg.render_icons([(kind, args)])[0]
+  return Response(markup, mimetype='image/svg+xml')
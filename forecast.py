@@ -8,48 +8,69 @@ from __future__ import print_function
 
 import os
 import re
+import shutil
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 import requests
-from bs4 import BeautifulSoup
+import numpy as np
+from lxml import etree
+from ndfd import DWML
+from iconcache import IconCache
 from weather_functions import write_json
+from textproduct import TextProduct, segment, flatten, paragraphs, zone_index
+import units
+import derived
 import weathersvg as wsvg
 
+# The /time frame/ label lines under an AFD section header.
+AFD_LABEL = re.compile(r'^[ \t]*/([^/\n]+)/[ \t]*$', re.M)
+
+# DWML time-series parameter -> meteogram.json key.
+TIMESERIES_NAMES = {'temperature_hourly': 'temperature',
+                    'temperature_dew point': 'dewpoint',
+                    'temperature_apparent': 'apparent',
+                    'wind-speed_sustained': 'wind',
+                    'wind-speed_gust': 'gusts',
+                    'direction': 'wind_direction',
+                    'cloud-amount': 'sky',
+                    'probability-of-precipitation': 'pop',
+                    'precipitation': 'qpf',
+                    'humidity': 'humidity'
+                   }
+
 
 class DayForecast(object):
   """
   Store one day's forecast and do useful stuff with the information.
   """
 
-  def __init__(self, output_dir, idx, parsed_xml, icon_dict):
+  def __init__(self, output_dir, idx, columns, icon_dict, label='today', icons=None):
     self.fcd = dict(high=None, low=None, precip_morning=0, precip_evening=0,
                     shortcast='No forecast', forecast_string='',
                     night_forecast_string='', day='Noneday',
                     date=None, icon='na.svg', idx=idx)
     self.idx = idx
-    self.parsed_xml = parsed_xml
+    self.columns = columns
     self.icon_dict = icon_dict
     self.output_dir = output_dir
+    self.label = label
+    self.icons = icons if icons is not None else IconCache(None)
     self.offset = ''
 
 
   def make_forecast_icons(self):
     """
-    Write out SVG icons of the day's temps and precip chances.
+    Write out SVG icons of the day's temps and precip chances, through the
+    render cache.
     """
-    filelabel = 'today_{fctype}_plus_{day}.svg'
+    filelabel = '{label}_{fctype}_plus_{day}.svg'
     logging.info('Making temperature and precipitation forecast icons for day %s', self.idx)
-    wsvg.high_low_svg(self.fcd['high'],
-                      self.fcd['low'],
-                      filelabel.format(fctype='temp', day=self.idx),
-                      outputdir=self.output_dir
-                     )
-    wsvg.precip_chance_svg(int(self.fcd['precip_morning']),
-                           int(self.fcd['precip_evening']),
-                           filename=filelabel.format(fctype='precip', day=self.idx),
-                           outputdir=self.output_dir
-                          )
-
+    temp_file = filelabel.format(label=self.label, fctype='temp', day=self.idx)
+    precip_file = filelabel.format(label=self.label, fctype='precip', day=self.idx)
+    self.icons.render(os.path.join(self.output_dir, temp_file), wsvg.high_low_svg,
+                      self.fcd['high'], self.fcd['low'])
+    self.icons.render(os.path.join(self.output_dir, precip_file), wsvg.precip_chance_svg,
+                      int(self.fcd['precip_morning']), int(self.fcd['precip_evening']))
     return True
 
 
@@ -57,26 +78,14 @@ class DayForecast(object):
     """
     Populate a single day's forecast dict.
     """
-    params = self.parsed_xml.find('parameters')
-    if params:
-      logging.debug('Found parameters tag in parsed XML forecast')
-    else:
-      logging.error('Parsed XML contains no parameters. Returning None!')
-      logging.debug(self.parsed_xml)
+    if not self.columns or self.idx >= len(self.columns['date']):
+      logging.error('No forecast columns for day %s. Returning None!', self.idx)
       return None
-    temps = params.find_all("temperature")
-    for temp in range(0, len(temps)):
-      if temps[temp].attrs['type'] == "maximum":
-        self.fcd['high'] = temps[temp].find_all("value")[self.idx].text
-        continue
-      self.fcd['low'] = temps[temp].find_all("value")[self.idx].text
-
-    precip = params.find('probability-of-precipitation')
-    self.fcd['precip_morning'] = precip.find_all("value")[self.idx].text
-    self.fcd['precip_evening'] = precip.find_all("value")[self.idx + 1].text
-    self.fcd['shortcast'] = params.find_all("weather-conditions")[self.idx].attrs['weather-summary']
+    for key in ['high', 'low', 'precip_morning', 'precip_evening']:
+      self.fcd[key] = self.columns[key][self.idx]
+    self.fcd['shortcast'] = self.columns['shortcast'][self.idx] or self.fcd['shortcast']
 
-    parseable_time = self.parsed_xml.find('time-layout').find_all("start-valid-time")[self.idx].text
+    parseable_time = self.columns['start'][self.idx]
     parseable_time1, self.offset = re.sub(r'([+|-])(\d{2}):(\d{2})$',
                                           ' \\1\\2\\3',
                                           parseable_time).split()
@@ -85,6 +94,7 @@ class DayForecast(object):
     self.fcd['date'] = valid_time.strftime("%Y-%m-%d")
     self.fcd['icon'] = wsvg.assign_icon(self.fcd['shortcast'],
                                         self.icon_dict)
+    self.fcd['icon_ref'] = wsvg.icon_ref(self.fcd['icon'], self.output_dir)
     self.make_forecast_icons()
     logging.debug('Day forecast: %s', self.fcd)
     return self.fcd
@@ -102,7 +112,10 @@ class Forecast(object):
     self.forecast = []
     self.afd = []
     self.offset = ''
-    self.parsed_xml = ''
+    self.dwml = None
+    self.points = data.get('forecast_points') or []
+    self.point_forecasts = dict()
+    self.icons = IconCache.from_settings(data)
 
 
   def get_afd(self, fmt='txt'):
@@ -118,66 +131,52 @@ class Forecast(object):
 
     """
     afdreturn = dict(short_term='', long_term='')
-    recordsplit = '&&'
-    args = {'site':self.data['nws_abbr'],
-            'issuedby': self.data['nws_abbr'],
-            'product': 'AFD',
-            'format': fmt,
-            'version': '1',
-            'glossary': '0'
-           }
-
-    try:
-      response = requests.get(self.defaults['afd_url'],
-                              params=args,
-                              verify=True,
-                              timeout=10)
-    except requests.exceptions.ReadTimeout:
-      logging.error('Request timed out. Returning -None-')
-      return None
-
-    if response.status_code != 200:
-      logging.error('Response from server was not OK: %s', response.status_code)
-      logging.debug('Response: %s', response.text)
+    product = TextProduct(self.data, 'AFD', self.data['nws_abbr'],
+                          site=self.data['nws_abbr'],
+                          params={'format': fmt, 'version': '1', 'glossary': '0'})
+    afd = product.fetch()
+    if afd is None:
+      logging.error('No Area Forecast Discussion text. Returning -None-')
       return None
-
-    afd = BeautifulSoup(response.text, 'lxml').find('body').find('pre').text
-    logging.debug('Response text (HTML body/pre/text):\n%s', afd)
-
-    afd_groups = re.split(re.escape(recordsplit), afd, re.M)
-    if len(afd_groups) < 5:
-      logging.warn('There should be five or six sections in the Area Forecast Discussion!')
+    logging.debug('Area Forecast Discussion text:\n%s', afd)
+
+    cached = product.cached_result()
+    if cached is not None:
+      write_json(cached, outputdir=self.data['output_dir'], filename='afd.json')
+      return cached
+
+    sections = dict()
+    for section in segment(afd):
+      if section.title and section.title.upper() not in sections:
+        sections[section.title.upper()] = section.body
+    logging.debug('Area Forecast Discussion sections: %s', list(sections.keys()))
+
+    short_term = sections.get(self.defaults['afd_divisions'][0].strip('.'))
+    long_term = sections.get(self.defaults['afd_divisions'][1].strip('.'))
+    if short_term is None or long_term is None:
+      logging.warn('No short and long term sections in the Area Forecast Discussion!')
       logging.warn('Returning None.')
       return None
-    else:
-      logging.debug('There are %s entries in the Area Forecast Discussion.', len(afd_groups))
 
-    indicator = self.defaults['afd_divisions'][0]
-    short_term = afd_groups[0]
-    afdreturn['short_title'], afdreturn['short_term'] = self.tidy_afd_text(short_term, indicator)
-
-    indicator = self.defaults['afd_divisions'][1]
-    long_term = afd_groups[1]
-    afdreturn['long_title'], afdreturn['long_term'] = self.tidy_afd_text(long_term, indicator)
+    afdreturn['short_title'], afdreturn['short_term'] = self.tidy_afd_text(short_term)
+    afdreturn['long_title'], afdreturn['long_term'] = self.tidy_afd_text(long_term)
 
+    product.save_result(afdreturn)
     write_json(afdreturn, outputdir=self.data['output_dir'], filename='afd.json')
     return afdreturn
 
 
-  def tidy_afd_text(self, text, upperlabel):
+  def tidy_afd_text(self, text):
     """
-    Take the text and do some basic regexing on it, plus extract potential
-    label/header text.
+    Take the body of one AFD section and return its time frame label plus
+    the text, one line per paragraph, without the /label/ lines or the
+    forecaster number at the end.
     """
-    fctxt = re.sub(r'^.+.?(' + re.escape(upperlabel) +  ')', '\\1', text, re.M, re.DOTALL)
-    fctxt = re.sub(r'\n+\d+\n+$', '', fctxt, re.M)
-    label = self.get_forecast_header(fctxt)
-    fctxt = re.sub(r'' + re.escape(upperlabel) + '.+.?\/\n{2}?', '', fctxt, re.M, re.DOTALL)
-    fctxt = re.sub(r'\n(?!\n)', ' ', fctxt)
-    fctxt = re.sub(r'\`', "'", fctxt)
-    fctxt = re.sub(r'^\s+', '', fctxt)
-    fctxt = re.sub(r'\.\s+\.\s*', '.', fctxt)
-    fctxt = re.sub(r'\n+$', '', fctxt)
+    label = self.get_forecast_header(text)
+    parts = paragraphs(AFD_LABEL.sub('', text))
+    while parts and parts[-1].isdigit():
+      parts.pop()
+    fctxt = '\n'.join(parts).replace('`', "'")
     return label, fctxt
 
 
@@ -186,18 +185,12 @@ class Forecast(object):
     Pull out the forcast timing information label, ignoring the labels that
     say "NEW". These labels are denoted with forward slashes.
     """
-
-    headers = [re.sub(r'\/', '', r.group()) for r in re.finditer(r'\/.+.?\/', text)]
-
-    try:
-      if headers[1]:
-        return headers[1]
-      if headers[0]:
-        return headers[0]
-      return ''
-
-    except Exception as exc:
-      logging.error('Cannot match a forecast time frame header in %s. (%s)', headers, exc)
+    headers = [header.strip() for header in AFD_LABEL.findall(text)]
+    if len(headers) > 1:
+      return headers[1]
+    if headers:
+      return headers[0]
+    logging.error('Cannot match a forecast time frame header in %s.', text[:80])
     return ''
 
 
@@ -216,6 +209,9 @@ class Forecast(object):
     See also: https://www.weather.gov/documentation/services-web-api for
     another API?
 
+    With forecast_points in the settings, the main lat/lon and every point
+    go into the same request as a listLatLon point list (point1 is the
+    main location).
     """
     if not fmt or fmt is None:
       fmt = ['24', 'hourly']
@@ -225,6 +221,11 @@ class Forecast(object):
                'format': time_format,
                'numDays': self.data['defaults']['forecast_days']
               }
+    if self.points:
+      coords = [(self.data['lat'], self.data['lon'])] + [(point['lat'], point['lon'])
+                                                         for point in self.points]
+      payload['listLatLon'] = ' '.join(['{0},{1}'.format(lat, lon) for lat, lon in coords])
+      del payload['lat'], payload['lon']
     try:
       retval = requests.get(url=self.data['defaults']['forecast_url'],
                             params=payload,
@@ -238,10 +239,14 @@ class Forecast(object):
     if retval.status_code == 200:
       self.data['forecast_xml'] = retval.text
       logging.info('Forecast request returned HTTP response code: %s', retval)
-      self.parsed_xml = BeautifulSoup(self.data['forecast_xml'], 'xml')
+      try:
+        self.dwml = DWML(retval.content)
+      except etree.XMLSyntaxError as exc:
+        logging.error('Unable to parse the forecast XML: %s', exc)
+        return None
 
-      if self.parsed_xml.find('error'):
-        logging.warn('Server returned 200 but had errors:\n%s', self.parsed_xml)
+      if self.dwml.error:
+        logging.warn('Server returned 200 but had errors:\n%s', self.dwml.error)
         logging.info('Submitted:\nURL: %s\nPayload: %s',
                      self.data['defaults']['forecast_url'], str(payload))
         return None
@@ -253,38 +258,61 @@ class Forecast(object):
 
   def parse_forecast(self):
     """
-    Use bs4 to parse the XML returned from the AWS forecast request.
+    Build each day's forecast from the DWML columns, which are read from
+    the XML once for all days.
+    """
+    if self.dwml is None:
+      logging.warn('No forecast XML. Forecast is NONE.')
+      return None
+    self.forecast = self.build_days(None)
+    return self.forecast
+
+
+  def build_days(self, location, label='today'):
+    """
+    The list of DayForecast dicts for one location in the DWML document.
     """
+    forecast = []
+    columns = self.dwml.daily(location=location, days=self.data['defaults']['forecast_days'])
     for idx in range(0, self.data['defaults']['forecast_days']):
 
       today = DayForecast(output_dir=self.data['output_dir'],
                           idx=idx,
-                          parsed_xml=self.parsed_xml,
-                          icon_dict=self.data['defaults']['icon_match']
+                          columns=columns,
+                          icon_dict=self.data['defaults']['icon_match'],
+                          label=label,
+                          icons=self.icons
                          )
       logging.info('Populating the day\'s forecast dictionary for day %s', idx)
       if today.populate_day_dict():
-        self.forecast.append(today.fcd)
+        forecast.append(today.fcd)
       else:
         logging.warn('Error parsing forecast XML. Forecast is NONE.')
         return None
 
-    return self.forecast
+    return forecast
 
 
-  def concat_forecast(self, bs_obj):
+  def parse_point_forecasts(self):
     """
-    Cycle through tag attrs, filter out the "none" values, and string
-    together the results into a quasi-sentence forecast.
+    Fan the same DWML document out to each of the forecast_points, writing
+    forecast_<name>.json (and <name>_temp/precip_plus_N.svg icons) for each.
     """
-
-    result = []
-    for i in bs_obj.attrs.keys():
-      if bs_obj[i] == "none":
+    if self.dwml is None or not self.points:
+      return self.point_forecasts
+    locations = self.dwml.locations()[1:]
+    for point, location in zip(self.points, locations):
+      name = point['name']
+      logging.info('Populating the forecast for %s (%s)', name, location)
+      forecast = self.build_days(location, label=name)
+      if forecast is None:
         continue
-      result.append(bs_obj[i].strip())
-
-    return " ".join(result)
+      self.point_forecasts[name] = forecast
+      write_json(forecast, outputdir=self.data['output_dir'],
+                 filename='forecast_{0}.json'.format(name))
+    if len(locations) < len(self.points):
+      logging.warn('Forecast returned %s of %s extra points.', len(locations), len(self.points))
+    return self.point_forecasts
 
 
   def write_forecast(self, outputdir='/tmp/', filename='forecast.txt'):
@@ -311,6 +339,133 @@ class Forecast(object):
 
 
 
+class TimeSeriesForecast(object):
+  """
+  The NDFD time-series product (hourly temperature, dewpoint, wind, sky
+  cover, PoP and QPF) for a meteogram, kept as NumPy arrays on one hourly
+  axis, with derived quantities computed for the whole series at once and
+  written out as a single columnar meteogram.json.
+  """
+
+  def __init__(self, data):
+    self.data = data
+    self.defaults = data['defaults']
+    self.times = None
+    self.columns = dict()
+    self.units = dict()
+
+
+  def get(self):
+    """
+    A roll-up (convenience) function to "just get everything."
+    """
+    if self.get_timeseries() is None:
+      return False
+    self.derive()
+    return self.write_meteogram()
+
+
+  def get_timeseries(self):
+    """
+    Request the time-series product for the next meteogram_days days and
+    put each element on the hourly axis.
+    """
+    begin = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    end = begin + timedelta(days=self.defaults.get('meteogram_days', 7))
+    payload = {'lat': self.data['lat'],
+               'lon': self.data['lon'],
+               'product': 'time-series',
+               'begin': begin.strftime('%Y-%m-%dT%H:%M:%S'),
+               'end': end.strftime('%Y-%m-%dT%H:%M:%S'),
+               'Unit': 'e'
+              }
+    for element in self.defaults['timeseries_elements']:
+      payload[element] = element
+
+    try:
+      retval = requests.get(url=self.defaults['timeseries_url'],
+                            params=payload,
+                            verify=True,
+                            timeout=20
+                           )
+    except requests.exceptions.RequestException as exc:
+      logging.error('Time-series request failed: %s.', exc)
+      return None
+    if retval.status_code != 200:
+      logging.error('Cannot retrieve time-series forecast -- server returned %s', retval)
+      return None
+
+    try:
+      dwml = DWML(retval.content)
+    except etree.XMLSyntaxError as exc:
+      logging.error('Unable to parse the time-series XML: %s', exc)
+      return None
+    if dwml.error:
+      logging.warn('Server returned 200 but had errors:\n%s', dwml.error)
+      return None
+
+    self.times, columns, units = dwml.timeseries()
+    for name, column in columns.items():
+      key = TIMESERIES_NAMES.get(name, name)
+      self.columns[key] = column
+      self.units[key] = units[name]
+    logging.info('Time-series forecast: %s hours, %s elements.', len(self.times), len(columns))
+    return self.times
+
+
+  def derive(self):
+    """
+    Wind in mph, Beaufort number, cardinal direction, dewpoint depression
+    and a feels-like temperature (heat index at or above 80 F, wind chill at
+    or below 50 F with wind over 3 mph), all vectorized.
+    """
+    temp = self.columns.get('temperature')
+    if 'wind' in self.columns:
+      wind_mph = units.convert_array(self.columns['wind'], 'kt', 'mph')
+      wind_mph[wind_mph == units.MISSING] = np.nan
+      self.columns['wind_mph'] = wind_mph
+      self.units['wind_mph'] = 'mph'
+      self.columns['beaufort'] = derived.beaufort(wind_mph).astype(float)
+      self.columns['beaufort'][np.isnan(wind_mph)] = np.nan
+    if 'wind_direction' in self.columns:
+      self.columns['wind_cardinal'] = derived.cardinal_direction(self.columns['wind_direction'])
+    if temp is None:
+      return self.columns
+
+    if 'dewpoint' in self.columns:
+      self.columns['dewpoint_depression'] = derived.dewpoint_depression(temp, self.columns['dewpoint'])
+      self.units['dewpoint_depression'] = self.units.get('temperature')
+
+    feels_like = temp.copy()
+    with np.errstate(invalid='ignore'):
+      if 'humidity' in self.columns:
+        hot = temp >= 80.0
+        feels_like[hot] = derived.heat_index(temp, self.columns['humidity'])[hot]
+      if 'wind_mph' in self.columns:
+        cold = (temp <= 50.0) & (self.columns['wind_mph'] > 3.0)
+        feels_like[cold] = derived.wind_chill(temp, self.columns['wind_mph'])[cold]
+    self.columns['feels_like'] = feels_like
+    self.units['feels_like'] = self.units.get('temperature')
+    return self.columns
+
+
+  def write_meteogram(self, filename='meteogram.json'):
+    """
+    Write the whole series as one compact, columnar JSON document: a list
+    of epoch times plus one list per element (null where missing).
+    """
+    series = dict()
+    for key, column in self.columns.items():
+      if column.dtype == object:
+        series[key] = column.tolist()
+      else:
+        rounded = np.round(column, 1)
+        series[key] = [None if np.isnan(value) else value for value in rounded.tolist()]
+
+    meteogram = dict(time=self.times.tolist(), units=self.units, series=series)
+    return write_json(meteogram, outputdir=self.data['output_dir'], filename=filename)
+
+
 class ZoneForecast(object):
   """
   Pull the Zone forecast for the next 5-7 days and parse it into a text
@@ -318,6 +473,9 @@ class ZoneForecast(object):
   Zone lists can be found on the NWS website.
   Zone forecasts are provided by regional NWS stations, like FWD.
   https://forecast.weather.gov/product.php?site=NWS&product=ZFP&issuedby=FWD
+
+  The office's product is fetched and indexed by UGC zone code once, so any
+  number of zones (settings: forecast_zones) are resolved by lookup.
   """
 
   def __init__(self, data):
@@ -325,83 +483,83 @@ class ZoneForecast(object):
     self.zonef = list()
     self.data = data
     self.zone = data['forecast_zone']
+    self.zones = [self.zone] + [zone for zone in data.get('forecast_zones') or []
+                                if zone != self.zone]
     self.issuedby = data['nws_abbr']
     self.output_dir = data['output_dir']
     self.forecasturl = data['defaults']['afd_url']
-    self.relevant = list()
-    self.parsed_xml = ''
+    self.relevant = dict()
+    self.zone_forecasts = dict()
+    self.product = None
 
   def get(self):
     """
-    A roll-up (convenience) function to "just get everything."
+    A roll-up (convenience) function to "just get everything." A zone
+    forecast product that has not been reissued is not parsed again.
     """
     self.get_zone_forecast()
-    self.parse_zone_forecast()
+    if self.relevant:
+      self.parse_zone_forecast()
+      self.product.save_result(self.zone_forecasts)
     self.write_zone_forecast()
     return True
 
 
   def get_zone_forecast(self):
     """
-    Retrieve and extract the zone forecast product text.
+    Retrieve the zone forecast product and find the segment for each
+    configured zone. If the product has not been reissued, the cached
+    forecasts are used instead.
     """
-    payload = {'site': 'NWS', 'product':'ZFP', 'issuedby': self.issuedby}
-    try:
-      retval = requests.get(url=self.forecasturl,
-                            params=payload,
-                            verify=True,
-                            timeout=10
-                           )
-    except requests.exceptions.ReadTimeout as exc:
-      logging.error('Request timed out or could not be found: %s.', exc)
+    self.product = TextProduct(self.data, 'ZFP', self.issuedby)
+    relevant = self.product.fetch()
+    if relevant is None:
+      logging.error('No zone forecast text. Returning -None-')
       return None
-
-    if retval.status_code == 200:
-      zone_forecast = retval.text
-      logging.info('Forecast request returned HTTP response code: %s', retval)
-      self.parsed_xml = BeautifulSoup(zone_forecast, 'lxml')
-
-      if self.parsed_xml.find('error'):
-        logging.warn('Server returned 200 but had errors:\n%s', self.parsed_xml)
-        logging.info('Submitted:\nURL: %s\nPayload: %s',
-                     self.data['defaults']['afd_url'], str(payload))
-        return None
-    relevant = self.parsed_xml.find("pre").text
     logging.debug('The forecast text has %s characters', len(relevant))
-    rlist = relevant.split('''$$''')
-    for i in rlist:
-      if re.search(self.zone, i):
-        logging.debug('Found requested forecast: %s', i)
-        self.relevant.append(i)
-        break
+
+    cached = self.product.cached_result()
+    if cached is not None and all([zone in cached for zone in self.zones]):
+      self.zone_forecasts = dict([(zone, cached[zone]) for zone in self.zones])
+      self.zonef = self.zone_forecasts[self.zone]
+      return self.relevant
+
+    sections = list(segment(relevant))
+    index = zone_index(sections)
+    logging.debug('The product covers %s zones.', len(index))
+    for zone in self.zones:
+      if zone not in index:
+        logging.warn('No forecast for zone %s in the %s product.', zone, self.issuedby)
+        continue
+      self.relevant[zone] = [section for section in sections
+                             if section.block == index[zone]]
 
     return self.relevant
 
 
   def parse_zone_forecast(self):
     """
-    Pull the forecast text out, then assign each element into a list of
-    neatly filtered forecasts.
+    Assign each titled section of each zone's segment into a list of
+    neatly filtered [period, forecast] pairs. Zones that share a segment
+    share one parse.
     """
-    lines = self.relevant[0]
-    lines = re.sub(r'\n', 'LINEBREAK', lines)
-    lines = re.sub(r'\.([\w\s]+)\.\.\.', '\n\nONEDAY\\1ONEDAY', lines)
-    # logging.debug('Forecast text: %s', lines)
-    forecasts = lines.split('\n')
-    for eachf in forecasts:
-      if re.search(r'^\s*$', eachf):
-        continue
-      eachf = re.sub('LINEBREAK', ' ', eachf)
-      if re.search(r'^ONEDAY([\w\s]+)ONEDAY', eachf):
-        day = re.search(r'^ONEDAY([\w\s]+)ONEDAY', eachf).group(1)
-        forecast = re.sub(day, '', eachf)
-        forecast = re.sub('ONEDAY', '', forecast)
-        forecast = re.sub(r'\s*$', '', forecast)
-        logging.info('%s: %s', day, forecast)
-        if re.search(r'^\s*$', forecast):
-          continue
-        self.zonef.append([day, forecast])
-
+    parsed = dict()
+    for zone, sections in self.relevant.items():
+      block = sections[0].block
+      if block not in parsed:
+        parsed[block] = list()
+        for section in sections:
+          if section.title is None:
+            continue
+          forecast = flatten(section.body)
+          logging.debug('%s %s: %s', zone, section.title, forecast)
+          if forecast:
+            parsed[block].append([section.title, forecast])
+      self.zone_forecasts[zone] = parsed[block]
+
+    for zone in self.zones:
+      self.zone_forecasts.setdefault(zone, list())
+    self.zonef = self.zone_forecasts[self.zone]
     return True
 
 
@@ -411,4 +569,6 @@ class ZoneForecast(object):
     """
     logging.info('Writing zone forecast out to zoneforecast.json.')
     write_json(self.zonef, outputdir=self.output_dir, filename='zoneforecast.json')
+    logging.info('Writing %s zone forecasts out to zoneforecasts.json.', len(self.zone_forecasts))
+    write_json(self.zone_forecasts, outputdir=self.output_dir, filename='zoneforecasts.json')
     return True
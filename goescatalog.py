@@ -0,0 +1,167 @@
+"""
+goescatalog.py: an SQLite catalog of the GOES images in output_dir, keyed by
+satellite, sector, band, resolution and scan time.
+
+"Is the newest frame already here?" becomes one indexed lookup instead of a
+download, and old frames are found with a range query on scan time rather
+than by listing and pattern-matching the whole directory.
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import time
+import sqlite3
+import calendar
+import logging
+import threading
+from datetime import datetime
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+  sat TEXT,
+  sector TEXT,
+  band TEXT,
+  resolution TEXT,
+  epoch INTEGER,
+  filename TEXT,
+  fetched INTEGER,
+  PRIMARY KEY (sat, sector, band, resolution, epoch)
+);
+CREATE INDEX IF NOT EXISTS images_epoch ON images (epoch);
+'''
+
+# e.g. 20241501205_GOES16-ABI-sp-GEOCOLOR-2400x2400.jpg
+GOES_IMAGE = re.compile(r'^(\d{11})_GOES(\d+)-ABI-([A-Za-z0-9]+)-(.+)-(\d+x\d+)\.jpg$')
+
+
+def parse_image_name(filename):
+  """
+  (sat, sector, band, resolution, epoch) for a GOES image file name, or
+  None if the name does not follow the goes_img pattern.
+  """
+  match = GOES_IMAGE.match(os.path.basename(filename))
+  if not match:
+    return None
+  stamp, sat, sector, band, resolution = match.groups()
+  scan = datetime.strptime(stamp, '%Y%j%H%M')
+  return sat, sector, band, resolution, calendar.timegm(scan.timetuple())
+
+
+class GoesCatalog(object):
+  """
+  One row per image file. The connection may be shared by the threads of
+  a multi-band download; every statement runs under one lock.
+  """
+
+  def __init__(self, path, image_dir, retention_days=3):
+    self.path = path
+    self.image_dir = image_dir
+    self.retention = int(retention_days * 86400)
+    self.conn = None
+    self.lock = threading.Lock()
+
+
+  @classmethod
+  def from_settings(cls, data):
+    """
+    Build the catalog from the settings/defaults dict.
+    """
+    path = data.get('goes_catalog_file', 'goes_catalog.sqlite')
+    if not os.path.isabs(path):
+      path = os.path.join(data['output_dir'], path)
+    return cls(path, data['output_dir'],
+               retention_days=data['defaults'].get('goes_retention_days', 3))
+
+
+  def open(self):
+    """
+    Connect and create the schema. A new catalog is filled from the image
+    files already in the directory.
+    """
+    if self.conn is not None:
+      return self.conn
+    self.conn = sqlite3.connect(self.path, check_same_thread=False)
+    self.conn.executescript(SCHEMA)
+    if self.conn.execute('SELECT COUNT(*) FROM images').fetchone()[0] == 0:
+      self.scan()
+    return self.conn
+
+
+  def close(self):
+    """
+    Commit and close the database connection.
+    """
+    if self.conn is not None:
+      self.conn.commit()
+      self.conn.close()
+      self.conn = None
+
+
+  def scan(self):
+    """
+    Catalog every GOES image file in the image directory.
+    """
+    added = 0
+    for filename in os.listdir(self.image_dir):
+      if self.add(filename, commit=False):
+        added = added + 1
+    self.conn.commit()
+    if added:
+      logging.info('Cataloged %s existing GOES images.', added)
+    return added
+
+
+  def has(self, filename):
+    """
+    True if this image is cataloged and its file is still on disk.
+    """
+    key = parse_image_name(filename)
+    if key is None:
+      return False
+    self.open()
+    with self.lock:
+      row = self.conn.execute('SELECT filename FROM images WHERE sat = ? AND sector = ? '
+                              'AND band = ? AND resolution = ? AND epoch = ?', key).fetchone()
+    return row is not None and os.path.exists(os.path.join(self.image_dir, row[0]))
+
+
+  def add(self, filename, now=None, commit=True):
+    """
+    Catalog one image file. Returns False for names that are not GOES images.
+    """
+    key = parse_image_name(filename)
+    if key is None:
+      return False
+    self.open()
+    with self.lock:
+      self.conn.execute('INSERT OR REPLACE INTO images '
+                        '(sat, sector, band, resolution, epoch, filename, fetched) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        key + (os.path.basename(filename), int(now or time.time())))
+      if commit:
+        self.conn.commit()
+    return True
+
+
+  def prune(self, now=None):
+    """
+    Delete images (files and rows) scanned before the retention period,
+    oldest first. Returns the number removed.
+    """
+    cutoff = int(now or time.time()) - self.retention
+    self.open()
+    with self.lock:
+      rows = self.conn.execute('SELECT filename FROM images WHERE epoch < ? ORDER BY epoch',
+                               (cutoff,)).fetchall()
+      for (filename,) in rows:
+        try:
+          os.remove(os.path.join(self.image_dir, filename))
+        except OSError as exc:
+          logging.debug('Unable to remove %s: %s', filename, exc)
+      self.conn.execute('DELETE FROM images WHERE epoch < ?', (cutoff,))
+      self.conn.commit()
+    if rows:
+      logging.info('Removed %s outdated GOES images.', len(rows))
+    return len(rows)
@@ -0,0 +1,245 @@
+"""
+history.py: an append-only archive of merged current observations, kept in
+SQLite, with rolling-window statistics (min/max/mean) and pressure tendency.
+Each window's statistics come from one aggregate query over a range of the
+epoch primary key, so the cost of an append does not depend on how much
+history the process has seen (each cron run is a fresh process).
+"""
+
+from __future__ import print_function
+
+import os
+import time
+import sqlite3
+import logging
+from record import ObsRecord, FIELDS
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS observations (
+  epoch INTEGER PRIMARY KEY,
+  timestamp TEXT,
+  temperature REAL,
+  dewpoint REAL,
+  humidity REAL,
+  pressure REAL,
+  wind REAL,
+  wind_direction REAL,
+  gusts REAL,
+  windchill REAL,
+  heatindex REAL,
+  visibility REAL,
+  textdescription TEXT,
+  temperature_units TEXT,
+  pressure_units TEXT,
+  wind_units TEXT,
+  visibility_units TEXT
+);
+CREATE TABLE IF NOT EXISTS trends (
+  name TEXT PRIMARY KEY,
+  value REAL,
+  updated INTEGER
+);
+'''
+
+COLUMNS = ', '.join(['epoch', 'timestamp'] + list(FIELDS) +
+                    ['textdescription', 'temperature_units', 'pressure_units', 'wind_units',
+                     'visibility_units'])
+
+INSERT = 'INSERT OR IGNORE INTO observations ({0}) VALUES ({1})'.format(
+    COLUMNS, ', '.join(['?'] * (len(FIELDS) + 7)))
+
+
+# Min/max/mean of a compass direction mean nothing (350 and 10 average to
+# 180), so wind direction is archived but left out of the trends.
+TREND_FIELDS = [field for field in FIELDS if field != 'wind_direction']
+
+WINDOW_STATS = 'SELECT {0} FROM observations WHERE epoch >= ?'.format(
+    ', '.join(['COUNT({0}), MIN({0}), MAX({0}), AVG({0})'.format(field)
+               for field in TREND_FIELDS]))
+
+FIRST_PRESSURE = ('SELECT pressure FROM observations WHERE epoch >= ? AND pressure IS NOT NULL '
+                  'ORDER BY epoch {0} LIMIT 1')
+
+
+class ObservationHistory(object):
+  """
+  Append-only SQLite archive of merged observations (one row per observation
+  timestamp, in the ObsRecord layout), plus a small trends table the Flask
+  app can read directly.
+  """
+
+  def __init__(self, path, retention_days=30, windows=None, tendency_window='3h'):
+    self.path = path
+    self.retention = int(retention_days * 86400)
+    self.windows = windows or {'3h': 3 * 3600, '24h': 24 * 3600}
+    self.tendency_window = tendency_window
+    self.conn = None
+
+
+  @classmethod
+  def from_settings(cls, data):
+    """
+    Build the archive from the settings/defaults dict.
+    """
+    path = data.get('history_file', 'observations.sqlite')
+    if not os.path.isabs(path):
+      path = os.path.join(data['output_dir'], path)
+    return cls(path,
+               retention_days=data['defaults'].get('history_retention_days', 30),
+               windows=data['defaults'].get('history_windows'))
+
+
+  def open(self):
+    """
+    Connect, and create the schema if needed.
+    """
+    if self.conn is not None:
+      return self.conn
+    self.conn = sqlite3.connect(self.path)
+    self.conn.execute('PRAGMA journal_mode=WAL')
+    self.conn.executescript(SCHEMA)
+    self.migrate()
+    return self.conn
+
+
+  def migrate(self):
+    """
+    Add any columns that archives created by older versions lack.
+    """
+    existing = [row[1] for row in self.conn.execute('PRAGMA table_info(observations)')]
+    for field in FIELDS:
+      if field not in existing:
+        logging.info('Adding column %s to the observation archive.', field)
+        self.conn.execute('ALTER TABLE observations ADD COLUMN {0} REAL'.format(field))
+    if 'visibility_units' not in existing:
+      logging.info('Adding column visibility_units to the observation archive.')
+      self.conn.execute('ALTER TABLE observations ADD COLUMN visibility_units TEXT')
+
+
+  def close(self):
+    """
+    Commit and close the database connection.
+    """
+    if self.conn is not None:
+      self.conn.commit()
+      self.conn.close()
+      self.conn = None
+
+
+  def make_row(self, obs):
+    """
+    Flatten an observation (an ObsRecord, or a WeatherDict.obs dict) into an
+    archive row.
+    """
+    if not isinstance(obs, ObsRecord):
+      obs = ObsRecord.from_obs(obs)
+    if obs.epoch is None:
+      return None
+    return obs.as_row()
+
+
+  def append(self, obs):
+    """
+    Archive one merged observation (ObsRecord or WeatherDict.obs), refresh
+    the trends table, and enforce the retention limit.
+    """
+    row = self.make_row(obs)
+    if row is None:
+      logging.error('Observation has no usable timestamp; not archiving it.')
+      return False
+
+    self.open()
+    cursor = self.conn.execute(INSERT, row)
+    if not cursor.rowcount:
+      logging.info('Observation at %s is already archived.', row[1])
+
+    self.prune(row[0])
+    self.write_trends()
+    self.conn.commit()
+    return bool(cursor.rowcount)
+
+
+  def append_many(self, records):
+    """
+    Bulk-insert many observations (e.g. from a backfill) in one transaction.
+    Rows already archived are left alone.
+    """
+    rows = [row for row in [self.make_row(obs) for obs in records] if row is not None]
+    if not rows:
+      return 0
+
+    self.open()
+    before = self.conn.total_changes
+    self.conn.executemany(INSERT, rows)
+    added = self.conn.total_changes - before
+    logging.info('Archived %s of %s observations.', added, len(rows))
+
+    self.prune(max([row[0] for row in rows]))
+    self.write_trends()
+    self.conn.commit()
+    return added
+
+
+  def prune(self, now):
+    """
+    Delete rows older than the retention period.
+    """
+    removed = self.conn.execute('DELETE FROM observations WHERE epoch < ?',
+                                (now - self.retention,)).rowcount
+    if removed:
+      logging.info('Removed %s observations older than the retention period.', removed)
+    return removed
+
+
+  def trends(self):
+    """
+    Return the rolling statistics as a flat dict, e.g. 'temperature_24h_max',
+    plus 'pressure_tendency_3h' (latest minus earliest pressure in the window).
+    Windows end at the newest archived observation.
+    """
+    result = {}
+    latest = self.conn.execute('SELECT MAX(epoch) FROM observations').fetchone()[0]
+    if latest is None:
+      return result
+
+    for name, span in self.windows.items():
+      row = self.conn.execute(WINDOW_STATS, (latest - span,)).fetchone()
+      for idx, field in enumerate(TREND_FIELDS):
+        count, low, high, mean = row[4 * idx:4 * idx + 4]
+        if not count:
+          continue
+        for key, value in [('min', low), ('max', high), ('mean', mean), ('count', count)]:
+          result['{0}_{1}_{2}'.format(field, name, key)] = value
+
+    span = self.windows.get(self.tendency_window)
+    if span is not None:
+      first = self.conn.execute(FIRST_PRESSURE.format('ASC'), (latest - span,)).fetchone()
+      last = self.conn.execute(FIRST_PRESSURE.format('DESC'), (latest - span,)).fetchone()
+      if first is not None and last is not None:
+        result['pressure_tendency_{0}'.format(self.tendency_window)] = last[0] - first[0]
+    return result
+
+
+  def write_trends(self):
+    """
+    Replace the trends table with the current rolling statistics.
+    """
+    now = int(time.time())
+    trends = self.trends()
+    self.conn.execute('DELETE FROM trends')
+    self.conn.executemany('INSERT INTO trends (name, value, updated) VALUES (?, ?, ?)',
+                          [(key, value, now) for key, value in trends.items()])
+    return trends
+
+
+  def recent(self, hours=24):
+    """
+    Return archived observations from the last N hours (relative to the
+    newest row), oldest first, as ObsRecords.
+    """
+    self.open()
+    cursor = self.conn.execute('SELECT {0} FROM observations WHERE epoch >= '
+                               '(SELECT MAX(epoch) FROM observations) - ? '
+                               'ORDER BY epoch'.format(COLUMNS),
+                               (int(hours * 3600),))
+    return [ObsRecord.from_row(row) for row in cursor]
@@ -0,0 +1,122 @@
+"""
+iconcache.py: a render cache for the small forecast SVGs (high/low temps,
+morning/evening precip chances).
+
+Each icon is rendered once, into a cache directory under output_dir, under
+the SHA-1 of its inputs (renderer, values and size). The published name
+(today_temp_plus_0.svg, ...) is then hard-linked to the cached file, or
+copied where links are not possible, and atomically renamed into place --
+and only when its content actually differs. Since the same handful of
+temperatures and PoP values recur day after day, most runs render nothing
+and write nothing.
+
+Published files must only ever be replaced, never written in place, since
+they can share an inode with the cache. With no cache directory (an empty
+icon_cache_dir), the cache is disabled and every icon is rendered straight
+to its target.
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import filecmp
+import hashlib
+import logging
+
+
+class IconCache(object):
+  """
+  Rendered icons keyed by the hash of their inputs. A cache_dir of None
+  disables the cache.
+  """
+
+  def __init__(self, cache_dir):
+    self.cache_dir = cache_dir
+    self.rendered = 0
+    self.published = 0
+
+
+  @classmethod
+  def from_settings(cls, data):
+    """
+    Build the cache from the settings/defaults dict.
+    """
+    cache_dir = data['defaults'].get('icon_cache_dir', 'iconcache')
+    if not cache_dir:
+      return cls(None)
+    return cls(os.path.join(data['output_dir'], cache_dir))
+
+
+  @staticmethod
+  def key(renderer, args, kwargs):
+    """
+    Hash of everything that determines an icon's content.
+    """
+    inputs = repr((renderer.__name__, tuple(args), sorted(kwargs.items())))
+    return hashlib.sha1(inputs.encode('utf-8')).hexdigest()
+
+
+  def path(self, digest):
+    """
+    The cache file for a key.
+    """
+    return os.path.join(self.cache_dir, '{0}.svg'.format(digest))
+
+
+  def get(self, renderer, *args, **kwargs):
+    """
+    Path of the cached icon for these inputs, rendering it first if it is
+    not in the cache. The renderer is one of the weathersvg functions that
+    take filename= and outputdir= keywords.
+    """
+    digest = self.key(renderer, args, kwargs)
+    cached = self.path(digest)
+    if os.path.exists(cached):
+      return cached
+
+    if not os.path.isdir(self.cache_dir):
+      os.makedirs(self.cache_dir)
+    partial = '{0}.{1}.tmp'.format(digest, os.getpid())
+    renderer(*args, filename=partial, outputdir=self.cache_dir, **kwargs)
+    os.rename(os.path.join(self.cache_dir, partial), cached)
+    self.rendered = self.rendered + 1
+    logging.debug('Rendered %s%s into the icon cache.', renderer.__name__, args)
+    return cached
+
+
+  def publish(self, cached, target):
+    """
+    Put a cached icon at its target path, unless the same content is
+    already there. Returns True if the target was replaced.
+    """
+    if os.path.exists(target):
+      try:
+        if os.path.samefile(cached, target) or filecmp.cmp(cached, target, shallow=False):
+          return False
+      except OSError as exc:
+        logging.debug('Unable to compare %s with the cache: %s', target, exc)
+
+    partial = '{0}.{1}.tmp'.format(target, os.getpid())
+    if os.path.exists(partial):
+      os.remove(partial)
+    try:
+      os.link(cached, partial)
+    except OSError:
+      shutil.copyfile(cached, partial)
+    os.rename(partial, target)
+    self.published = self.published + 1
+    return True
+
+
+  def render(self, target, renderer, *args, **kwargs):
+    """
+    Render (or reuse) an icon and publish it at target.
+    """
+    if self.cache_dir is None:
+      renderer(*args, filename=os.path.basename(target),
+               outputdir=os.path.dirname(target), **kwargs)
+      self.rendered = self.rendered + 1
+      self.published = self.published + 1
+      return True
+    return self.publish(self.get(renderer, *args, **kwargs), target)
@@ -0,0 +1,170 @@
+"""
+iconmatch.py: match forecast, observation and alert descriptions to weather
+icons, using the phrase lists of icon_match in defaults.yml.
+
+The phrase lists are compiled once into a hash map of normalized phrase ->
+icon for exact matches, and into an Aho-Corasick automaton that finds every
+listed phrase inside a longer description in a single pass over it. So a
+description like 'Chance Showers And Thunderstorms then Sunny' still gets
+an icon: the longest phrase found wins ('chance showers' over 'sunny').
+Results are kept in a small LRU memo, since the same few descriptions recur
+all day.
+"""
+
+from __future__ import print_function
+
+import re
+import logging
+from collections import deque, OrderedDict
+
+NO_ICON = 'wi-na.svg'
+
+WHITESPACE = re.compile(r'\s+')
+
+_MATCHERS = {}
+
+
+def normalize(phrase):
+  """
+  Lowercase a phrase and collapse its whitespace.
+  """
+  return WHITESPACE.sub(' ', phrase.strip().lower())
+
+
+def is_boundary(text, index):
+  """
+  True if text[index] is outside the text or not a letter or digit, i.e. a
+  match ending or starting next to it is a whole word.
+  """
+  return index < 0 or index >= len(text) or not text[index].isalnum()
+
+
+class IconMatcher(object):
+  """
+  Phrase -> icon lookups compiled from an icon_match dict. Where a phrase is
+  listed under more than one icon, the first icon (in file order) keeps it,
+  as it did with the old linear scan.
+  """
+
+  def __init__(self, icon_match, cache_size=512):
+    self.exact = dict()
+    for icon, phrases in icon_match.items():
+      for phrase in phrases:
+        self.exact.setdefault(normalize(phrase), icon)
+
+    # Aho-Corasick trie: goto transitions, failure links, and the phrases
+    # (by length) that end at each state.
+    self.goto = [dict()]
+    self.fail = [0]
+    self.output = [[]]
+    for phrase in self.exact:
+      self.add_phrase(phrase)
+    self.link_failures()
+    self.cache_size = cache_size
+    self.memo = OrderedDict()
+
+
+  def add_phrase(self, phrase):
+    """
+    Add one normalized phrase to the trie.
+    """
+    state = 0
+    for char in phrase:
+      following = self.goto[state].get(char)
+      if following is None:
+        following = len(self.goto)
+        self.goto[state][char] = following
+        self.goto.append(dict())
+        self.fail.append(0)
+        self.output.append([])
+      state = following
+    self.output[state].append(len(phrase))
+
+
+  def link_failures(self):
+    """
+    Breadth-first pass setting each state's failure link to the longest
+    proper suffix that is also in the trie, and merging its outputs.
+    """
+    queue = deque(self.goto[0].values())
+    while queue:
+      state = queue.popleft()
+      for char, following in self.goto[state].items():
+        queue.append(following)
+        fallback = self.fail[state]
+        while fallback and char not in self.goto[fallback]:
+          fallback = self.fail[fallback]
+        self.fail[following] = self.goto[fallback].get(char, 0)
+        if self.fail[following] == following:
+          self.fail[following] = 0
+        self.output[following] = self.output[following] + self.output[self.fail[following]]
+
+
+  def find_longest(self, text):
+    """
+    The longest listed phrase that occurs in text as whole words (the
+    earliest, on a tie), or None.
+    """
+    best = None
+    state = 0
+    for index, char in enumerate(text):
+      while state and char not in self.goto[state]:
+        state = self.fail[state]
+      state = self.goto[state].get(char, 0)
+      for length in self.output[state]:
+        start = index - length + 1
+        if best is not None and length <= len(best):
+          continue
+        if is_boundary(text, start - 1) and is_boundary(text, index + 1):
+          best = text[start:index + 1]
+    return best
+
+
+  def match(self, description):
+    """
+    lookup(), memoized. When the memo is full, the least recently used
+    description is dropped.
+    """
+    try:
+      icon = self.memo.pop(description)
+    except KeyError:
+      icon = self.lookup(description)
+      if len(self.memo) >= self.cache_size:
+        self.memo.popitem(last=False)
+    self.memo[description] = icon
+    return icon
+
+
+  def lookup(self, description):
+    """
+    The icon for a description: an exact phrase match, else the icon of the
+    longest phrase inside it, else NO_ICON.
+    """
+    if not description:
+      logging.warning('No description available for icon match. Returning NA.')
+      return NO_ICON
+    text = normalize(description)
+    icon = self.exact.get(text)
+    if icon is not None:
+      logging.info('Matched "%s"', text)
+      return icon
+
+    phrase = self.find_longest(text)
+    if phrase is not None:
+      logging.info('Matched "%s" within "%s"', phrase, text)
+      return self.exact[phrase]
+
+    logging.warning('Unable to match "%s"', text)
+    return NO_ICON
+
+
+def icon_matcher(icon_match):
+  """
+  The IconMatcher for an icon_match dict, compiled on first use.
+  """
+  cached = _MATCHERS.get(id(icon_match))
+  if cached is not None and cached[0] is icon_match:
+    return cached[1]
+  matcher = IconMatcher(icon_match)
+  _MATCHERS[id(icon_match)] = (icon_match, matcher)
+  return matcher
@@ -4,10 +4,62 @@ imagery.py: a Class for obtaining weather satellite imagery from NOAA.
 
 import os
 import re
+import shutil
+import sqlite3
 import logging
+from contextlib import closing
+from multiprocessing.pool import ThreadPool
 import requests
 from bs4 import BeautifulSoup
 import weather_functions as wf
+from goescatalog import GoesCatalog
+
+# Bytes read from the network and written to disk at a time.
+CHUNK_SIZE = 64 * 1024
+
+
+def stream_to_file(url, path, verify=True, timeout=60, chunk_size=CHUNK_SIZE):
+  """
+  Stream a download to path through a temporary file in the same directory,
+  fsync it, and rename it into place, so the whole file is never held in
+  memory and readers never see a partial image. Returns the HTTP status
+  code (the file is only written on 200).
+  """
+  partial = '{0}.part'.format(path)
+  with closing(requests.get(url, verify=verify, timeout=timeout, stream=True)) as response:
+    if response.status_code != 200:
+      return response.status_code
+    try:
+      with open(partial, 'wb') as outfile:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+          outfile.write(chunk)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+      os.rename(partial, path)
+    except (IOError, OSError, requests.exceptions.RequestException):
+      if os.path.exists(partial):
+        os.remove(partial)
+      raise
+  return 200
+
+
+def link_into_place(source, path):
+  """
+  Point path at the same file as source: a hard link (or, across file
+  systems, a copy) under a temporary name, renamed over path in one step.
+  """
+  if os.path.exists(path) and os.path.samefile(source, path):
+    return path
+  partial = '{0}.part'.format(path)
+  if os.path.exists(partial):
+    os.remove(partial)
+  try:
+    os.link(source, partial)
+  except OSError:
+    shutil.copyfile(source, partial)
+  os.rename(partial, path)
+  return path
+
 
 class Imagery(object):
   """
@@ -15,13 +67,14 @@ class Imagery(object):
 
   """
 
-  def __init__(self, band='', data=''):
+  def __init__(self, band='', data='', catalog=None):
     """
     Initial parameters are simple, but the data dictionary holds a few
-    important variables.
+    important variables. The image catalog may be shared between bands.
     """
     self.band = band
     self.data = data
+    self.catalog = catalog or GoesCatalog.from_settings(data)
     self.res = data['goes_res']
     self.url = data['defaults']['goes_url'].format(sat=data['goes_sat'],
                                                    sector=data['goes_sector'],
@@ -85,6 +138,8 @@ class Imagery(object):
     except Exception as exc:
       logging.error('Exception: %s', exc)
       return False
+    finally:
+      self.catalog.close()
 
 
   def get_daily_list(self, localyear, localdoy, links):
@@ -169,58 +224,67 @@ class Imagery(object):
     return band_timestamps
 
 
-  def get_goes_image(self, timehhmm):
+  def goes_image_name(self, timehhmm):
     """
-    Retrieve current GOES weather imagery.
+    File name of this band's image at a given (UTC) HHMM.
     """
-    image = self.data['defaults']['goes_img'].format(year=self.today_v['year'],
-                                                     doy=self.today_v['doy'],
-                                                     timeHHMM=timehhmm,
-                                                     sat=self.data['goes_sat'],
-                                                     sector=self.data['goes_sector'],
-                                                     band=self.band,
-                                                     resolution=self.res
-                                                    )
+    return self.data['defaults']['goes_img'].format(year=self.today_v['year'],
+                                                    doy=self.today_v['doy'],
+                                                    timeHHMM=timehhmm,
+                                                    sat=self.data['goes_sat'],
+                                                    sector=self.data['goes_sector'],
+                                                    band=self.band,
+                                                    resolution=self.res
+                                                   )
+
+
+  def get_goes_image(self, timehhmm, current=True):
+    """
+    Retrieve current GOES weather imagery, unless the catalog shows that
+    the image is already on disk. With current=True, the image is also
+    linked to goes_current.jpg. Returns the image file name, or None if the
+    server does not have it.
+    """
+    image = self.goes_image_name(timehhmm)
     # image = '20200651806_GOES16-ABI-sp-NightMicrophysics-2400x2400.jpg'
-    returned_val = requests.get(os.path.join(self.url, image), verify=True)
-    with open(os.path.join(self.data['output_dir'], image), 'wb') as satout:
-      satout.write(bytearray(returned_val.content))
-      logging.debug('Writing image %s to path %s', image, self.data['output_dir'])
+    image_path = os.path.join(self.data['output_dir'], image)
+    try:
+      present = self.catalog.has(image)
+    except sqlite3.Error as exc:
+      logging.error('Unable to check the GOES catalog: %s', exc)
+      present = False
 
-    with open(os.path.join(self.data['output_dir'], 'goes_current.jpg'), 'wb') as satout:
-      satout.write(bytearray(returned_val.content))
-      logging.debug('Writing "goes_current.jpg" to path %s', self.data['output_dir'])
+    if present:
+      logging.info('Already have %s; not downloading it again.', image)
+    else:
+      status = stream_to_file(os.path.join(self.url, image), image_path)
+      if status != 200:
+        logging.warn('No %s image at %s: %s', self.band, timehhmm, status)
+        return None
+      logging.debug('Wrote image %s to path %s', image, self.data['output_dir'])
+      try:
+        self.catalog.add(image)
+      except sqlite3.Error as exc:
+        logging.error('Unable to catalog %s: %s', image, exc)
+
+    if current:
+      link_into_place(image_path, os.path.join(self.data['output_dir'], 'goes_current.jpg'))
+      logging.debug('Linked "goes_current.jpg" to %s', image)
 
     return image
 
 
   def goes_cleanup(self):
     """
-    Remove GOES imagery older than two days.
-    GOES image are stored in a format like:
-    YYYYDDDHHMM_GOESNN-ABI-sp-BAND-PIXELSxPIXELS.jpg
-    So at its simplest, take DDD, subtract three, and delete files that match
-    that filename or earlier.
-    Note that on January 1 and 2, the year will need to be changed as well.
+    Remove GOES imagery older than goes_retention_days (three days by
+    default). The catalog finds the old frames by scan time, oldest first,
+    so the directory is not listed.
     """
-    thefiles = [a for a in os.listdir(self.data['output_dir']) if re.search('GOES', a)]
-    today_int = int(self.today_v['doy'])
-    cur_year_int = int(self.today_v['year'])
-    keepme = []
-
-    for i in range(0, 3):
-      # determine appropriate year and day, if needed.
-      leadtag = str('{0}{1}'.format(cur_year_int, (today_int - i)))
-      keepme.extend([a for a in thefiles if re.search(leadtag, a)])
-
-    removeme = [a for a in thefiles if a not in keepme]
     try:
-      [os.remove(b) for b in [os.path.join(self.data['output_dir'], a) for a in removeme]]
-      logging.debug('Removing outdated GOES imagery.')
-    except Exception as exc:
-      logging.error('Exception! %s', exc)
+      self.catalog.prune()
+    except sqlite3.Error as exc:
+      logging.error('Unable to prune the GOES catalog: %s', exc)
       return False
-
     return True
 
 
@@ -231,13 +295,15 @@ class Imagery(object):
     """
     target_url = os.path.join(url, file_to_retrieve)
     logging.info('Retrieving %s and saving to %s', target_url, mapname)
-    response = requests.get(url=target_url, verify=verify)
-    if response.status_code != 200:
-      logging.warn('Response code: %s. Returning False.', response.status_code)
+    try:
+      status = stream_to_file(target_url, os.path.join(self.data['output_dir'], mapname),
+                              verify=verify)
+    except (requests.exceptions.RequestException, IOError, OSError) as exc:
+      logging.error('Unable to retrieve %s: %s', target_url, exc)
+      return False
+    if status != 200:
+      logging.warn('Response code: %s. Returning False.', status)
       return False
-    with open(os.path.join(self.data['output_dir'], mapname), 'wb') as outputfile:
-      outputfile.write(response.content)
-      outputfile.close()
     return True
 
 
@@ -265,3 +331,111 @@ class Imagery(object):
                                  file_to_retrieve=self.data['defaults']['temp_map_file'],
                                  verify=True)
     return return_value
+
+
+class MultiBandImagery(object):
+  """
+  Keep several GOES bands current in one pass. Each band has its own
+  directory on the server, but all bands of a sector are imaged on the same
+  scan times, so only the first (preferred) band's directory is listed; the
+  other bands' images are requested by name for the same timestamp (and
+  their directories listed only if that image is missing). The downloads
+  run in a bounded thread pool, and every band goes into one goes.json.
+  """
+
+  def __init__(self, bands, data=''):
+    self.data = data
+    self.bands = list(bands)
+    self.catalog = GoesCatalog.from_settings(data)
+    self.imagery = [Imagery(band=band, data=data, catalog=self.catalog) for band in self.bands]
+    self.workers = data['defaults'].get('goes_workers', 4)
+    self.goes_current = {'visible': '',
+                         'preferred_band': '',
+                         'image_html': '',
+                         'id': 'sat_image_thumb',
+                         'bands': {}
+                        }
+
+
+  def get_all(self):
+    """
+    The current image of every band, plus the national maps.
+    """
+    self.get_current_images()
+    self.imagery[0].get_forecast_map()
+    self.imagery[0].get_national_temp_map()
+    return True
+
+
+  def latest_timestamp(self, imagery, skip=None):
+    """
+    The most recent HHMM in a band's directory listing (other than skip),
+    or None.
+    """
+    try:
+      imagery.fileslist = imagery.get_goes_list()
+      timestamps = [stamp for stamp in imagery.get_goes_timestamps() if stamp != skip]
+    except Exception as exc:
+      logging.error('Exception when determining current timestamps: %s', exc)
+      return None
+    if not timestamps:
+      logging.error('No current %s images listed.', imagery.band)
+      return None
+    return timestamps[-1]
+
+
+  def fetch_band(self, imagery, timestamp):
+    """
+    Download one band's image for the shared timestamp, falling back to the
+    band's own latest image. Returns (band, image name or None, timestamp);
+    a failed download is logged and leaves the other bands unaffected.
+    """
+    current = imagery is self.imagery[0]
+    image = None
+    try:
+      if timestamp is not None:
+        image = imagery.get_goes_image(timehhmm=timestamp, current=current)
+      if image is None and not current:
+        timestamp = self.latest_timestamp(imagery, skip=timestamp)
+        if timestamp is not None:
+          image = imagery.get_goes_image(timehhmm=timestamp, current=False)
+    except (requests.exceptions.RequestException, IOError, OSError) as exc:
+      logging.error('Unable to retrieve the %s image: %s', imagery.band, exc)
+      return imagery.band, None, timestamp
+    return imagery.band, image, timestamp
+
+
+  def get_current_images(self):
+    """
+    Clean up once, list the preferred band once, download every band
+    concurrently, and write goes.json.
+    """
+    image_html = '<img src="{img}" alt="Current GOES image">'
+    self.imagery[0].goes_cleanup()
+    timestamp = self.latest_timestamp(self.imagery[0])
+    logging.info('Current timestamp: %s', timestamp)
+
+    pool = ThreadPool(max(1, min(self.workers, len(self.imagery))))
+    try:
+      results = pool.map(lambda imagery: self.fetch_band(imagery, timestamp), self.imagery)
+    finally:
+      pool.close()
+      pool.join()
+      self.catalog.close()
+
+    for band, image, band_timestamp in results:
+      if image is None:
+        continue
+      logging.info('retrieved %s', image)
+      img_path = os.path.join(self.data['image_dir'], image)
+      self.goes_current['bands'][band] = {'image': image,
+                                          'timestamp': band_timestamp,
+                                          'image_html': image_html.format(img=img_path)}
+      if band == self.bands[0]:
+        self.goes_current['preferred_band'] = image
+        self.goes_current['image_html'] = image_html.format(img=img_path)
+
+    wf.write_json(self.goes_current,
+                  outputdir=self.data['output_dir'],
+                  filename='goes.json')
+    return bool(self.goes_current['bands'])
@@ -68,7 +68,7 @@ requestg.onload = () => {
       document.getElementById("alert_badge").className = "badge bg-yellow";
       document.getElementById("alert_badge").innerHTML += "Alert";
       for (var somealert of alertdict['alert']) {
-        warning_icon = imgpath + somealert['alert_icon'];
+        warning_icon = iconPath(somealert['alert_icon'], somealert['alert_icon_ref']);
         cardstring = '<div class="modal-body"><table><tr><td>' + addSVGIcon(svgpath=warning_icon, id="", width=40, height=40) + '</td><td><h4>' + somealert['event_type'] + ':</h4></td></tr></table>' + somealert['summary'] + '</div>';
         document.getElementById("alerts_entries").innerHTML += cardstring;
         console.log('Alert: ' + somealert);
@@ -92,7 +92,7 @@ requestg.onload = () => {
       writeWarningsRow();
       for (var i in alertdict['warn']) {
         console.log('Warning list entry: ' + alertdict['warn'][i]['event_type']);
-        warning_icon = imgpath + alertdict['warn'][i]['alert_icon'];
+        warning_icon = iconPath(alertdict['warn'][i]['alert_icon'], alertdict['warn'][i]['alert_icon_ref']);
         writeWarningCard(alertdict['warn'][i], i, warning_icon);
       }
     }
@@ -1,5 +1,16 @@
 
 var imgpath = "static/icons/weather-icons-master/svg/";
+
+// Icons come from the sprite built by build_assets.py (served with the other
+// generated files) when the JSON carries a reference to it. alerts.js and
+// forecast.js load after this file and use iconPath() too.
+var spritepath = "static/photos/";
+function iconPath(name, ref) {
+  if (ref) {
+    return spritepath + ref;
+  }
+  return imgpath + name;
+}
 var radarpath = "static/photos/";
 
 function addSVGIcon(svgpath, id, width, height) {
@@ -93,7 +104,7 @@ request.onload = () => {
     document.getElementById("table1").innerHTML += "<tr><td>Pressure</td><td class=\"paddedCells\">" + curDict["pressure"]["value"].toFixed(2) + " " + curDict["pressure"]["units"] + "</td></tr>";
 
     document.getElementById("cc_col2").innerHTML += table2;
-    document.getElementById("weather_icon_here").innerHTML += addSVGIcon(imgpath + curDict['weather_icon'], id="current_weather_icon", width=70, height=70);
+    document.getElementById("weather_icon_here").innerHTML += addSVGIcon(iconPath(curDict['weather_icon'], curDict['weather_icon_ref']), id="current_weather_icon", width=70, height=70);
     document.getElementById("wind_direction_icon_here").innerHTML += addSVGIcon(imgpath + 'compass.svg', id="current_wind_direction", width=70, height=50);
     var wind_direction_arrow = (curDict['wind_direction']['value']) -180;
     document.getElementById("wind_direction_icon_here").style.transform = "rotate(" + wind_direction_arrow + "deg)";
@@ -110,8 +121,8 @@ request.onload = () => {
     } else {
       bficon = 'wi-wind-beaufort-' + bfscale + '.svg';
     }
-    document.getElementById("beaufort_icon").innerHTML += addSVGIcon(imgpath + bficon, id="current_wind_speed", width=70, height=70);
-    document.getElementById("moonphase").innerHTML += addSVGIcon(imgpath + curDict['moon_icon'], id="current_moon_phase", width=30, height=30);
+    document.getElementById("beaufort_icon").innerHTML += addSVGIcon(iconPath(bficon, curDict['beaufort_icon_ref']), id="current_wind_speed", width=70, height=70);
+    document.getElementById("moonphase").innerHTML += addSVGIcon(iconPath(curDict['moon_icon'], curDict['moon_icon_ref']), id="current_moon_phase", width=30, height=30);
   } else {
     console.log(`error ${request.status} ${request.statusText}`);
   }
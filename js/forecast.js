@@ -44,7 +44,7 @@ function forecastrow(forecast, idx) {
   var icon = "fc_icon_" + idx + "";
   document.getElementById(daystring).innerHTML += forecast[idx].day;
   document.getElementById(summary).innerHTML += forecast[idx].shortcast;
-  document.getElementById(icon).src = "static/icons/weather-icons-master/svg/" + forecast[idx].icon;
+  document.getElementById(icon).src = iconPath(forecast[idx].icon, forecast[idx].icon_ref);
 }
 
 
@@ -64,7 +64,7 @@ function write_one_row(forecast, idx) {
   var precip = "today_precip_plus_" + idx + ".svg";
  
   var subheader = '<div class="d-flex align-items-center"><span><div class="subheader" id="' + daystring + '">' + forecast[idx].day + '</div></span></div>';
-  var weather = '<div class="d-flex align-items-baseline"><span class="bg-gray forecastDiv mr-3" style="--icon-height: ' + height1 + 'px;"><img id="' + icon + '"  src="static/icons/weather-icons-master/svg/' + forecast[idx].icon + '" alt="weather icon daytime" width="' + width1 + '" height="' + height1 + '"></span>';
+  var weather = '<div class="d-flex align-items-baseline"><span class="bg-gray forecastDiv mr-3" style="--icon-height: ' + height1 + 'px;"><img id="' + icon + '"  src="' + iconPath(forecast[idx].icon, forecast[idx].icon_ref) + '" alt="weather icon daytime" width="' + width1 + '" height="' + height1 + '"></span>';
   var temps_pane = '<span class="bg-gray forecastDiv mr-3" style="--icon-height: ' + height1 + 'px;"><img src="static/photos/' + temp + '" alt="weather icon today temperatures" width="' + width1 + '" height="' + height1 + '"></span>';
   var precip_pane = '<span class="forecastDiv" style="--icon-height: ' + height1 + 'px;"> <img src="static/photos/' + precip + '" alt="weather icon today precipitation chances" width="' + width2 + '" height="' + height1  + '"></span></div>';
   var summarytext = '<div class="text-muted" style="font-size: large" id="' + summary + '">' + forecast[idx].shortcast + '</div>';
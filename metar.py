@@ -0,0 +1,201 @@
+"""
+metar.py: a small, pure-Python decoder for the METAR groups this project
+uses (wind and gusts, visibility, present weather, sky cover,
+temperature/dewpoint and altimeter), so that gaps in the api.weather.gov
+JSON can be filled from its own rawMessage without another request.
+"""
+
+from __future__ import division
+
+import re
+import math
+import logging
+
+try:
+  TEXT_TYPES = (str, unicode)
+except NameError:
+  TEXT_TYPES = (str,)
+
+WIND = re.compile(r'^(\d{3}|VRB)(\d{2,3})(?:G(\d{2,3}))?(KT|MPS|KMH)$')
+VARIABLE_WIND = re.compile(r'^\d{3}V\d{3}$')
+VISIBILITY_SM = re.compile(r'^([MP])?(?:(\d+)|(\d+)/(\d+))SM$')
+VISIBILITY_M = re.compile(r'^(\d{4})(?:NDV)?$')
+TEMPERATURE = re.compile(r'^(M?\d{2})/(M?\d{2})?$')
+ALTIMETER = re.compile(r'^([AQ])(\d{4})$')
+PRECISE_TEMPERATURE = re.compile(r'^T([01])(\d{3})(?:([01])(\d{3}))?$')
+SKY = re.compile(r'^(FEW|SCT|BKN|OVC|VV)(\d{3}|///)')
+WEATHER = re.compile(r'^(-|\+|VC)?((?:MI|PR|BC|DR|BL|SH|TS|FZ)*)'
+                     r'((?:DZ|RA|SN|SG|IC|PL|GR|GS|UP|BR|FG|FU|VA|DU|SA|HZ|PY|PO|SQ|FC|SS|DS)*)$')
+PAIRS = re.compile(r'..')
+
+INTENSITY = {'-': 'Light', '+': 'Heavy', '': ''}
+
+DESCRIPTORS = {'MI': 'Shallow', 'PR': 'Partial', 'BC': 'Patches', 'DR': 'Low Drifting',
+               'BL': 'Blowing', 'SH': 'Showers', 'TS': 'Thunderstorm', 'FZ': 'Freezing'}
+
+PHENOMENA = {'DZ': 'Drizzle', 'RA': 'Rain', 'SN': 'Snow', 'SG': 'Snow Grains',
+             'IC': 'Ice Crystals', 'PL': 'Ice Pellets', 'GR': 'Hail', 'GS': 'Small Hail',
+             'UP': 'Unknown Precipitation', 'BR': 'Fog/Mist', 'FG': 'Fog', 'FU': 'Smoke',
+             'VA': 'Volcanic Ash', 'DU': 'Dust', 'SA': 'Sand', 'HZ': 'Haze', 'PY': 'Spray',
+             'PO': 'Dust Whirls', 'SQ': 'Squalls', 'FC': 'Funnel Cloud', 'SS': 'Sandstorm',
+             'DS': 'Duststorm'}
+
+SKY_TEXT = [('OVC', 'Overcast'), ('VV', 'Overcast'), ('BKN', 'Mostly Cloudy'),
+            ('SCT', 'Partly Cloudy'), ('FEW', 'A Few Clouds')]
+
+TO_KNOTS = {'KT': 1.0, 'MPS': 1.943844, 'KMH': 0.539957}
+
+
+def signed_temp(text):
+  """
+  METAR temperatures use a leading M for minus.
+  """
+  if text.startswith('M'):
+    return -float(text[1:])
+  return float(text)
+
+
+def weather_phrase(match):
+  """
+  Turn one present-weather group into the NWS-style phrase used in
+  textDescription (and in icon_match): '-SHRA' -> 'Light Rain Showers'.
+  """
+  intensity, descriptors, phenomena = match.groups()
+  if not descriptors and not phenomena:
+    return None
+  words = []
+  descriptor_list = PAIRS.findall(descriptors)
+  if 'TS' in descriptor_list:
+    words.append('Thunderstorm')
+  if intensity in INTENSITY and INTENSITY[intensity]:
+    words.append(INTENSITY[intensity])
+  for code in descriptor_list:
+    if code not in ['TS', 'SH']:
+      words.append(DESCRIPTORS[code])
+  words.extend([PHENOMENA[code] for code in PAIRS.findall(phenomena)])
+  if 'SH' in descriptor_list:
+    words.append('Showers')
+  if intensity == 'VC':
+    words.append('in Vicinity')
+  return ' '.join(words)
+
+
+def decode_metar(raw):
+  """
+  Decode a raw METAR/SPECI string. Returns a dict with whichever of these
+  keys the report contains:
+  station, time, wind_dir_deg (None when variable), wind_speed_kt, gust_kt,
+  visibility_sm, weather (list of phrases), weather_text, sky_text,
+  temperature_c, dewpoint_c, altimeter_inhg.
+  Returns None if there is nothing to decode.
+  """
+  if not raw or not isinstance(raw, TEXT_TYPES):
+    return None
+
+  body, _, remarks = raw.strip().rstrip('=').partition(' RMK ')
+  tokens = body.split()
+  if tokens and tokens[0] in ['METAR', 'SPECI']:
+    tokens = tokens[1:]
+  if not tokens:
+    return None
+
+  decoded = dict(station=tokens[0], weather=[])
+  sky_cover = []
+  pending_whole_miles = None
+  for token in tokens[1:]:
+    if re.match(r'^\d{6}Z$', token):
+      decoded['time'] = token
+      continue
+    if token in ['AUTO', 'COR', 'NIL']:
+      continue
+
+    match = WIND.match(token)
+    if match:
+      factor = TO_KNOTS[match.group(4)]
+      decoded['wind_dir_deg'] = None if match.group(1) == 'VRB' else float(match.group(1))
+      decoded['wind_speed_kt'] = float(match.group(2)) * factor
+      if match.group(3):
+        decoded['gust_kt'] = float(match.group(3)) * factor
+      continue
+    if VARIABLE_WIND.match(token):
+      continue
+
+    if token.isdigit() and len(token) == 1:
+      pending_whole_miles = float(token)
+      continue
+    match = VISIBILITY_SM.match(token)
+    if match:
+      if match.group(2):
+        miles = float(match.group(2))
+      else:
+        miles = float(match.group(3)) / float(match.group(4))
+      decoded['visibility_sm'] = miles + (pending_whole_miles or 0.0)
+      pending_whole_miles = None
+      continue
+    match = VISIBILITY_M.match(token)
+    if match and 'visibility_sm' not in decoded:
+      decoded['visibility_sm'] = float(match.group(1)) / 1609.344
+      continue
+
+    if token in ['CLR', 'SKC', 'CAVOK', 'NSC']:
+      sky_cover.append('CLR')
+      continue
+    match = SKY.match(token)
+    if match:
+      sky_cover.append(match.group(1))
+      continue
+
+    match = TEMPERATURE.match(token)
+    if match:
+      decoded['temperature_c'] = signed_temp(match.group(1))
+      if match.group(2):
+        decoded['dewpoint_c'] = signed_temp(match.group(2))
+      continue
+
+    match = ALTIMETER.match(token)
+    if match:
+      if match.group(1) == 'A':
+        decoded['altimeter_inhg'] = float(match.group(2)) / 100.0
+      else:
+        decoded['altimeter_inhg'] = float(match.group(2)) * 0.0295299830714
+      continue
+
+    match = WEATHER.match(token)
+    if match:
+      phrase = weather_phrase(match)
+      if phrase:
+        decoded['weather'].append(phrase)
+      continue
+
+    logging.debug('Unrecognized METAR group: %s', token)
+
+  # The remarks T-group carries temperature and dewpoint to a tenth of a degree.
+  for token in remarks.split():
+    match = PRECISE_TEMPERATURE.match(token)
+    if match:
+      sign = -1.0 if match.group(1) == '1' else 1.0
+      decoded['temperature_c'] = sign * float(match.group(2)) / 10.0
+      if match.group(3):
+        sign = -1.0 if match.group(3) == '1' else 1.0
+        decoded['dewpoint_c'] = sign * float(match.group(4)) / 10.0
+
+  if sky_cover:
+    decoded['sky_text'] = 'Clear'
+    for code, text in SKY_TEXT:
+      if code in sky_cover:
+        decoded['sky_text'] = text
+        break
+  if decoded['weather']:
+    decoded['weather_text'] = ' and '.join(decoded['weather'])
+
+  return decoded
+
+
+def relative_humidity(temp_c, dewpoint_c):
+  """
+  Relative humidity (percent) from temperature and dewpoint, using the
+  Magnus approximation.
+  """
+  def vapor_pressure(temp):
+    return 6.112 * math.exp((17.62 * temp) / (243.12 + temp))
+  return 100.0 * vapor_pressure(dewpoint_c) / vapor_pressure(temp_c)
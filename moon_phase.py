@@ -3,19 +3,174 @@ moon_phase.py: a class for determining the current phase of the moon,
 and for assigning a weather icon for that phase.
 """
 
-import re
+import math
 import logging
 import datetime
-import requests
-from bs4 import BeautifulSoup
+
+SYNODIC_MONTH = 29.530588861
+
+J2000 = 2451545.0
+
+J2000_DATETIME = datetime.datetime(2000, 1, 1, 12, 0, 0)
+
+# Meeus, Astronomical Algorithms, ch. 49: periodic terms for the new moon as
+# (coefficient, power of E, multiples of M, M', F, Omega).
+NEW_MOON_TERMS = [(-0.40720, 0, 0, 1, 0, 0), (0.17241, 1, 1, 0, 0, 0),
+                  (0.01608, 0, 0, 2, 0, 0), (0.01039, 0, 0, 0, 2, 0),
+                  (0.00739, 1, -1, 1, 0, 0), (-0.00514, 1, 1, 1, 0, 0),
+                  (0.00208, 2, 2, 0, 0, 0), (-0.00111, 0, 0, 1, -2, 0),
+                  (-0.00057, 0, 0, 1, 2, 0), (0.00056, 1, 1, 2, 0, 0),
+                  (-0.00042, 0, 0, 3, 0, 0), (0.00042, 1, 1, 0, 2, 0),
+                  (0.00038, 1, 1, 0, -2, 0), (-0.00024, 1, -1, 2, 0, 0),
+                  (-0.00017, 0, 0, 0, 0, 1), (-0.00007, 0, 2, 1, 0, 0),
+                  (0.00004, 0, 0, 2, -2, 0), (0.00004, 0, 3, 0, 0, 0),
+                  (0.00003, 0, 1, 1, -2, 0), (0.00003, 0, 0, 2, 2, 0),
+                  (-0.00003, 0, 1, 1, 2, 0), (0.00003, 0, -1, 1, 2, 0),
+                  (-0.00002, 0, -1, 1, -2, 0), (-0.00002, 0, 1, 3, 0, 0),
+                  (0.00002, 0, 0, 4, 0, 0)]
+
+# Planetary arguments (A1 - A14): (coefficient, constant, rate per lunation),
+# and A1's small quadratic term in T.
+PLANETARY_A1_T2 = -0.009173
+PLANETARY_TERMS = [(0.000325, 299.77, 0.107408), (0.000165, 251.88, 0.016321),
+                   (0.000164, 251.83, 26.651886), (0.000126, 349.42, 36.412478),
+                   (0.000110, 84.66, 18.206239), (0.000062, 141.74, 53.303771),
+                   (0.000060, 207.14, 2.453732), (0.000056, 154.84, 7.306860),
+                   (0.000047, 34.52, 27.261239), (0.000042, 207.19, 0.121824),
+                   (0.000040, 291.34, 1.844379), (0.000037, 161.72, 24.198154),
+                   (0.000035, 239.56, 25.513099), (0.000023, 331.55, 3.592518)]
+
+PHASES = {
+    '0': 'wi-moon-alt-new.svg',
+    '1': 'wi-moon-alt-new.svg',
+    '2': 'wi-moon-alt-waxing-crescent-1.svg',
+    '3': 'wi-moon-alt-waxing-crescent-2.svg',
+    '4': 'wi-moon-alt-waxing-crescent-3.svg',
+    '5': 'wi-moon-alt-waxing-crescent-4.svg',
+    '6': 'wi-moon-alt-waxing-crescent-5.svg',
+    '7': 'wi-moon-alt-waxing-crescent-6.svg',
+    '8': 'wi-moon-alt-first-quarter.svg',
+    '9': 'wi-moon-alt-waxing-gibbous-1.svg',
+    '10': 'wi-moon-alt-waxing-gibbous-2.svg',
+    '11': 'wi-moon-alt-waxing-gibbous-3.svg',
+    '12': 'wi-moon-alt-waxing-gibbous-4.svg',
+    '13': 'wi-moon-alt-waxing-gibbous-5.svg',
+    '14': 'wi-moon-alt-waxing-gibbous-6.svg',
+    '15': 'wi-moon-alt-full.svg',
+    '16': 'wi-moon-alt-waning-gibbous-1.svg',
+    '17': 'wi-moon-alt-waning-gibbous-2.svg',
+    '18': 'wi-moon-alt-waning-gibbous-3.svg',
+    '19': 'wi-moon-alt-waning-gibbous-4.svg',
+    '20': 'wi-moon-alt-waning-gibbous-5.svg',
+    '21': 'wi-moon-alt-waning-gibbous-6.svg',
+    '22': 'wi-moon-alt-third-quarter.svg',
+    '23': 'wi-moon-alt-waning-crescent-1.svg',
+    '24': 'wi-moon-alt-waning-crescent-2.svg',
+    '25': 'wi-moon-alt-waning-crescent-3.svg',
+    '26': 'wi-moon-alt-waning-crescent-4.svg',
+    '27': 'wi-moon-alt-waning-crescent-5.svg',
+    '28': 'wi-moon-alt-waning-crescent-6.svg',
+    '29': 'wi-moon-alt-new.svg'
+    }
+
+_YEAR_TABLES = {}
+
+
+def julian_day(moment):
+  """
+  Julian day of a (naive, UTC) datetime.
+  """
+  delta = moment - J2000_DATETIME
+  return J2000 + delta.days + delta.seconds / 86400.0
+
+
+def from_julian_day(jday):
+  """
+  Naive UTC datetime of a Julian day.
+  """
+  return J2000_DATETIME + datetime.timedelta(days=jday - J2000)
+
+
+def true_new_moon(lunation):
+  """
+  Julian day of the new moon of (integer) lunation k, counted from the new
+  moon of 2000 January 6, to within a minute or so (Meeus, ch. 49).
+  """
+  k = float(lunation)
+  t = k / 1236.85
+  jde = (2451550.09766 + SYNODIC_MONTH * k + 0.00015437 * t ** 2
+         - 0.000000150 * t ** 3 + 0.00000000073 * t ** 4)
+
+  ecc = 1.0 - 0.002516 * t - 0.0000074 * t ** 2
+  sun = math.radians(2.5534 + 29.10535670 * k - 0.0000014 * t ** 2 - 0.00000011 * t ** 3)
+  moon = math.radians(201.5643 + 385.81693528 * k + 0.0107582 * t ** 2
+                      + 0.00001238 * t ** 3 - 0.000000058 * t ** 4)
+  latitude = math.radians(160.7108 + 390.67050284 * k - 0.0016118 * t ** 2
+                          - 0.00000227 * t ** 3 + 0.000000011 * t ** 4)
+  node = math.radians(124.7746 - 1.56375588 * k + 0.0020672 * t ** 2 + 0.00000215 * t ** 3)
+
+  for coeff, epower, msun, mmoon, flat, omega in NEW_MOON_TERMS:
+    angle = msun * sun + mmoon * moon + flat * latitude + omega * node
+    jde = jde + coeff * (ecc ** epower) * math.sin(angle)
+
+  for index, (coeff, const, rate) in enumerate(PLANETARY_TERMS):
+    angle = const + rate * k
+    if index == 0:
+      angle = angle + PLANETARY_A1_T2 * t ** 2
+    jde = jde + coeff * math.sin(math.radians(angle))
+
+  return jde
+
+
+def moon_age(moment):
+  """
+  Days since the most recent new moon, and the length of the current
+  lunation, for a (naive, UTC) datetime.
+  """
+  jday = julian_day(moment)
+  lunation = int(math.floor((jday - 2451550.09766) / SYNODIC_MONTH))
+  previous = true_new_moon(lunation)
+  if previous > jday:
+    lunation = lunation - 1
+    previous = true_new_moon(lunation)
+  following = true_new_moon(lunation + 1)
+  if following <= jday:
+    lunation = lunation + 1
+    previous, following = following, true_new_moon(lunation + 1)
+  return jday - previous, following - previous
+
+
+def phase_icon(moment):
+  """
+  Icon name for the moon phase at a (naive, UTC) datetime.
+  """
+  age, length = moon_age(moment)
+  icon_index = min(int((age / length) * 29), 29)
+  return PHASES[str(icon_index)]
+
+
+def year_table(year):
+  """
+  Date -> moon icon for every day of a year (evaluated at 12:00 UTC),
+  computed once per year and kept for the life of the process.
+  """
+  year = int(year)
+  if year not in _YEAR_TABLES:
+    day = datetime.date(year, 1, 1)
+    table = {}
+    while day.year == year:
+      table[day] = phase_icon(datetime.datetime(day.year, day.month, day.day, 12))
+      day = day + datetime.timedelta(days=1)
+    _YEAR_TABLES[year] = table
+  return _YEAR_TABLES[year]
 
 
 class MoonPhase(object):
   """
-  While the length of an average lunar cycle is 29.53 days, to avoid
-  propagation errors, this class retrieves a table from NOAA that shows the
-  new moon days and times for the year, and thus the code resets to a known
-  precise zero each month.
+  The moon's phase is computed locally from the times of true new moon
+  (Meeus' algorithm, accurate to about a minute), so each lunation has its
+  own precise length and no network request is needed. Icons are looked up
+  in a per-year table, so repeat calls on the same day are a dict lookup.
   """
 
   def __init__(self, data=''):
@@ -24,119 +179,22 @@ class MoonPhase(object):
     """
     self.data = data
     self.today_v = data['today_vars']
-    self.baseurl = 'https://tidesandcurrents.noaa.gov/moon_phases.shtml'
-    self.phases = {
-        '0': 'wi-moon-alt-new.svg',
-        '1': 'wi-moon-alt-new.svg',
-        '2': 'wi-moon-alt-waxing-crescent-1.svg',
-        '3': 'wi-moon-alt-waxing-crescent-2.svg',
-        '4': 'wi-moon-alt-waxing-crescent-3.svg',
-        '5': 'wi-moon-alt-waxing-crescent-4.svg',
-        '6': 'wi-moon-alt-waxing-crescent-5.svg',
-        '7': 'wi-moon-alt-waxing-crescent-6.svg',
-        '8': 'wi-moon-alt-first-quarter.svg',
-        '9': 'wi-moon-alt-waxing-gibbous-1.svg',
-        '10': 'wi-moon-alt-waxing-gibbous-2.svg',
-        '11': 'wi-moon-alt-waxing-gibbous-3.svg',
-        '12': 'wi-moon-alt-waxing-gibbous-4.svg',
-        '13': 'wi-moon-alt-waxing-gibbous-5.svg',
-        '14': 'wi-moon-alt-waxing-gibbous-6.svg',
-        '15': 'wi-moon-alt-full.svg',
-        '16': 'wi-moon-alt-waning-gibbous-1.svg',
-        '17': 'wi-moon-alt-waning-gibbous-2.svg',
-        '18': 'wi-moon-alt-waning-gibbous-3.svg',
-        '19': 'wi-moon-alt-waning-gibbous-4.svg',
-        '20': 'wi-moon-alt-waning-gibbous-5.svg',
-        '21': 'wi-moon-alt-waning-gibbous-6.svg',
-        '22': 'wi-moon-alt-third-quarter.svg',
-        '23': 'wi-moon-alt-waning-crescent-1.svg',
-        '24': 'wi-moon-alt-waning-crescent-2.svg',
-        '25': 'wi-moon-alt-waning-crescent-3.svg',
-        '26': 'wi-moon-alt-waning-crescent-4.svg',
-        '27': 'wi-moon-alt-waning-crescent-5.svg',
-        '28': 'wi-moon-alt-waning-crescent-6.svg',
-        '29': 'wi-moon-alt-new.svg'
-        }
-
-    self.new_moon_dict = dict(year={})
+    self.phases = PHASES
 
 
   def get_moon_phase(self):
     """
-    run methods in the correct order.
+    Return the icon name for today's moon phase.
     """
-    self.retrieve_new_moon_dict()
     svg_name = self.moon_phase_today()
     return svg_name
 
 
-  def bs_pull_table_cell(self, row, index):
-    """
-    Helper function to sanitize and pull a specific cell from a specific table
-    row.
-    """
-    try:
-      return re.sub('\xa0', '', row.find_all('td')[index].text)
-    except IndexError as exc:
-      logging.error('IndexError trying to retrieve table cell %s: %s', index, exc)
-      logging.error('Row: %s', row)
-      return 'NA'
-
-
-  def retrieve_new_moon_dict(self):
-    """
-    Using some simple math, compute the moon phase for today, using
-    NOAA's data for new moons in the current year.
-    """
-    thisyear = self.today_v['year']
-    self.new_moon_dict['year'][thisyear] = {}
-    url_args = {'year': thisyear, 'data_type': 'phaX1'}
-    logging.debug('Retrieving moon phase data from %s', self.baseurl)
-    moon_table = requests.get(self.baseurl, params=url_args,
-                              verify=True, timeout=10)
-
-    if moon_table.status_code != 200:
-      logging.error('Unable to get a proper response from NOAA server. Returning False.')
-      return False
-
-    logging.debug('Parsing the new moon html table from NOAA.')
-    soup = BeautifulSoup(moon_table.text, 'html.parser')
-    tables = soup.body.find_all('table')
-    phase_table = tables[0]
-    trows = phase_table.find_all('tr')
-    for row in trows:
-      if row.find_all('th'):
-        continue
-      rowmonth = self.bs_pull_table_cell(row, 1)
-      rowday = self.bs_pull_table_cell(row, 2)
-      rowtime = self.bs_pull_table_cell(row, 3)
-      self.new_moon_dict['year'][thisyear][rowmonth] = [rowday, rowtime]
-
-    return self.new_moon_dict
-
-
   def moon_phase_today(self):
     """
-    Take in a date and determine the moon's phase on that day, using
-    NOAA new moon dates and times as the time-base / sync.
+    Look up today's (UTC) date in the precomputed table for the year.
     """
-    today = self.today_v['utcnow']
-    year = self.today_v['year']
-    mon = self.today_v['mon']
-    nextmoonstring = '{0}-{1}-{2} {3}'.format(year, mon,
-                                              self.new_moon_dict['year'][year][mon][0],
-                                              self.new_moon_dict['year'][year][mon][1])
-    nextnewmoon = datetime.datetime.strptime(nextmoonstring, '%Y-%b-%d %H:%M')
-    difference = nextnewmoon - today
-    cycle = 29.53 # days in an average moon cycle
-
-    place_in_cycle = (datetime.timedelta(cycle) - difference)
-    days_into_cycle = ((place_in_cycle.days * 24) + (place_in_cycle.seconds/3600.0)) / 24
-    while days_into_cycle > cycle:
-      days_into_cycle = days_into_cycle - cycle
-
-    logging.info('Place in the lunar cycle: %s', days_into_cycle)
-    icon_index = int((days_into_cycle / cycle) * 29)
-    logging.info('Icon should be: %s', self.phases[str(icon_index)])
-
-    return self.phases[str(icon_index)]
+    today = self.today_v['utcnow'].date()
+    icon = year_table(today.year)[today]
+    logging.info('Moon phase icon should be: %s', icon)
+    return icon
@@ -0,0 +1,215 @@
+"""
+ndfd.py: a one-pass parser for NDFD DWML (digital.weather.gov XML).
+
+Every time layout and every parameter series in the document is read once
+into plain lists, keyed by layout-key and applicable-location. Forecast
+rows are then built by joining those series on their valid dates, so the
+cost of parsing does not grow with the number of days asked for.
+"""
+
+from __future__ import print_function
+
+import logging
+import calendar
+from datetime import datetime
+from collections import OrderedDict
+import numpy as np
+from lxml import etree
+
+XSI_NIL = '{http://www.w3.org/2001/XMLSchema-instance}nil'
+
+# Parameters that appear more than once per location, told apart by type.
+TYPED_PARAMETERS = ['temperature', 'wind-speed']
+
+
+def iso_epoch(text):
+  """
+  Seconds since the epoch for a DWML time, e.g. '2024-05-01T06:00:00-05:00'.
+  """
+  moment = calendar.timegm(datetime.strptime(text[:19], '%Y-%m-%dT%H:%M:%S').timetuple())
+  offset = text[19:].replace(':', '')
+  if offset and offset not in ['Z', '+0000', '-0000']:
+    sign = -1 if offset[0] == '-' else 1
+    moment = moment - sign * (int(offset[1:3]) * 3600 + int(offset[3:5]) * 60)
+  return moment
+
+
+def element_value(element):
+  """
+  Text of a <value> element, or None if it is empty or xsi:nil.
+  """
+  if element.get(XSI_NIL) == 'true' or element.text is None:
+    return None
+  return element.text.strip()
+
+
+def series_name(element):
+  """
+  A key for one parameter series: the tag, plus its type for the
+  temperature and wind-speed families (temperature_maximum,
+  temperature_hourly, wind-speed_sustained, ...).
+  """
+  if element.tag in TYPED_PARAMETERS:
+    return '{0}_{1}'.format(element.tag, element.get('type'))
+  return element.tag
+
+
+class DWML(object):
+  """
+  A parsed DWML document: `layouts` maps layout-key -> list of start times
+  (local ISO 8601 strings), `layout_ends` the matching end times (empty for
+  point-in-time layouts), and `series` maps location-key -> series name ->
+  dict(layout=layout-key, units=units, values=[...]), each list aligned
+  with its layout.
+  """
+
+  def __init__(self, xml):
+    self.layouts = dict()
+    self.layout_ends = dict()
+    self.location_keys = []
+    self.series = OrderedDict()
+    self.error = None
+    self.parse(xml)
+
+
+  def parse(self, xml):
+    """
+    Walk the document once, collecting layouts and parameter series.
+    """
+    if not isinstance(xml, bytes):
+      xml = xml.encode('utf-8')
+    root = etree.fromstring(xml)
+    if root.tag == 'error' or root.find('error') is not None:
+      self.error = etree.tostring(root).decode('utf-8')
+      return self
+
+    data = root.find('data')
+    if data is None:
+      self.error = 'No <data> element in DWML document.'
+      return self
+
+    for element in data:
+      if element.tag == 'location':
+        self.location_keys.append(element.findtext('location-key'))
+      elif element.tag == 'time-layout':
+        key = element.findtext('layout-key')
+        self.layouts[key] = [start.text for start in element.iter('start-valid-time')]
+        self.layout_ends[key] = [end.text for end in element.iter('end-valid-time')]
+      elif element.tag == 'parameters':
+        location = element.get('applicable-location')
+        params = self.series.setdefault(location, OrderedDict())
+        for param in element:
+          if param.tag == 'weather':
+            values = [condition.get('weather-summary')
+                      for condition in param.iter('weather-conditions')]
+          elif param.tag == 'conditions-icon':
+            values = [link.text for link in param.iter('icon-link')]
+          else:
+            values = [element_value(value) for value in param.iter('value')]
+          params[series_name(param)] = dict(layout=param.get('time-layout'),
+                                            units=param.get('units'),
+                                            values=values)
+    return self
+
+
+  def locations(self):
+    """
+    Location keys (point1, point2, ...), in the order the points were
+    requested.
+    """
+    return [key for key in self.location_keys if key in self.series] or list(self.series.keys())
+
+
+  def by_date(self, location, name, period=None):
+    """
+    {date: value} for one series. With period='morning' or 'evening', only
+    values whose layout period starts before or after local noon.
+    """
+    param = self.series.get(location, {}).get(name)
+    if param is None:
+      return {}
+    result = dict()
+    for start, value in zip(self.layouts.get(param['layout'], []), param['values']):
+      if period is not None and (int(start[11:13]) < 12) != (period == 'morning'):
+        continue
+      result.setdefault(start[:10], value)
+    return result
+
+
+  def daily(self, location=None, days=None):
+    """
+    Columns for a 24-hourly forecast, one entry per day, joined by date:
+    date, start, high, low, precip_morning, precip_evening, shortcast.
+    """
+    if location is None:
+      if not self.series:
+        return None
+      location = self.locations()[0]
+
+    highs = self.by_date(location, 'temperature_maximum')
+    lows = self.by_date(location, 'temperature_minimum')
+    morning = self.by_date(location, 'probability-of-precipitation', 'morning')
+    evening = self.by_date(location, 'probability-of-precipitation', 'evening')
+    weather = self.by_date(location, 'weather')
+
+    param = self.series[location].get('temperature_maximum') or self.series[location].get('weather')
+    if param is None:
+      logging.error('No daily series for %s in the DWML document.', location)
+      return None
+    starts = self.layouts.get(param['layout'], [])[:days]
+    dates = [start[:10] for start in starts]
+
+    columns = dict(date=dates, start=starts,
+                   high=[highs.get(date) for date in dates],
+                   low=[lows.get(date) for date in dates],
+                   precip_morning=[morning.get(date) or '0' for date in dates],
+                   precip_evening=[evening.get(date) or '0' for date in dates],
+                   shortcast=[weather.get(date) for date in dates])
+    return columns
+
+
+  def timeseries(self, location=None):
+    """
+    Every series of a time-series document on one hourly axis. Returns
+    (times, columns, units): times is an array of epoch seconds (the union of
+    the point-in-time layouts), and each column is a float array aligned with
+    it (NaN where there is no value). Period values (12-hour PoP, 6-hour QPF)
+    cover every hour of their period; QPF is spread evenly over it, so
+    the column still sums to the period totals.
+    """
+    if location is None:
+      if not self.series:
+        return None, {}, {}
+      location = self.locations()[0]
+    params = self.series.get(location, {})
+
+    instants = set()
+    for param in params.values():
+      if not self.layout_ends.get(param['layout']):
+        instants.update([iso_epoch(start) for start in self.layouts.get(param['layout'], [])])
+    times = np.array(sorted(instants), dtype=np.int64)
+
+    columns = dict()
+    units = dict()
+    for name, param in params.items():
+      if name in ['weather', 'conditions-icon']:
+        continue
+      values = np.array([np.nan if value is None else float(value)
+                         for value in param['values']], dtype=float)
+      starts = np.array([iso_epoch(start) for start in self.layouts.get(param['layout'], [])],
+                        dtype=np.int64)[:len(values)]
+      values = values[:len(starts)]
+      column = np.full(len(times), np.nan)
+      ends = self.layout_ends.get(param['layout'])
+      if ends:
+        ends = np.array([iso_epoch(end) for end in ends], dtype=np.int64)[:len(values)]
+        first = np.searchsorted(times, starts, side='left')
+        last = np.searchsorted(times, ends, side='left')
+        for value, low, high in zip(values, first, last):
+          if high > low:
+            column[low:high] = value / (high - low) if name == 'precipitation' else value
+      else:
+        column[np.searchsorted(times, starts)] = values
+      columns[name] = column
+      units[name] = param['units']
+    return times, columns, units
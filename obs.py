@@ -6,12 +6,27 @@ from __future__ import print_function
 
 import os
 import sys
-import re
+import json
 import logging
 from bs4 import BeautifulSoup
 import weather_functions as wf
+import units
+import derived
 import weathersvg as wsvg
 import moon_phase
+import metar
+from record import ObsRecord
+
+
+MISSING_TEXT = [None, 'None', '', 'No Data', 'No data']
+
+
+def is_missing(value):
+  """
+  True if an observation value (or text field) holds one of the
+  placeholders used for missing data.
+  """
+  return value in MISSING_TEXT
 
 
 class WeatherDict(object):
@@ -32,6 +47,7 @@ class WeatherDict(object):
                     gusts=dict(units='', value='', label='Gusts'),
                     windchill=dict(units='', value='', label='Wind Chill'),
                     heatindex=dict(units='', value='', label='Heat Index'),
+                    visibility=dict(units='', value='', label='Visibility'),
                     location=dict(lon=0.0, lat=0.0, zip=00000, state='', label='Location'),
                     wind_cardinal='',
                     textdescription='',
@@ -57,9 +73,18 @@ class Observation(object):
     self.con2 = WeatherDict(data=data)
     self.matchup = ['pressure', 'dewpoint', 'temperature', 'humidity',
                     'wind_direction', 'heatindex', 'windchill', 'wind',
-                    'gusts']
+                    'gusts', 'visibility']
     self.textonly = ['weather', 'metar', 'textdescription', 'timestamp',
                      'beaufort', 'wind_cardinal']
+    # No windchill: the backup feed's is computed from temperature and wind,
+    # just as fill_wind_chill() does, and is absent for warm or calm weather.
+    self.backup_provides = ['pressure', 'dewpoint', 'temperature', 'humidity',
+                            'wind_direction', 'wind', 'weather',
+                            'textdescription', 'timestamp', 'beaufort',
+                            'wind_cardinal', 'visibility']
+    self.raw_obs = ''
+    self.obs_json = None
+    self.record = None
 
 
   def get_current_conditions(self):
@@ -67,39 +92,16 @@ class Observation(object):
     Take the JSON object from the NWS station and produce a reduced set of
     information for display.
     """
-    cur_url = self.data['defaults']['cur_url'].format(station=self.data['station'])
-    returned_json = wf.make_request(url=cur_url)
-
+    returned_json = self.fetch_current()
     if returned_json is None:
-      logging.error('No usable reply from %s', self.data['defaults']['cur_url'])
       return None
-    else:
-      try:
-        returned_text = wf.make_request(url=cur_url, use_json=False)
-        logging.debug('Returned current conditions information: %s', returned_text)
-      except Exception as exc:
-        logging.error('Exception when retrieving current conditions webpage data: %s', exc)
-        return None
 
     if 'properties' in returned_json.keys():
       con1 = self.con1.obs
       self.parse_primary_obs(returned_json=returned_json)
-
-      logging.debug('Determining cardinal wind direction, if possible.')
-      logging.info('Wind azimuth: %s', con1['wind_direction']['value'])
-      wdstring = self.wind_direction(con1['wind_direction']['value'])
-      if wdstring is None or wdstring == 'None':
-        logging.debug('Unable to determine cardinal wind direction.')
-        con1['wind_cardinal'] = 'No Data'
-      else:
-        logging.debug('Wind is out of the %s.', wdstring)
-        con1['wind_cardinal'] = 'Out of the {0}'.format(wdstring)
-
-      con1['beaufort'] = wf.beaufort_scale(self.data,
-                                           speed=con1['wind']['value'],
-                                           units=con1['wind']['units'])
-      logging.info('Beaufort wind speed scale: %s', con1['beaufort'])
-
+      self.fill_from_metar(con1)
+      self.derive_wind(con1)
+      self.fill_wind_chill(con1)
       con1['moon_icon'] = self.moonphase()
 
       return con1
@@ -107,9 +109,157 @@ class Observation(object):
       return None
 
 
-  def parse_primary_obs(self, returned_json):
+  def derive_wind(self, con):
+    """
+    Set the cardinal wind direction and Beaufort number from the wind
+    azimuth and speed.
+    """
+    logging.debug('Determining cardinal wind direction, if possible.')
+    logging.info('Wind azimuth: %s', con['wind_direction']['value'])
+    wdstring = self.wind_direction(con['wind_direction']['value'])
+    if wdstring is None or wdstring == 'None':
+      logging.debug('Unable to determine cardinal wind direction.')
+      con['wind_cardinal'] = 'No Data'
+    else:
+      logging.debug('Wind is out of the %s.', wdstring)
+      con['wind_cardinal'] = 'Out of the {0}'.format(wdstring)
+
+    con['beaufort'] = wf.beaufort_scale(self.data,
+                                        speed=con['wind']['value'],
+                                        units=con['wind']['units'])
+    logging.info('Beaufort wind speed scale: %s', con['beaufort'])
+    return con
+
+
+  def fetch_current(self):
+    """
+    Retrieve the current observation with a single request, keeping both
+    the raw body (for logging/debugging) and the parsed JSON.
+    """
+    cur_url = self.data['defaults']['cur_url'].format(station=self.data['station'])
+    returned_text = wf.make_request(url=cur_url, use_json=False)
+    if not returned_text:
+      logging.error('No usable reply from %s', cur_url)
+      return None
+    logging.debug('Returned current conditions information: %s', returned_text)
+
+    try:
+      returned_json = json.loads(returned_text)
+    except ValueError as exc:
+      logging.error('Unable to decode current conditions JSON from %s: %s', cur_url, exc)
+      return None
+
+    self.raw_obs = returned_text
+    self.obs_json = returned_json
+    return returned_json
+
+
+  def fill_from_metar(self, con):
+    """
+    Fill any fields the primary JSON left empty from the raw METAR it
+    carries (rawMessage, stored as con['metar']). The JSON is often missing
+    values that are plainly present in the raw message, and decoding it
+    locally usually makes the backup XML fetch unnecessary.
+    """
+    decoded = metar.decode_metar(con['metar'])
+    if not decoded:
+      logging.debug('No raw METAR to fill gaps from.')
+      return con
+
+    units = self.data['units']
+    fields = {'temperature': ['temperature_c', 'C', units['temperature']],
+              'dewpoint': ['dewpoint_c', 'C', units['temperature']],
+              'pressure': ['altimeter_inhg', 'inHg', units['pressure']],
+              'wind': ['wind_speed_kt', 'kt', units['velocity']],
+              'gusts': ['gust_kt', 'kt', units['velocity']],
+              'visibility': ['visibility_sm', 'miles', units['distance']]
+             }
+    for key, (metar_key, from_unit, to_unit) in fields.items():
+      if is_missing(con[key]['value']) and decoded.get(metar_key) is not None:
+        con[key]['value'] = wf.convert_units(value=decoded[metar_key],
+                                             from_unit=from_unit,
+                                             to_unit=to_unit)
+        con[key]['units'] = to_unit
+        logging.info('Filled %s from METAR: %s %s', key, con[key]['value'], to_unit)
+
+    if is_missing(con['wind_direction']['value']) and decoded.get('wind_dir_deg') is not None:
+      con['wind_direction']['value'] = decoded['wind_dir_deg']
+      con['wind_direction']['units'] = 'degrees'
+
+    if (is_missing(con['humidity']['value']) and 'temperature_c' in decoded
+        and 'dewpoint_c' in decoded):
+      con['humidity']['value'] = metar.relative_humidity(decoded['temperature_c'],
+                                                         decoded['dewpoint_c'])
+      con['humidity']['units'] = '%'
+
+    description = decoded.get('weather_text', decoded.get('sky_text'))
+    if is_missing(con['textdescription']) and description:
+      con['textdescription'] = description
+    if not con['weather'] and decoded.get('weather_text'):
+      con['weather'] = decoded['weather_text']
+
+    return con
+
+
+  def fill_wind_chill(self, con):
+    """
+    The primary JSON leaves windChill empty whenever it is warm or calm.
+    Compute it locally from the primary temperature and wind, exactly as the
+    backup feed would, so a missing wind chill alone never forces a backup
+    fetch.
+    """
+    temp = con['temperature']
+    wind = con['wind']
+    if not is_missing(con['windchill']['value']):
+      return con['windchill']
+    if is_missing(temp['value']) or is_missing(wind['value']):
+      return None
+
+    temp_f = float(temp['value'])
+    if temp['units'] != 'F':
+      temp_f = wf.convert_units(value=temp['value'], from_unit=temp['units'], to_unit='F')
+    wind_mph = float(wind['value'])
+    if wind['units'] != 'mph':
+      wind_mph = wf.convert_units(value=wind['value'], from_unit=wind['units'], to_unit='mph')
+
+    chill = self.wind_chill(temp_f, wind_mph)
+    if chill is None:
+      return None
+    if temp['units'] != 'F':
+      chill = wf.convert_units(value=chill, from_unit='F', to_unit=temp['units'])
+    con['windchill'] = {'value': chill,
+                        'units': temp['units'],
+                        'label': 'Wind Chill'
+                       }
+    return con['windchill']
+
+
+  def needs_backup(self):
+    """
+    Only go to the backup XML feed when merge_good_observations() would
+    actually take something from it: i.e. when a field the backup feed can
+    supply is missing from the primary observation.
+    """
+    ccp = self.con1.obs
+    for key in self.matchup:
+      if key in self.backup_provides and is_missing(ccp[key]['value']):
+        logging.info('Primary observation is missing %s; backup source needed.', key)
+        return True
+
+    for key in self.textonly:
+      if key in self.backup_provides and is_missing(ccp[key]):
+        logging.info('Primary observation is missing %s; backup source needed.', key)
+        return True
+
+    logging.info('Primary observation is complete; skipping the backup source.')
+    return False
+
+
+  def parse_primary_obs(self, returned_json, target=None):
     """
     Parse the primary URL for current conditions. Return a dict.
+    The parsed values go into self.con1.obs unless another WeatherDict.obs
+    is passed as the target (as the backfill does for each record).
     """
     other = {'textDescription': 'textdescription',
              'rawMessage': 'metar',
@@ -124,13 +274,13 @@ class Observation(object):
               'barometricPressure': ['pressure', 'pressure'],
               'windChill': ['windchill', 'temperature'],
               'windSpeed': ['wind', 'velocity'],
-              'windGust': ['gusts', 'velocity']
+              'windGust': ['gusts', 'velocity'],
+              'visibility': ['visibility', 'distance']
              }
     tempdict = returned_json['properties']
-    con1 = self.con1.obs
-    for key, val in useful.iteritems():
-      from_unit = re.sub(r'unit:\s*', '', tempdict[key]['unitCode'])
-      from_unit = re.sub(r'^deg', '', from_unit)
+    con1 = self.con1.obs if target is None else target
+    for key, val in useful.items():
+      from_unit = units.normalize_unit(tempdict[key]['unitCode'])
       from_value = wf.sanity_check(tempdict[key]['value'])
 
       if from_value is None or from_value == self.data['defaults']['missing']:
@@ -149,7 +299,7 @@ class Observation(object):
         con1[val[0]]['units'] = self.data['units'][val[1]]
         sys.stdout.write('\tUnits: {0}\n'.format(self.data['units'][val[1]]))
 
-    for key, val in other.iteritems():
+    for key, val in other.items():
       con1[val] = tempdict[key]
 
     con1['wind_direction'] = {'value': tempdict['windDirection']['value'],
@@ -159,6 +309,55 @@ class Observation(object):
     return con1
 
 
+  def get_observation_list(self, start, end, limit=500):
+    """
+    Retrieve the station's observation collection for a time range (rather
+    than only /observations/current), following the pagination links.
+    Returns the list of GeoJSON features, newest first.
+    """
+    url = self.data['defaults']['obs_list_url'].format(station=self.data['station'])
+    payload = {'start': start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+               'end': end.strftime('%Y-%m-%dT%H:%M:%SZ'),
+               'limit': limit
+              }
+    features = []
+    while url:
+      page = wf.make_request(url=url, payload=payload)
+      if not page:
+        logging.error('No usable reply from %s', url)
+        break
+      batch = page.get('features', [])
+      features.extend(batch)
+      logging.info('Retrieved %s observations (%s total).', len(batch), len(features))
+      url = page.get('pagination', {}).get('next')
+      if not batch:
+        break
+      payload = False
+
+    return features
+
+
+  def parse_observation_list(self, features):
+    """
+    Run each record of an observation collection through the same
+    parse_primary_obs() conversion as the current observation. Returns a
+    list of ObsRecords, skipping records that cannot be parsed.
+    """
+    records = []
+    for feature in features:
+      record = WeatherDict(data=self.data).obs
+      try:
+        self.parse_primary_obs(returned_json=feature, target=record)
+        self.fill_from_metar(record)
+        self.fill_wind_chill(record)
+        records.append(ObsRecord.from_obs(record))
+      except (KeyError, TypeError, ValueError, AttributeError) as exc:
+        logging.error('Skipping unparseable observation record: %s', exc)
+        continue
+
+    return records
+
+
   def get_backup_obs(self, use_json=False):
     """
     Something strange is happening with the data for at least one location --
@@ -225,6 +424,14 @@ class Observation(object):
                         'label': 'Pressure'
                        }
 
+    converted_vis = wf.convert_units(value=self.backup_obs.obs['visibility_mi'],
+                                     from_unit='miles',
+                                     to_unit=units['distance'])
+    con2['visibility'] = {'value': converted_vis,
+                          'units': units['distance'],
+                          'label': 'Visibility'
+                         }
+
     con2['weather'] = self.backup_obs.obs['weather']
     logging.debug('Backup weather observation (current conditions) string: %s', con2['weather'])
     con2['textdescription'] = con2['weather']
@@ -276,25 +483,30 @@ class Observation(object):
     - (35.75 * (wind_mph ** 0.16))
     + (0.4275 * temp_f * (wind_mph ** 0.16))
 
+    It is only defined at or below 50 F with wind over 3 mph; outside that
+    there is no wind chill, and this returns None.
     """
-    if temp_f == self.data['defaults']['missing']:
-      logging.warn('No temperature data to use. Returning -None-')
+    missing = self.data['defaults']['missing']
+    if temp_f == missing or wind_mph == missing:
+      logging.warn('No temperature or wind data to use. Returning -None-')
       return None
-
-    logging.info('Finding wind chill for %s, with wind at %s mph', temp_f, wind_mph)
     try:
-      wind_ch = 35.74 + (0.6215 * float(temp_f))
-    except Exception as exc:
-      logging.error('Exception computing first wind chill component! %s', exc)
+      temp_f = float(temp_f)
+      wind_mph = float(wind_mph)
+    except (TypeError, ValueError):
+      logging.warn('Unusable temperature (%s) or wind (%s). Returning -None-', temp_f, wind_mph)
+      return None
+    if temp_f > 50.0 or wind_mph <= 3.0:
+      logging.info('No wind chill at %s F with wind at %s mph.', temp_f, wind_mph)
       return None
 
-    try:
-      wind_ch = float(wind_ch) - (35.75 * (float(wind_mph) ** 0.16)) + (0.4275 * float(temp_f) * (float(wind_mph) ** 0.16))
-      logging.info('Wind chill computed to be %s degrees.', wind_ch)
-      return int(wind_ch)
-    except Exception as exc:
-      logging.error('Exception computing second portion of wind chill! %s', exc)
+    logging.info('Finding wind chill for %s, with wind at %s mph', temp_f, wind_mph)
+    wind_ch = derived.wind_chill_scalar(temp_f, wind_mph)
+    if wind_ch is None:
+      logging.error('Unable to compute wind chill from %s F and %s mph.', temp_f, wind_mph)
       return None
+    logging.info('Wind chill computed to be %s degrees.', wind_ch)
+    return int(wind_ch)
 
 
   def get_metar(self):
@@ -311,10 +523,8 @@ class Observation(object):
   def merge_good_observations(self):
     """
     Find missing data in current_conditions and replace/augment it with
-    data from backup_dict.
-    If all else fails, and if there's a current_conditions['rawMessage'],
-    it should be possible to use python-metar to parse the raw message and
-    fill in remaining gaps.
+    data from backup_dict. (Gaps that the raw METAR can fill have already
+    been filled by fill_from_metar().)
     """
 
     logging.info('Comparing current observations from multiple sources.')
@@ -344,39 +554,46 @@ class Observation(object):
     ccp['weather_icon'] = wsvg.assign_icon(ccp['textdescription'],
                                            self.data['defaults']['icon_match'])
 
-    ccp['moon_icon'] = self.moonphase()
+    if not ccp['moon_icon']:
+      ccp['moon_icon'] = self.moonphase()
 
+    self.record = ObsRecord.from_obs(ccp)
     return self.con1.obs
 
 
   def format_current_conditions(self):
     """
-    Take in the dictionary of current conditions and return a text document.
+    Take in the current conditions record and return a text document, plus
+    the JSON-ready dict for current_conditions.json.
     """
-    cur = self.con1.obs
+    cur = self.current_record()
     ordered = ['temperature', 'dewpoint', 'humidity', 'heatindex', 'windchill',
-               'pressure', 'wind_direction', 'wind', 'gusts']
+               'pressure', 'wind_direction', 'wind', 'gusts', 'visibility']
 
-    doctext = str('Conditions as of {0}'.format(wf.prettify_timestamp(cur['timestamp'])))
+    doctext = str('Conditions as of {0}'.format(wf.prettify_timestamp(cur.timestamp)))
     for entry in ordered:
-      print('Checking key: {0}'.format(entry))
-      print('Stored dict: {0}'.format(cur[entry]))
-      doctext = wf.quick_doctext(doctext,
-                                 '{0}:'.format(cur[entry]['label']),
-                                 cur[entry]['value'], cur[entry]['units']
-                                )
+      value, unit, label = cur.entry(entry)
+      logging.debug('%s: %s %s', label, value, unit)
+      doctext = wf.quick_doctext(doctext, '{0}:'.format(label), value, unit)
 
     doctext = wf.quick_doctext(doctext,
                                '{0}:'.format('Weather'),
-                               cur['weather'],
+                               cur.weather,
                                ''
                               )
     doctext = wf.quick_doctext(doctext,
                                '{0}:'.format('Wind'),
-                               cur['wind_cardinal'],
+                               cur.wind_cardinal,
                                ''
                               )
-    return doctext, cur
+    result = cur.to_json()
+    try:
+      result['beaufort_icon'] = 'wi-wind-beaufort-{0}.svg'.format(int(cur.beaufort))
+    except (TypeError, ValueError):
+      result['beaufort_icon'] = 'wi-na.svg'
+    for name in ['weather_icon', 'moon_icon', 'beaufort_icon']:
+      result[name + '_ref'] = wsvg.icon_ref(result[name], self.data['output_dir'])
+    return doctext, result
 
 
   def conditions_summary(self):
@@ -386,43 +603,37 @@ class Observation(object):
     """
     keys = ['dewpoint', 'pressure', 'wind_direction',
             'wind', 'gusts', 'temperature',
-            'humidity', 'heatindex']
+            'humidity', 'heatindex', 'visibility']
+    cur = self.current_record()
     summary = dict()
-    summary['timestamp'] = self.con1.obs['timestamp']
+    summary['timestamp'] = cur.timestamp
     for key in keys:
-      trump = self.con1.obs[key]  # because it's a tiny dict, that's why
-      try:
-        summary[key] = '{0}: {1} {2}'.format(trump['label'],
-                                             trump['value'],
-                                             trump['units'])
-      except Exception as exc:
-        logging.error('Exception: %s', exc)
-        summary[key] = 'none'
+      value, unit, label = cur.entry(key)
+      summary[key] = '{0}: {1} {2}'.format(label, value, unit)
 
     return summary
 
 
+  def current_record(self):
+    """
+    The merged observation as a compact ObsRecord (built once, after the
+    merge, and reused by the summary, text, JSON and archive outputs).
+    """
+    if self.record is None:
+      self.record = ObsRecord.from_obs(self.con1.obs)
+    return self.record
+
+
   def wind_direction(self, azimuth):
     """
     Converts 'wind coming from an azimuth, in degrees', to cardinal directions.
     """
-    try:
-      azimuth = float(azimuth)
-      logging.debug('Converted azimuth to %s', azimuth)  
-    except Exception as exc:
-      logging.error('Cannot convert azimuth %s to numeric. Returning None. (%s)', azimuth, exc)
+    cardinal = derived.cardinal_scalar(azimuth)
+    if cardinal is None:
+      logging.error('Cannot convert azimuth %s to a cardinal direction. Returning None.', azimuth)
       return None
-
-    plusminus = self.data['defaults']['plusminus']  # 11.25
-    azdir = self.data['defaults']['azdir']
-    for az_deg, val in azdir.iteritems():
-      az_deg = float(az_deg)
-      logging.debug('Checking range %s to %s', az_deg - plusminus, az_deg + plusminus)
-      if (az_deg - plusminus < azimuth) and (az_deg + plusminus >= azimuth):
-        logging.info('Wind azimuth %s degrees converts to %s', azimuth, val)
-        return val
-
-    return 'None'
+    logging.info('Wind azimuth %s degrees converts to %s', azimuth, cardinal)
+    return cardinal
 
 
   def htable_current_conditions(self, tablefile='current_conditions.html'):
@@ -433,7 +644,7 @@ class Observation(object):
     try:
       with open(os.path.join(self.data['output_dir'], tablefile), 'w') as htmlout:
         htmlout.write('<table>\n')
-        for key, value in self.con1.obs.iteritems():
+        for key, value in self.con1.obs.items():
           print('{0}: {1}'.format(key, value))
           htmlout.write('<tr><td>{0}</td><td>{1} {2}</td></tr>\n'.format(value[2],
                                                                          value[0],
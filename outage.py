@@ -8,8 +8,7 @@ from __future__ import print_function
 import re
 import logging
 import datetime
-import requests
-from bs4 import BeautifulSoup
+from textproduct import TextProduct
 
 class Outage(object):
   """
@@ -22,13 +21,10 @@ class Outage(object):
     """
     self.data = data
     self.defaults = data['defaults']
-    self.ftm_params = {'site': 'NWS',
-                       'issuedby': data['radar_station'],
-                       'product': 'FTM',
-                       'format': 'CI',
-                       'version': 1,
-                       'glossary': 0
-                      }
+    self.product = TextProduct(data, 'FTM', data['radar_station'],
+                               params={'format': 'CI', 'version': 1, 'glossary': 0},
+                               min_length=100,
+                               url=self.defaults['hwo_url'])
     self.ftm_text = ''
     self.return_text = ''
 
@@ -42,37 +38,16 @@ class Outage(object):
     The information is identical to the HWO call.
     """
 
-    print('ftm parameter dict: {0}'.format(self.ftm_params))
+    print('ftm parameters: {0}'.format(self.product.params))
 
-    try:
-      response = requests.get(self.defaults['hwo_url'],
-                              params=self.ftm_params,
-                              verify=True, timeout=10)
-    except requests.exceptions.ConnectionError as exc:
-      print('ConnectionError: {0}'.format(exc))
-      return None
-
-    html = response.text
-    soup = BeautifulSoup(html, 'html.parser')
-
-    if not soup:
+    ftm_text = self.product.fetch()
+    if ftm_text is None:
       print('WARNING: no returned data from html request for outages.')
       return None
 
-    try:
-      pres = soup.body.find_all('pre')
-    except TypeError:
-      return None
-    except AttributeError:
-      return None
-
-    for pretag in pres:
-      self.ftm_text = pretag.get_text()
-      # print('ftm_text: {0}'.format(ftm_text))
-      if len(self.ftm_text) > 100:
-        self.ftm_text = self.ftm_text.split('\n')
-        return True
-    return False
+    self.product.save_result(None)
+    self.ftm_text = ftm_text.split('\n')
+    return True
 
 
   def parse_outage(self):
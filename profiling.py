@@ -0,0 +1,159 @@
+"""
+profiling.py: opt-in cProfile and tracemalloc instrumentation for each
+stage of a program run.
+
+Profiling is switched on with the --profile command line flag or the
+WEATHERWIDGET_PROFILE environment variable, and can be sampled so that
+only a fraction of runs pay for it. A sample rate below 1 switches it on by
+itself: WEATHERWIDGET_PROFILE_SAMPLE=0.01 alone profiles about 1% of cron
+runs. Allocation tracking needs tracemalloc (Python 3); without it, only
+the cProfile stats and timings are written.
+"""
+
+from __future__ import print_function
+
+import os
+import time
+import random
+import logging
+import datetime
+import cProfile
+from contextlib import contextmanager
+import weather_functions as wf
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+TRUTHY = ['1', 'true', 'yes', 'on']
+
+
+class StageProfiler(object):
+  """
+  Wrap each named stage of a run with a cProfile profiler and a pair of
+  tracemalloc snapshots. Each stage gets a .prof file (readable with pstats
+  or snakeviz) and a text file of the top allocation sites; a summary.json
+  of wall time and net allocations per stage is written by finish().
+  """
+
+  def __init__(self, output_dir, enabled=False, sample_rate=1.0,
+               dirname='profile', top=25):
+    self.enabled = bool(enabled) and random.random() < float(sample_rate)
+    self.top = top
+    self.stage_count = 0
+    self.summary = []
+    run_label = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    self.profile_dir = os.path.join(output_dir, dirname, run_label)
+    if self.enabled:
+      logging.info('Profiling this run. Output goes to %s', self.profile_dir)
+      if not os.path.isdir(self.profile_dir):
+        os.makedirs(self.profile_dir)
+      if tracemalloc is None:
+        logging.info('tracemalloc is not available; not tracking allocations.')
+      elif not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+  @contextmanager
+  def stage(self, name):
+    """
+    Context manager around one stage of main(). Does nothing at all when
+    profiling is disabled for this run.
+    """
+    if not self.enabled:
+      yield
+      return
+
+    self.stage_count = self.stage_count + 1
+    profiler = cProfile.Profile()
+    before = None
+    if tracemalloc is not None:
+      before = tracemalloc.take_snapshot()
+    start = time.time()
+    profiler.enable()
+    try:
+      yield
+    finally:
+      profiler.disable()
+      elapsed = time.time() - start
+      after = None
+      if before is not None:
+        after = tracemalloc.take_snapshot()
+      self.dump_stage(name, profiler, before, after, elapsed)
+
+
+  def dump_stage(self, name, profiler, before, after, elapsed):
+    """
+    Write the cProfile stats and the top allocation sites for one stage.
+    Without allocation snapshots, only the stats and the timing are kept.
+    """
+    label = '{0:02d}_{1}'.format(self.stage_count, name)
+    try:
+      profiler.dump_stats(os.path.join(self.profile_dir, '{0}.prof'.format(label)))
+    except (IOError, OSError) as exc:
+      logging.error('Unable to write profile for stage %s: %s', name, exc)
+
+    if before is None or after is None:
+      logging.info('Stage %s took %.3f s.', name, elapsed)
+      self.summary.append(dict(stage=name, seconds=round(elapsed, 4), net_bytes=None))
+      return True
+
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__),
+              tracemalloc.Filter(False, '<frozen importlib._bootstrap>')]
+    diffs = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'lineno')
+    net_bytes = sum([stat.size_diff for stat in diffs])
+    try:
+      with open(os.path.join(self.profile_dir, '{0}_alloc.txt'.format(label)), 'w') as allocs:
+        allocs.write('Stage {0}: {1:.3f} s, net {2} bytes allocated\n'.format(name,
+                                                                            elapsed,
+                                                                            net_bytes))
+        for stat in diffs[:self.top]:
+          allocs.write('{0}\n'.format(stat))
+    except (IOError, OSError) as exc:
+      logging.error('Unable to write allocation sites for stage %s: %s', name, exc)
+
+    logging.info('Stage %s took %.3f s and allocated %s bytes (net).', name, elapsed, net_bytes)
+    self.summary.append(dict(stage=name, seconds=round(elapsed, 4), net_bytes=net_bytes))
+    return True
+
+
+  def finish(self):
+    """
+    Write the per-stage summary and stop tracing memory allocations.
+    """
+    if not self.enabled:
+      return False
+    wf.write_json(some_dict=self.summary, outputdir=self.profile_dir, filename='summary.json')
+    if tracemalloc is not None and tracemalloc.is_tracing():
+      tracemalloc.stop()
+    return True
+
+
+def from_settings(data, force=False, sample_rate=None):
+  """
+  Build a StageProfiler from the settings/defaults dict, the environment,
+  and any command line overrides. Command line beats environment, which
+  beats the YAML files. Asking for a sample rate below 1 implies profiling.
+  """
+  defaults = data['defaults']
+  enabled = force or data.get('profile', False)
+  if os.environ.get('WEATHERWIDGET_PROFILE', '').lower() in TRUTHY:
+    enabled = True
+
+  if sample_rate is None:
+    sample_rate = os.environ.get('WEATHERWIDGET_PROFILE_SAMPLE',
+                                 defaults.get('profile_sample_rate', 1.0))
+  try:
+    sample_rate = float(sample_rate)
+  except (TypeError, ValueError):
+    logging.error('Unusable profile sample rate "%s". Profiling every run.', sample_rate)
+    sample_rate = 1.0
+  if sample_rate < 1.0:
+    enabled = True
+
+  return StageProfiler(output_dir=data['output_dir'],
+                       enabled=enabled,
+                       sample_rate=sample_rate,
+                       dirname=defaults.get('profile_dir', 'profile'),
+                       top=defaults.get('profile_top_allocations', 25))
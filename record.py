@@ -0,0 +1,189 @@
+"""
+record.py: a compact, fixed-layout observation record.
+
+WeatherDict.obs (a dict of small value/units/label dicts) is convenient while
+an observation is being parsed and merged, but it is a poor shape to keep
+many of. ObsRecord stores the measured fields in a single array of doubles
+(NaN for missing), shares the units tuple between records, and keeps labels
+as a class constant. It is the row type of the observation archive and
+produces the familiar nested JSON shape on demand with to_json().
+"""
+
+from __future__ import print_function
+
+import math
+import calendar
+import datetime
+from array import array
+from email.utils import parsedate_tz, mktime_tz
+
+MISSING = -9999.9
+
+FIELDS = ('temperature', 'dewpoint', 'humidity', 'pressure', 'wind',
+          'wind_direction', 'gusts', 'windchill', 'heatindex', 'visibility')
+
+LABELS = ('Temperature', 'Dewpoint', 'Rel. Humidity', 'Pressure', 'Wind Speed',
+          'Wind Direction', 'Gusts', 'Wind Chill', 'Heat Index', 'Visibility')
+
+TEXT_FIELDS = ('timestamp', 'textdescription', 'weather', 'wind_cardinal',
+               'metar', 'weather_icon', 'moon_icon', 'location')
+
+FIELD_INDEX = dict([(field, idx) for idx, field in enumerate(FIELDS)])
+
+NAN = float('nan')
+
+_UNITS_CACHE = {}
+
+
+def shared_units(units):
+  """
+  Return one shared tuple object for each distinct combination of units, so
+  that thousands of records in the same units hold a single tuple.
+  """
+  units = tuple(units)
+  return _UNITS_CACHE.setdefault(units, units)
+
+
+def obs_epoch(timestamp):
+  """
+  Seconds since the epoch for either timestamp format we see: ISO 8601 from
+  api.weather.gov, or RFC 822 from the w1 backup XML feed.
+  """
+  try:
+    parsed = datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S+00:00')
+    return calendar.timegm(parsed.timetuple())
+  except (TypeError, ValueError):
+    pass
+
+  try:
+    return mktime_tz(parsedate_tz(timestamp))
+  except (TypeError, ValueError):
+    return None
+
+
+def to_float(value):
+  """
+  Observation values arrive as floats, formatted strings, 'None', or the
+  missing-value sentinel; all of the missing forms become NaN.
+  """
+  try:
+    value = float(value)
+  except (TypeError, ValueError):
+    return NAN
+  if value == MISSING:
+    return NAN
+  return value
+
+
+class ObsRecord(object):
+  """
+  One observation in a fixed layout. Measured values live in `values`, an
+  array('d') ordered as FIELDS; `units` is a shared tuple in the same order.
+  """
+
+  __slots__ = ('epoch', 'values', 'units', 'beaufort') + TEXT_FIELDS
+
+  def __init__(self, epoch=None, values=None, units=None, beaufort=None, **text):
+    self.epoch = epoch
+    self.values = array('d', values if values is not None else [NAN] * len(FIELDS))
+    self.units = shared_units(units if units is not None else [''] * len(FIELDS))
+    self.beaufort = beaufort
+    for name in TEXT_FIELDS:
+      setattr(self, name, text.get(name, ''))
+
+
+  @classmethod
+  def from_obs(cls, obs):
+    """
+    Build a record from a (merged) WeatherDict.obs dict.
+    """
+    text = dict([(name, obs.get(name, '')) for name in TEXT_FIELDS])
+    if isinstance(text['weather'], list):
+      text['weather'] = ' '.join([str(item) for item in text['weather']])
+    return cls(epoch=obs_epoch(obs.get('timestamp')),
+               values=[to_float(obs[field]['value']) for field in FIELDS],
+               units=[obs[field]['units'] for field in FIELDS],
+               beaufort=obs.get('beaufort'),
+               **text)
+
+
+  def get(self, field):
+    """
+    Value of one measured field, or None if it is missing.
+    """
+    value = self.values[FIELD_INDEX[field]]
+    if math.isnan(value):
+      return None
+    return value
+
+
+  def unit(self, field):
+    """
+    Units of one measured field.
+    """
+    return self.units[FIELD_INDEX[field]]
+
+
+  def entry(self, field):
+    """
+    (value-or-'None', units, label) for one measured field.
+    """
+    idx = FIELD_INDEX[field]
+    if math.isnan(self.values[idx]):
+      return 'None', '', LABELS[idx]
+    return self.values[idx], self.units[idx], LABELS[idx]
+
+
+  def entries(self):
+    """
+    Yield (field, value-or-'None', units, label) for each measured field.
+    """
+    for field, value, unit, label in zip(FIELDS, self.values, self.units, LABELS):
+      if math.isnan(value):
+        yield field, 'None', '', label
+      else:
+        yield field, value, unit, label
+
+
+  def to_json(self):
+    """
+    The nested dict shape written to current_conditions.json (and expected
+    by the dashboard), built on demand rather than kept around.
+    """
+    result = dict([(field, {'value': value, 'units': unit, 'label': label})
+                   for field, value, unit, label in self.entries()])
+    for name in TEXT_FIELDS:
+      result[name] = getattr(self, name)
+    result['beaufort'] = self.beaufort
+    return result
+
+
+  def as_row(self):
+    """
+    Flatten to an archive row: epoch, timestamp, the measured values (NULL
+    for missing), description, and the temperature/pressure/wind/visibility
+    units.
+    """
+    return tuple([self.epoch, self.timestamp] +
+                 [self.get(field) for field in FIELDS] +
+                 [self.textdescription, self.unit('temperature'),
+                  self.unit('pressure'), self.unit('wind'), self.unit('visibility')])
+
+
+  @classmethod
+  def from_row(cls, row):
+    """
+    Inverse of as_row(), for records read back from the archive.
+    """
+    nfields = len(FIELDS)
+    values = [NAN if value is None else value for value in row[2:2 + nfields]]
+    temp_units, pressure_units, wind_units, vis_units = row[3 + nfields:7 + nfields]
+    unit_map = {'temperature': temp_units, 'dewpoint': temp_units,
+                'windchill': temp_units, 'heatindex': temp_units,
+                'pressure': pressure_units, 'wind': wind_units, 'gusts': wind_units,
+                'humidity': '%', 'wind_direction': 'degrees', 'visibility': vis_units or ''}
+    return cls(epoch=row[0],
+               values=values,
+               units=[unit_map[field] for field in FIELDS],
+               timestamp=row[1],
+               textdescription=row[2 + nfields])
@@ -0,0 +1,215 @@
+"""
+stations.py: fetch several nearby observing stations concurrently and fill
+gaps in the primary station's observation from the nearest station with
+fresh, plausible data.
+"""
+
+from __future__ import print_function
+
+import os
+import json
+import math
+import time
+import logging
+from multiprocessing.pool import ThreadPool
+import weather_functions as wf
+import units
+from obs import Observation, is_missing
+from record import obs_epoch
+
+# Plausibility limits, in the named unit, for values borrowed from another station.
+QC_LIMITS = {'temperature': ['C', -80.0, 60.0],
+             'dewpoint': ['C', -90.0, 40.0],
+             'windchill': ['C', -90.0, 60.0],
+             'heatindex': ['C', -80.0, 80.0],
+             'pressure': ['kPa', 85.0, 110.0],
+             'wind': ['m_s-1', 0.0, 100.0],
+             'gusts': ['m_s-1', 0.0, 120.0],
+             'visibility': ['miles', 0.0, 100.0],
+             'humidity': ['%', 0.0, 100.0],
+             'wind_direction': ['degrees', 0.0, 360.0]
+            }
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+  """
+  Great-circle (haversine) distance in kilometers.
+  """
+  lat1, lon1, lat2, lon2 = [math.radians(float(x)) for x in [lat1, lon1, lat2, lon2]]
+  hav = (math.sin((lat2 - lat1) / 2.0) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2.0) ** 2)
+  return 6371.0 * 2.0 * math.asin(math.sqrt(hav))
+
+
+def passes_qc(key, entry):
+  """
+  True if an observation value is present and physically plausible.
+  """
+  if is_missing(entry['value']):
+    return False
+  if key not in QC_LIMITS:
+    return True
+  limit_unit, low, high = QC_LIMITS[key]
+  value = entry['value']
+  if entry['units'] and entry['units'] != limit_unit and limit_unit not in ['%', 'degrees']:
+    value = units.convert(value, from_unit=entry['units'], to_unit=limit_unit)
+  try:
+    return low <= float(value) <= high
+  except (TypeError, ValueError):
+    return False
+
+
+class StationNetwork(object):
+  """
+  A set of nearby stations (settings: nearby_stations) used to back up the
+  primary station. A small freshness index, kept in output_dir, remembers
+  each station's last observation time so that stations that have gone
+  quiet are skipped without a request until it is time to check them again.
+  """
+
+  def __init__(self, data, primary):
+    self.data = data
+    self.defaults = data['defaults']
+    self.primary = primary
+    self.stations = [s for s in data.get('nearby_stations') or [] if s != data['station']]
+    self.max_age = self.defaults.get('station_max_age', 5400)
+    self.retry = self.defaults.get('station_retry', 3600)
+    self.workers = self.defaults.get('station_workers', 4)
+    self.index_path = os.path.join(data['output_dir'], 'station_index.json')
+    self.index = self.load_index()
+    self.fresh = {}
+
+
+  def load_index(self):
+    """
+    Read the per-station freshness index, if there is one.
+    """
+    try:
+      with open(self.index_path, 'r') as index_file:
+        return json.load(index_file)
+    except (IOError, OSError, ValueError):
+      return {}
+
+
+  def is_due(self, station, now):
+    """
+    A station is skipped only if its last known observation is stale and it
+    was already checked within the retry interval.
+    """
+    entry = self.index.get(station)
+    if not entry:
+      return True
+    stale = now - (entry.get('last_obs') or 0) > self.max_age
+    checked_recently = now - (entry.get('last_checked') or 0) < self.retry
+    return not (stale and checked_recently)
+
+
+  def fetch_station(self, station):
+    """
+    Retrieve and parse one station's current observation. Returns
+    (station, obs dict or None, [lon, lat] or None).
+    """
+    station_data = dict(self.data)
+    station_data['station'] = station
+    observation = Observation(station_data)
+    returned_json = observation.fetch_current()
+    if not returned_json or 'properties' not in returned_json:
+      return station, None, None
+
+    con = observation.con1.obs
+    try:
+      observation.parse_primary_obs(returned_json=returned_json)
+      observation.fill_from_metar(con)
+      observation.fill_wind_chill(con)
+    except (KeyError, TypeError, ValueError, AttributeError) as exc:
+      logging.error('Unable to parse observation from %s: %s', station, exc)
+      return station, None, None
+    coords = (returned_json.get('geometry') or {}).get('coordinates')
+    return station, con, coords
+
+
+  def fetch_all(self):
+    """
+    Fetch every due station concurrently through a bounded pool, update the
+    freshness index, and keep the observations that are recent enough.
+    """
+    now = time.time()
+    due = [station for station in self.stations if self.is_due(station, now)]
+    skipped = [station for station in self.stations if station not in due]
+    if skipped:
+      logging.info('Skipping stale stations: %s', ', '.join(skipped))
+    if not due:
+      return self.fresh
+
+    pool = ThreadPool(max(1, min(self.workers, len(due))))
+    try:
+      results = pool.map(self.fetch_station, due)
+    finally:
+      pool.close()
+      pool.join()
+
+    for station, con, coords in results:
+      entry = self.index.setdefault(station, {})
+      entry['last_checked'] = now
+      if con is None:
+        continue
+      if coords:
+        entry['lon'], entry['lat'] = coords[0], coords[1]
+      epoch = obs_epoch(con['timestamp'])
+      if epoch is None:
+        continue
+      entry['last_obs'] = epoch
+      if now - epoch <= self.max_age:
+        self.fresh[station] = con
+      else:
+        logging.info('Observation from %s is stale (%s s old).', station, int(now - epoch))
+
+    wf.write_json(self.index, outputdir=self.data['output_dir'], filename='station_index.json')
+    return self.fresh
+
+
+  def by_distance(self):
+    """
+    Fresh stations ordered nearest-first from the configured lat/lon.
+    Stations without coordinates go last, in configured order.
+    """
+    def sort_key(station):
+      entry = self.index.get(station, {})
+      if 'lat' not in entry:
+        return float('inf')
+      return distance_km(self.data['lat'], self.data['lon'], entry['lat'], entry['lon'])
+    return sorted(self.fresh.keys(), key=sort_key)
+
+
+  def merge(self):
+    """
+    Fill each missing field of the primary observation from the nearest
+    fresh station whose value passes the QC limits.
+    """
+    ccp = self.primary.con1.obs
+    ordered = self.by_distance()
+    if not ordered:
+      return ccp
+
+    filled_wind = False
+    for key in self.primary.matchup:
+      if not is_missing(ccp[key]['value']):
+        continue
+      for station in ordered:
+        candidate = self.fresh[station][key]
+        if passes_qc(key, candidate):
+          ccp[key] = dict(candidate, station=station)
+          logging.info('Filled %s from %s: %s', key, station, candidate['value'])
+          filled_wind = filled_wind or key in ['wind', 'wind_direction']
+          break
+
+    for key in ['textdescription', 'timestamp']:
+      if is_missing(ccp[key]):
+        for station in ordered:
+          if not is_missing(self.fresh[station][key]):
+            ccp[key] = self.fresh[station][key]
+            break
+
+    if filled_wind:
+      self.primary.derive_wind(ccp)
+    return ccp
@@ -0,0 +1,144 @@
+"""
+textarchive.py: an SQLite archive of NWS text products (AFD, HWO, ZFP, FTM),
+one row per distinct issuance, with an FTS5 full-text index so that past
+products can be searched without reading files.
+"""
+
+from __future__ import print_function
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS products (
+  id INTEGER PRIMARY KEY,
+  sha TEXT UNIQUE,
+  product TEXT,
+  office TEXT,
+  issued TEXT,
+  fetched INTEGER,
+  body TEXT
+);
+CREATE INDEX IF NOT EXISTS products_fetched ON products (fetched);
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+  body, content='products', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS products_ai AFTER INSERT ON products BEGIN
+  INSERT INTO products_fts (rowid, body) VALUES (new.id, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS products_ad AFTER DELETE ON products BEGIN
+  INSERT INTO products_fts (products_fts, rowid, body) VALUES ('delete', old.id, old.body);
+END;
+'''
+
+SEARCH = '''
+SELECT products.product, products.office, products.issued, products.fetched,
+       snippet(products_fts, 0, '[', ']', '...', 16)
+FROM products_fts JOIN products ON products.id = products_fts.rowid
+WHERE products_fts MATCH ? AND products.fetched >= ? {0}
+ORDER BY bm25(products_fts)
+LIMIT ?
+'''
+
+
+class TextArchive(object):
+  """
+  Text products keyed by the SHA-1 of their text, so that a product fetched
+  again without being reissued is stored only once.
+  """
+
+  def __init__(self, path, retention_days=365):
+    self.path = path
+    self.retention = int(retention_days * 86400)
+    self.conn = None
+
+
+  @classmethod
+  def from_settings(cls, data):
+    """
+    Build the archive from the settings/defaults dict.
+    """
+    path = data.get('text_archive_file', 'textproducts.sqlite')
+    if not os.path.isabs(path):
+      path = os.path.join(data['output_dir'], path)
+    return cls(path, retention_days=data['defaults'].get('text_archive_retention_days', 365))
+
+
+  def open(self, readonly=False):
+    """
+    Connect, and create the schema if needed (read-write connections only).
+    """
+    if self.conn is not None:
+      return self.conn
+    if readonly:
+      self.conn = sqlite3.connect('file:{0}?mode=ro'.format(self.path), uri=True)
+      return self.conn
+    self.conn = sqlite3.connect(self.path)
+    self.conn.execute('PRAGMA journal_mode=WAL')
+    self.conn.executescript(SCHEMA)
+    return self.conn
+
+
+  def close(self):
+    """
+    Commit and close the database connection.
+    """
+    if self.conn is not None:
+      self.conn.commit()
+      self.conn.close()
+      self.conn = None
+
+
+  def add(self, product, office, issued, text, now=None):
+    """
+    Store one product issuance unless identical text is already archived,
+    then enforce the retention limit. Returns True if a row was added.
+    """
+    now = int(now or time.time())
+    sha = hashlib.sha1(text.encode('utf-8')).hexdigest()
+    self.open()
+    cursor = self.conn.execute('INSERT OR IGNORE INTO products '
+                               '(sha, product, office, issued, fetched, body) '
+                               'VALUES (?, ?, ?, ?, ?, ?)',
+                               (sha, product, office, issued, now, text))
+    if cursor.rowcount:
+      logging.info('Archived %s %s (%s).', product, issued, sha[:12])
+    self.prune(now)
+    self.conn.commit()
+    return bool(cursor.rowcount)
+
+
+  def prune(self, now):
+    """
+    Delete products fetched before the retention period.
+    """
+    removed = self.conn.execute('DELETE FROM products WHERE fetched < ?',
+                                (now - self.retention,)).rowcount
+    if removed:
+      logging.info('Removed %s text products older than the retention period.', removed)
+    return removed
+
+
+  def search(self, query, product=None, days=None, limit=50):
+    """
+    Full-text search (FTS5 query syntax, e.g. 'dryline' or 'dryline NEAR
+    storms'), best matches first. Optionally limit to one product type and
+    to the last N days. Returns a list of dicts with a highlighted snippet.
+    """
+    self.open(readonly=True)
+    since = 0
+    if days:
+      since = int(time.time() - float(days) * 86400)
+    params = [query, since]
+    extra = ''
+    if product:
+      extra = 'AND products.product = ?'
+      params.append(product.upper())
+    params.append(int(limit))
+
+    rows = self.conn.execute(SEARCH.format(extra), params).fetchall()
+    return [dict(product=row[0], office=row[1], issued=row[2], fetched=row[3],
+                 snippet=row[4]) for row in rows]
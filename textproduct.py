@@ -0,0 +1,273 @@
+"""
+textproduct.py: one client for the NWS text products served by
+forecast.weather.gov/product.php (HWO, FTM, AFD, ZFP, ...).
+
+The product text is pulled out of the page's <pre> block with a regular
+expression rather than a full HTML parse, and each product is cached in
+output_dir by product and issuing office, keyed on its WMO heading (e.g.
+'FXUS64 KFWD 191130'). When a product has not been reissued since the last
+run, callers get their previously parsed result back from the cache and
+can skip parsing it again. Each new issuance is also added to the
+full-text archive (textarchive.py).
+
+segment() splits product text into its sections in one pass, for the
+product-specific parsers in hwo.py and forecast.py, and zone_index() maps
+each UGC zone code in a segmented product to its segment.
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import json
+import sqlite3
+import hashlib
+import logging
+from collections import namedtuple
+import requests
+from textarchive import TextArchive
+
+try:
+  from html import unescape
+except ImportError:
+  from HTMLParser import HTMLParser
+  unescape = HTMLParser().unescape
+
+PRE_BLOCK = re.compile(r'<pre[^>]*>(.*?)</pre>', re.I | re.S)
+TAGS = re.compile(r'<[^>]+>')
+WMO_HEADING = re.compile(r'^([A-Z]{4}\d{2}) ([A-Z]{4}) (\d{6})(?: ([A-Z]{3}))?\s*$', re.M)
+
+# A section header ('.DAY ONE...', '.SHORT TERM...', '.TONIGHT...') or a
+# terminator ('&&' ends an AFD section, '$$' ends a product segment).
+SECTION_MARK = re.compile(r'^[ \t]*(?:\.([A-Za-z][\w /&-]*?)\.\.\.|(\$\$|&&)[ \t]*$)', re.M)
+# The first line of a UGC string, e.g. 'TXZ091>095-100-OKZ001-200900-'.
+UGC_START = re.compile(r'^[A-Z]{2}[CZ](?:\d{3}|ALL)[->]', re.M)
+UGC_EXPIRES = re.compile(r'^\d{6}$')
+WHITESPACE = re.compile(r'\s+')
+PARAGRAPH = re.compile(r'\n[ \t]*\n')
+
+# title is None for text that is not under a header (e.g. a segment's UGC
+# and zone-name preamble); block counts the '$$' segments.
+Section = namedtuple('Section', ['title', 'body', 'block'])
+
+
+def segment(text):
+  """
+  Yield a Section for each header in a product, in order, with the text up
+  to the next header or terminator as its body. Text between a terminator
+  and the next header comes back as an untitled section.
+  """
+  block = 0
+  title = None
+  start = 0
+  for match in SECTION_MARK.finditer(text):
+    body = text[start:match.start()]
+    if title is not None or body.strip():
+      yield Section(title, body, block)
+    title = match.group(1)
+    if match.group(2) == '$$':
+      block = block + 1
+    start = match.end()
+
+  body = text[start:]
+  if title is not None or body.strip():
+    yield Section(title, body, block)
+
+
+def flatten(text):
+  """
+  Collapse a section body onto one line: leading dots and all runs of
+  whitespace (including line breaks) become single spaces.
+  """
+  return WHITESPACE.sub(' ', text).strip().lstrip('.').strip()
+
+
+def headline(body):
+  """
+  Split a section body into its first line (the headline that follows the
+  header on the same line, without the final period) and the flattened rest.
+  """
+  first, _, rest = body.lstrip('.').partition('\n')
+  return first.strip().rstrip('.').strip(), flatten(rest)
+
+
+def paragraphs(text):
+  """
+  The flattened, non-empty paragraphs of a section body.
+  """
+  return [flatten(part) for part in PARAGRAPH.split(text) if part.strip()]
+
+
+def extract_pre(html, min_length=0):
+  """
+  Return the text of the first <pre> block longer than min_length
+  characters, with any markup inside it removed and entities decoded.
+  """
+  for match in PRE_BLOCK.finditer(html):
+    text = unescape(TAGS.sub('', match.group(1)))
+    if len(text) > min_length:
+      return text
+  return None
+
+
+def wmo_heading(text):
+  """
+  The WMO abbreviated heading of a product, e.g. 'FXUS64 KFWD 191130' (with
+  any correction/amendment indicator), or None if there is not one.
+  """
+  match = WMO_HEADING.search(text or '')
+  if not match:
+    return None
+  return ' '.join([group for group in match.groups() if group])
+
+
+class TextProduct(object):
+  """
+  A single product from a single issuing office.
+  """
+
+  def __init__(self, data, product, issuedby, site='NWS', params=None, min_length=0,
+               url=None):
+    self.data = data
+    self.url = url or data['defaults']['afd_url']
+    self.product = product
+    self.issuedby = issuedby
+    self.params = dict(site=site, issuedby=issuedby, product=product)
+    self.params.update(params or {})
+    self.min_length = min_length
+    self.cache_dir = os.path.join(data['output_dir'],
+                                  data['defaults'].get('text_product_dir', 'products'))
+    self.cache_path = os.path.join(self.cache_dir,
+                                   '{0}_{1}.json'.format(product, issuedby).lower())
+    self.cache = self.load_cache()
+    self.text = None
+    self.issued = None
+
+
+  def load_cache(self):
+    """
+    Read the cached copy of this product, if there is one.
+    """
+    try:
+      with open(self.cache_path, 'r') as cache_file:
+        return json.load(cache_file)
+    except (IOError, OSError, ValueError):
+      return {}
+
+
+  def fetch(self):
+    """
+    Download the product and return its text, or None.
+    """
+    logging.debug('Requesting %s from %s: %s', self.product, self.url, self.params)
+    try:
+      response = requests.get(self.url, params=self.params, verify=True, timeout=10)
+    except requests.exceptions.RequestException as exc:
+      logging.error('Request for %s failed: %s', self.product, exc)
+      return None
+
+    if response.status_code != 200:
+      logging.error('Response from server was not OK: %s', response.status_code)
+      return None
+
+    self.text = extract_pre(response.text, self.min_length)
+    if self.text is None:
+      logging.warning('No %s text found in the response.', self.product)
+      return None
+
+    self.issued = wmo_heading(self.text)
+    if self.issued is None:
+      self.issued = hashlib.sha1(self.text.encode('utf-8')).hexdigest()
+    logging.info('%s from %s: %s', self.product, self.issuedby, self.issued)
+    if self.is_new():
+      self.archive_text()
+    return self.text
+
+
+  def archive_text(self):
+    """
+    Add this issuance to the text-product archive.
+    """
+    archive = TextArchive.from_settings(self.data)
+    try:
+      return archive.add(self.product, self.issuedby, self.issued, self.text)
+    except sqlite3.Error as exc:
+      logging.error('Unable to archive %s: %s', self.product, exc)
+      return False
+    finally:
+      archive.close()
+
+
+  def is_new(self):
+    """
+    True if the product fetched this run differs from the cached one.
+    """
+    return self.issued is None or self.issued != self.cache.get('issued')
+
+
+  def cached_result(self):
+    """
+    The parsed result stored for this issuance, or None if the product has
+    been reissued (or was never parsed).
+    """
+    if self.text is None or self.is_new():
+      return None
+    logging.info('%s %s is unchanged; using the cached parse.', self.product, self.issued)
+    return self.cache.get('parsed')
+
+
+  def save_result(self, parsed):
+    """
+    Cache the text and parsed result of this issuance.
+    """
+    if self.text is None:
+      return False
+    self.cache = dict(issued=self.issued, text=self.text, parsed=parsed)
+    try:
+      if not os.path.isdir(self.cache_dir):
+        os.makedirs(self.cache_dir)
+      with open(self.cache_path, 'w') as cache_file:
+        json.dump(self.cache, cache_file)
+    except (IOError, OSError, TypeError) as exc:
+      logging.error('Unable to cache %s: %s', self.product, exc)
+      return False
+    return True
+
+
+def parse_ugc(text):
+  """
+  Expand the first UGC string in a block of text into its zone (or county)
+  codes. The string may run over several lines, holds ranges such as
+  'TXZ091>095' and repeats of the state/type prefix, and ends with the
+  DDHHMM expiration. Returns (list of codes, expiration or None).
+  """
+  start = UGC_START.search(text)
+  if not start:
+    return [], None
+
+  codes = []
+  prefix = ''
+  for token in WHITESPACE.sub('', text[start.start():]).split('-'):
+    if UGC_EXPIRES.match(token):
+      return codes, token
+    if len(token) >= 6 and token[:3].isalpha():
+      prefix, token = token[:3], token[3:]
+    first, _, last = token.partition('>')
+    if not (prefix and first.isdigit() and (not last or last.isdigit())):
+      break
+    for number in range(int(first), int(last or first) + 1):
+      codes.append('{0}{1:03d}'.format(prefix, number))
+  return codes, None
+
+
+def zone_index(sections):
+  """
+  Map every UGC code in a segmented product to the block (the '$$' segment
+  number) that carries its forecast.
+  """
+  index = dict()
+  for section in sections:
+    if section.title is None:
+      for code in parse_ugc(section.body)[0]:
+        index.setdefault(code, section.block)
+  return index
@@ -0,0 +1,125 @@
+"""
+units.py: precomputed unit conversions, with a scalar fast path for single
+observations and a NumPy batch API for whole series (a day of observations,
+every forecast period, an archive of pressure readings).
+
+Every unit is defined once, as a linear map onto a base unit for its
+quantity, and the pairwise factor/offset table is built from those at import
+time. Inverse conversions therefore always agree with forward ones.
+"""
+
+from __future__ import division
+
+import re
+import logging
+import numpy as np
+
+MISSING = -9999.9
+
+PERCENTS = ['percent', 'pct', '%', 'Percent']
+
+# unit: (scale, offset) such that base = value * scale + offset
+BASE_UNITS = {
+    'velocity': {'m_s-1': (1.0, 0.0),
+                 'kph': (1.0 / 3.6, 0.0),
+                 'km_h-1': (1.0 / 3.6, 0.0),
+                 'mph': (0.44704, 0.0),
+                 'kt': (1852.0 / 3600.0, 0.0)
+                },
+    'pressure': {'Pa': (1.0, 0.0),
+                 'hPa': (100.0, 0.0),
+                 'mb': (100.0, 0.0),
+                 'kPa': (1000.0, 0.0),
+                 'bar': (100000.0, 0.0),
+                 'inHg': (3386.390607, 0.0)
+                },
+    'temperature': {'K': (1.0, 0.0),
+                    'C': (1.0, 273.15),
+                    'F': (5.0 / 9.0, 273.15 - (32.0 * 5.0 / 9.0)),
+                    'R': (5.0 / 9.0, 0.0)
+                   },
+    'distance': {'m': (1.0, 0.0),
+                 'km': (1000.0, 0.0),
+                 'kilometers': (1000.0, 0.0),
+                 'miles': (1609.344, 0.0),
+                 'mi': (1609.344, 0.0),
+                 'sm': (1609.344, 0.0),
+                 'ft': (0.3048, 0.0)
+                }
+   }
+
+
+def build_factor_table(base_units):
+  """
+  Turn the per-quantity base-unit definitions into a flat
+  {(from_unit, to_unit): (factor, offset)} table.
+  """
+  table = {}
+  for units in base_units.values():
+    for from_unit, (scale1, offset1) in units.items():
+      for to_unit, (scale2, offset2) in units.items():
+        table[(from_unit, to_unit)] = (scale1 / scale2, (offset1 - offset2) / scale2)
+  return table
+
+
+FACTORS = build_factor_table(BASE_UNITS)
+
+UNIT_PREFIX = re.compile(r'^(?:wmoUnit|unit):\s*')
+DEGREE_PREFIX = re.compile(r'^deg([CFKR])$')
+
+
+def normalize_unit(code):
+  """
+  Reduce an NWS API unit code ('wmoUnit:degC', 'unit:km_h-1', 'wmoUnit:Pa')
+  to the plain names used in settings.yml and the factor table.
+  """
+  code = UNIT_PREFIX.sub('', code)
+  return DEGREE_PREFIX.sub('\\1', code)
+
+
+def convert(value, from_unit, to_unit, missing=MISSING):
+  """
+  Scalar conversion of a single value. Empty and missing inputs come back as
+  the missing-value sentinel; percentages pass through untouched.
+  """
+  if value is None or value == '' or value == 'None':
+    return missing
+  if from_unit in PERCENTS or to_unit in PERCENTS:
+    return value
+  if value == missing:
+    return missing
+
+  try:
+    factor, offset = FACTORS[(from_unit, to_unit)]
+  except KeyError:
+    logging.error('No conversion from %s to %s. Returning None.', from_unit, to_unit)
+    return None
+
+  try:
+    return float(value) * factor + offset
+  except ValueError:
+    return None
+
+
+def convert_array(values, from_unit, to_unit, missing=MISSING, masked=False):
+  """
+  Convert a whole series in one call. Any NaN (including None entries) or
+  missing-value sentinel is masked out and comes back as the sentinel, or as
+  a masked entry if masked=True.
+  """
+  arr = np.asarray(values, dtype=float)
+  mask = np.isnan(arr) | np.isclose(arr, missing)
+
+  if from_unit in PERCENTS or to_unit in PERCENTS:
+    out = arr.copy()
+  else:
+    try:
+      factor, offset = FACTORS[(from_unit, to_unit)]
+    except KeyError:
+      raise ValueError('No conversion from {0} to {1}'.format(from_unit, to_unit))
+    out = arr * factor + offset
+
+  if masked:
+    return np.ma.masked_array(out, mask=mask)
+  out[mask] = missing
+  return out
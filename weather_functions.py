@@ -16,6 +16,8 @@ import logging
 
 from time import sleep
 from outage import Outage
+import units
+import derived
 import requests
 import yaml
 import pytz
@@ -157,7 +159,7 @@ def write_dict(filepath, some_dict):
   Write out a dict to a text file.
   """
   with open(filepath, 'w') as current_alerts:
-    for key, value in some_dict.iteritems():
+    for key, value in some_dict.items():
       logging.debug('Key for this alert entry: %s', key)
       current_alerts.write('{0}: {1}\n'.format(key, value))
 
@@ -226,20 +228,10 @@ def wind_direction(azimuth, data):
   """
   Convert "wind coming from an azimuth" to cardinal directions
   """
-  try:
-    azimuth = float(azimuth)
-  except Exception as exc:
-    logging.error('Unable to convert azimuth to a numerical value: %s.\nReturning None.', exc)
-    return None
-
-  plusminus = data['defaults']['plusminus'] # 11.25 degrees
-
-  for az_deg, val in data['defaults']['azdir'].iteritems():
-    az_deg = float(az_deg)
-    if (az_deg - plusminus < azimuth) and (az_deg + plusminus >= azimuth):
-      return val
-
-  return 'None'
+  cardinal = derived.cardinal_scalar(azimuth)
+  if cardinal is None:
+    logging.error('Unable to convert azimuth %s to a cardinal direction. Returning None.', azimuth)
+  return cardinal
 
 
 def get_hydrograph(abbr,
@@ -299,7 +291,7 @@ def htable_current_conditions(con_dict,
   try:
     with open(os.path.join(outputdir, tablefile), 'w') as htmlout:
       htmlout.write('<table>\n')
-      for key, value in con_dict.iteritems():
+      for key, value in con_dict.items():
         logging.debug('%s: %s', key, value)
         htmlout.write('<tr><td>{0}</td><td>{1} {2}</td></tr>\n'.format(value[2],
                                                                        value[0],
@@ -331,85 +323,10 @@ def convert_units(value, from_unit, to_unit, missing=-9999.9):
   """
   As elsewhere, this function depends on use of specific unit conventions,
   as labeled in the settings.yml document (and comments).
+  The conversion factors live in a precomputed table in units.py; use
+  units.convert_array() to convert a whole series at once.
   """
-  convertme = {'m_s-1':
-               {'kph': lambda x: float(x) * 3.6,
-                'mph': lambda x: float(x) * 2.23694,
-                'kt': lambda x: float(x) * 1.94384
-               },
-               'kph':
-               {'m_s-1': lambda x: float(x) * 0.2778,
-                'mph': lambda x: float(x) * 0.62137,
-                'kt': lambda x: float(x) * 0.54
-               },
-               'km_h-1':
-               {'m_s-1': lambda x: float(x) * 0.2778,
-                'mph': lambda x: float(x) * 0.62137,
-                'kt': lambda x: float(x) * 0.54
-               },
-               'mph':
-               {'m_s-1': lambda x: float(x) * 0.4470389,
-                'kph': lambda x: float(x) * 1.60934,
-                'kt': lambda x: float(x) * 0.869
-               },
-               'kt':
-               {'m_s-1': lambda x: float(x) * 0.514443,
-                'mph': lambda x: float(x) * 1.1508,
-                'kph': lambda x: float(x) * 1.852
-               },
-               'mb':
-               {'Pa': lambda x: float(x) * 100.0,
-                'kPa': lambda x: float(x) * 0.10,
-                'bar': lambda x: float(x) * 1000.0,
-                'inHg': lambda x: float(x) * 0.02953
-               },
-               'Pa':
-               {'mb': lambda x: float(x) * 1E-2,
-                'kPa': lambda x: float(x) * 1E-3,
-                'bar': lambda x: float(x) * 1E-5,
-                'inHg': lambda x: float(x) * 0.0002953
-               },
-               'kPa':
-               {'mb': lambda x: float(x) * 1E5,
-                'Pa': lambda x: float(x) * 1E3,
-                'bar': lambda x: float(x) * 0.01,
-                'inHg': lambda x: float(x) * 0.2953
-               },
-               'inHg':
-               {'mb': lambda x: float(x) * 33.86390607,
-                'Pa': lambda x: float(x) * 3386.390607,
-                'bar': lambda x: float(x) * 0.03386390607,
-                'kPa': lambda x: float(x) * 3.386390607
-               },
-               'C':
-               {'F': lambda x: (float(x) * 9.0/5.0) + 32.0,
-                'R': lambda x: (float(x) * 9.0/5.0) + 491.67,
-                'K': lambda x: float(x) + 273.15
-               },
-               'F':
-               {'C': lambda x: (float(x) - 32.0) * 5.0 / 9.0,
-                'R': lambda x: float(x) + 491.67,
-                'K': lambda x: ((float(x) - 32.0) * 5.0 / 9.0) + 273.15
-               },
-               'percent':
-               {'percent': lambda x: x
-               }
-              }
-
-  percents = ['percent', 'pct', '%', 'Percent']
-  if value == '' or value == 'None' or value is None:
-    return missing
-  if from_unit in percents or to_unit in percents:
-    return value
-
-  if value == missing:
-    return missing
-  try:
-    return convertme[from_unit][to_unit](value)
-  except ValueError:
-    return None
-
-  return None
+  return units.convert(value, from_unit, to_unit, missing=missing)
 
 
 def beaufort_scale(data, speed, units='mph'):
@@ -425,19 +342,11 @@ def beaufort_scale(data, speed, units='mph'):
   if units != 'mph':
     speed = convert_units(speed, from_unit=units, to_unit='mph')
   logging.debug('output speed value: %s mph', speed)
-  speed = int(speed)
-  logging.debug('integer speed value: %s mph', speed)
-
-  for i in blist.keys():
-    logging.debug('Key: %s\tmin speed: %s\tmax speed: %s', i, blist[i][0], blist[i][1])
-    if int(blist[i][0]) <= speed and speed <= int(blist[i][1]):
-      logging.debug('Speed (%s mph) between %s & %s. Returning %s', speed,
-                                                                    blist[i][0],
-                                                                    blist[i][1],
-                                                                    i)
-      return int(i)
-
-  return None
+  if speed is None or speed == data['defaults']['missing']:
+    return None
+  rank = derived.beaufort_scalar(speed, derived.beaufort_edges(blist))
+  logging.debug('Speed (%s mph) is Beaufort %s', speed, rank)
+  return rank
 
 
 def make_request(url, retries=1, payload=False, use_json=True):
@@ -508,7 +417,7 @@ def populate_alert_counties(somedict, alerts_url):
   """
   returndict = {}
 
-  for key, values in somedict.iteritems():
+  for key, values in somedict.items():
     statezonelist = get_zonelist(key, 'zone', alerts_url)
     if not statezonelist:
       return None
@@ -5,10 +5,13 @@ of useful weather data.
 
 from __future__ import print_function
 
+import io
 import os
 import re
-import svgwrite
+import json
 import logging
+from xml.sax.saxutils import escape
+from iconmatch import icon_matcher
 
 def fix_missing(value):
   """
@@ -25,159 +28,181 @@ def fix_missing(value):
     return '--'
   
 
-def precip_chance_svg(morning, evening, filename, outputdir='/tmp/', iconheight=50):
+# The icons are small enough that plain string templates, formatted once
+# per icon, are much cheaper than building an svgwrite object tree.
+SVG_OPEN = (u'<?xml version="1.0" encoding="utf-8" ?>\n'
+            u'<svg baseProfile="full" height="{height}" version="1.1" width="{width}" '
+            u'xmlns="http://www.w3.org/2000/svg" xmlns:ev="http://www.w3.org/2001/xml-events" '
+            u'xmlns:xlink="http://www.w3.org/1999/xlink">')
+
+TEXT_STYLE = (u'.{stylename} {{ font: bold {fontsize}px sans-serif; fill:{fontcolor}; '
+              u'stroke:#000000; stroke-width:{stroke}px; stroke-linecap:butt; '
+              u'stroke-linejoin:miter; stroke-opacity:{opacity}; }}')
+
+PRECIP_TEMPLATE = (SVG_OPEN +
+                   u'<defs><style type="text/css"><![CDATA[.background {{fill: {background}; '
+                   u'stroke: #f0f0f0f0;}}{morning_style}{evening_style}]]></style></defs>'
+                   u'<rect class="background" height="{height}" width="{width}" x="0" y="0" />'
+                   u'<text x="0" y="0">'
+                   u'<tspan class="evening" x="8" y="{top}">{evening}</tspan>'
+                   u'<tspan class="morning" x="2" y="{bottom}">{morning}</tspan>'
+                   u'</text></svg>\n')
+
+HIGH_LOW_TEMPLATE = (SVG_OPEN +
+                     u'<defs><style type="text/css"><![CDATA[.background {{fill: #f0f0f0f0; '
+                     u'stroke: #f0f0f0f0;}}{low_style}{high_style}]]></style></defs>'
+                     u'<text x="0" y="0">'
+                     u'<tspan class="high" x="3" y="{top}">{high}\xb0</tspan>'
+                     u'<tspan class="low" x="3" y="{bottom}">{low}\xb0</tspan>'
+                     u'</text></svg>\n')
+
+PRECIP_COLORS = ['#baa87d', '#7ae6c0', '#2bb5aa', '#023dbd', '#035740']
+
+# Written by build_assets.py to output_dir: the icon sprite and its fragments.
+SPRITE_MANIFEST = 'sprite_manifest.json'
+
+_MANIFESTS = {}
+
+
+def precip_chance_markup(morning, evening, iconheight=50):
   """
-  Take the day's precip chances and produce a color-coded svg of percentages.
+  SVG text for the day's precip chances: color-coded by the higher chance,
+  evening on top and morning below. Chances outside 0-100 get the color of
+  the nearer end of the scale.
   """
   fontheight = (iconheight / 2) - 2
-  svg_info = {'high_coords': (8, fontheight),
-              'low_coords': (2, iconheight - 2),
-              'dimensions': (65, iconheight),
-              'colors': ['#baa87d', '#7ae6c0', '#2bb5aa', '#023dbd', '#035740'],
-              'fontcolor': 'white',
-              'fontheight': fontheight
-             }
-
-  bgc = svg_info['colors'][int(max(morning, evening)/100.0 * (len(svg_info['colors']) - 1))]
+  chance = min(max(max(morning, evening), 0), 100)
+  bgc = PRECIP_COLORS[int(chance/100.0 * (len(PRECIP_COLORS) - 1))]
 
   if not re.search(r'%$', str(evening)):
     evening = '{0}%'.format(evening)
   if not re.search(r'%$', str(morning)):
     morning = '{0}%'.format(morning)
 
-  style1 = '''.{stylename} {openbrace} font: bold {fontsize}px sans-serif;
-  fill:{fontcolor}; stroke:#000000; stroke-width:2px; stroke-linecap:butt;
-  stroke-linejoin:miter; stroke-opacity:0.5; {closebrace}'''
-
-  dwg = svgwrite.Drawing(os.path.join(outputdir, filename),
-                         size=svg_info['dimensions'])
-
-  dwg_styles = svgwrite.container.Style(content='.background {fill: ' + bgc +
-                                        '; stroke: #f0f0f0f0;}')
-  dwg_styles.append(content=style1.format(stylename='morning', openbrace='{',
-                                          fontsize=fontheight, fontcolor='#f2df94',
-                                          closebrace='}'))
-  dwg_styles.append(content=style1.format(stylename='evening', openbrace='{',
-                                          fontsize=fontheight, fontcolor='#ffd4fb',
-                                          closebrace='}'))
-  dwg.defs.add(dwg_styles)
-  evening = fix_missing(evening) 
-  morning = fix_missing(morning) 
-  evening_text = svgwrite.text.TSpan(text=evening,
-                                     insert=svg_info['high_coords'],
-                                     class_='evening')
-  morning_text = svgwrite.text.TSpan(text=morning,
-                                     insert=svg_info['low_coords'],
-                                     class_='morning')
-  frame = svgwrite.shapes.Rect(insert=(0, 0),
-                               size=svg_info['dimensions'],
-                               class_='background')
-  text_block = svgwrite.text.Text('', x='0', y='0')
-  text_block.add(evening_text)
-  text_block.add(morning_text)
-  dwg.add(frame)
-  dwg.add(text_block)
-  dwg.save(pretty=True)
-
-  return 0
+  return PRECIP_TEMPLATE.format(
+      height=iconheight, width=65, background=bgc, top=fontheight, bottom=iconheight - 2,
+      morning_style=TEXT_STYLE.format(stylename='morning', fontsize=fontheight,
+                                      fontcolor='#f2df94', stroke=2, opacity=0.5),
+      evening_style=TEXT_STYLE.format(stylename='evening', fontsize=fontheight,
+                                      fontcolor='#ffd4fb', stroke=2, opacity=0.5),
+      morning=escape(str(fix_missing(morning))),
+      evening=escape(str(fix_missing(evening))))
 
 
-def high_low_svg(high, low, filename, outputdir='/tmp/', iconheight=50, iconwidth=50):
+def high_low_markup(high, low, iconheight=50, iconwidth=50):
   """
-  Use svgwrite to make a simple graphic with high/low temps for the day's
-  forecast.
-  Unicode deg-Celsius is U+2103 (only for UTF-16)
-  Unicode deg-Fahrenheit is U+2109 (only for UTF-16)
-  Unicode degree symbol is U+00B0 ('\xb0') -- same as Latin-1 encoding, but is
-  not available in 1963-standard 7-bit ASCII
+  SVG text for the day's forecast high (red, on top) and low (blue) temps.
+  The degree sign is U+00B0; the file is written as UTF-8.
   """
   fontheight = (iconheight / 2) - 2
-  svg_info = {'high_coords': (3, fontheight),
-              'low_coords': (3, iconheight - 2),
-              'dimensions': (iconwidth, iconheight),
-              'colors': ['#baa87d', '#7ae6c0', '#2bb5aa', '#023dbd', '#035740'],
-              'fontcolor': ['blue', 'red', 'white'],
-              'fontheight': fontheight
-             }
-
-  # high_coords = (3, 18)
-  # low_coords = (3, 40)
-  # dimensions = (iconheight, iconwidth)
-  style1 = '.{stylename} {openbrace} font: bold {fontsize}px sans-serif;\
-  fill:{fontcolor}; stroke:#000000; stroke-width:1px; stroke-linecap:butt;\
-  stroke-linejoin:miter; stroke-opacity:0.7; {closebrace}'
-
-  dwg = svgwrite.Drawing(os.path.join(outputdir, filename), size=svg_info['dimensions'])
-  dwg_styles = svgwrite.container.Style(content='.background {fill: #f0f0f0f0; stroke: #f0f0f0f0;}')
-  dwg_styles.append(content=style1.format(stylename='low', openbrace='{',
-                                          fontsize=fontheight,
-                                          fontcolor=svg_info['fontcolor'][0],
-                                          closebrace='}'))
-  dwg_styles.append(content=style1.format(stylename='high', openbrace='{',
-                                          fontsize=fontheight + 2,
-                                          fontcolor=svg_info['fontcolor'][1],
-                                          closebrace='}'))
-  dwg.defs.add(dwg_styles)
-  high = fix_missing(high) 
-  low = fix_missing(low) 
-  high_symbol = (unicode(high) + u'\xb0')
-  low_symbol = (unicode(low) + u'\xb0')
-  high_text = svgwrite.text.TSpan(text=high_symbol,
-                                  insert=svg_info['high_coords'], class_='high')
-  low_text = svgwrite.text.TSpan(text=low_symbol,
-                                 insert=svg_info['low_coords'], class_='low')
-  text_block = svgwrite.text.Text('', x='0', y='0')
-  text_block.add(high_text)
-  text_block.add(low_text)
-  dwg.add(text_block)
-  dwg.save(pretty=True)
+  return HIGH_LOW_TEMPLATE.format(
+      height=iconheight, width=iconwidth, top=fontheight, bottom=iconheight - 2,
+      low_style=TEXT_STYLE.format(stylename='low', fontsize=fontheight,
+                                  fontcolor='blue', stroke=1, opacity=0.7),
+      high_style=TEXT_STYLE.format(stylename='high', fontsize=fontheight + 2,
+                                   fontcolor='red', stroke=1, opacity=0.7),
+      high=escape(str(fix_missing(high))),
+      low=escape(str(fix_missing(low))))
+
+
+# Icon type -> markup function, for render_icons().
+RENDERERS = {'temp': high_low_markup,
+             'precip': precip_chance_markup}
+
 
+def write_svg(markup, filename, outputdir='/tmp/'):
+  """
+  Write SVG text to outputdir/filename as UTF-8.
+  """
+  with io.open(os.path.join(outputdir, filename), 'w', encoding='utf-8') as svg_file:
+    svg_file.write(markup)
   return 0
 
 
+def render_icons(icons, outputdir=None):
+  """
+  Render a batch of icons in one call. Each item is (type, args) or
+  (type, args, filename), with type a key of RENDERERS and args its
+  positional values, e.g. ('temp', (81, 62), 'today_temp_plus_0.svg').
+  With no outputdir, return the SVG text of each icon, in order;
+  otherwise write each one to its filename and return the paths.
+  """
+  results = []
+  for icon in icons:
+    markup = RENDERERS[icon[0]](*icon[1])
+    if outputdir is None:
+      results.append(markup)
+      continue
+    write_svg(markup, icon[2], outputdir=outputdir)
+    results.append(os.path.join(outputdir, icon[2]))
+  return results
+
+
+def precip_chance_svg(morning, evening, filename, outputdir='/tmp/', iconheight=50):
+  """
+  Take the day's precip chances and produce a color-coded svg of percentages.
+  """
+  return write_svg(precip_chance_markup(morning, evening, iconheight=iconheight),
+                   filename, outputdir=outputdir)
+
+
+def high_low_svg(high, low, filename, outputdir='/tmp/', iconheight=50, iconwidth=50):
+  """
+  Write out a simple graphic with high/low temps for the day's forecast.
+  """
+  return write_svg(high_low_markup(high, low, iconheight=iconheight, iconwidth=iconwidth),
+                   filename, outputdir=outputdir)
+
+
 def make_forecast_icons(fc_dict, outputdir='/tmp/'):
   """
   Write out SVG icons of the next three days of temps and precip chances.
   """
   filelabel = 'today_{fctype}_plus_{day}.svg'
+  icons = []
   for i in range(0, 3):
-    high_low_svg(fc_dict[i]['high'], fc_dict[i]['low'],
-                 filelabel.format(fctype='temp', day=i),
-                 outputdir=outputdir
-                )
-    precip_chance_svg(int(fc_dict[i]['precip_morning']),
-                      int(fc_dict[i]['precip_evening']),
-                      filename=filelabel.format(fctype='precip', day=i),
-                      outputdir=outputdir
-                     )
-
+    icons.append(('temp', (fc_dict[i]['high'], fc_dict[i]['low']),
+                  filelabel.format(fctype='temp', day=i)))
+    icons.append(('precip', (int(fc_dict[i]['precip_morning']),
+                             int(fc_dict[i]['precip_evening'])),
+                  filelabel.format(fctype='precip', day=i)))
+  render_icons(icons, outputdir=outputdir)
   return True
 
 
 def assign_icon(description, icon_match):
   """
   Try to parse the language in forecasts for each to and match to an
-  appropriate weather SVG icon.
+  appropriate weather SVG icon. See iconmatch.py: exact phrases first, then
+  the longest listed phrase within the description.
   """
-  if description == ''
-    logging.warn('No description available for icon match. Returning NA.')
-    return 'wi-na.svg' 
+  return icon_matcher(icon_match).match(description)
 
-  returnvalue = ''
-  description = description.strip().lower()
-  description = re.sub(r'\s+', ' ', description)
-  logging.info('Finding icon for "%s"', description)
-  logging.debug('Found %s items in icon list.', len(icon_match.keys()))
-  for key, value in icon_match.iteritems():
-    logging.debug('Evaluating key %s and list %s', key, value)
-    for val in value:
-      if description == val.lower().strip():
-        returnvalue = key
-        logging.info('Matched "%s"', val)
-        return returnvalue
 
-  logging.warn('Unable to match "%s"', description)
-  return 'wi-na.svg'
+def icon_ref(icon, outputdir):
+  """
+  Sprite reference for an icon file name, e.g. 'icons.3f2a9c81d0e4.svg#wi-rain',
+  from the manifest that build_assets.py wrote to outputdir. None if there
+  is no manifest or the icon is not in the sprite.
+  """
+  path = os.path.join(outputdir, SPRITE_MANIFEST)
+  try:
+    mtime = os.path.getmtime(path)
+  except OSError:
+    return None
+  cached = _MANIFESTS.get(path)
+  if cached is None or cached[0] != mtime:
+    try:
+      with open(path, 'r') as manifest_file:
+        cached = (mtime, json.load(manifest_file))
+    except (IOError, ValueError) as exc:
+      logging.error('Unable to read the sprite manifest: %s', exc)
+      return None
+    _MANIFESTS[path] = cached
+  fragment = cached[1]['icons'].get(icon)
+  if fragment is None:
+    return None
+  return '{0}#{1}'.format(cached[1]['sprite'], fragment)
 
 
 def css_string(css_dict):
@@ -185,43 +210,56 @@ def css_string(css_dict):
   Convenience function to format a dict into a css_friendly string.
   """
   stylestring = '{'
-  for key, value in css_dict.iteritems():
+  for key, value in css_dict.items():
     stylestring = '{0}{1}:{2}; '.format(stylestring, key, value)
   stylestring = stylestring + '}'
   return stylestring
 
 
-def draw_compass_svg(degrees, data):
-  """
-  Drawing raw SVG via text and python.
-  """
-  wcd = data['defaults']['wind_compass']
-  # raw_svg_header = '<?xml version="1.0" encoding="utf-8"?>'
-
-  svg_invocation = '''<svg height="{height}" width="{width}" version="1.1" id="{id_label}"
+COMPASS_OPEN = '''<svg height="{height}" width="{width}" version="1.1" id="{id_label}"
   xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"
   x="0px" y="0px" viewBox="{viewbox}"
   style="enable-background:new {viewbox};" xml:ispace="preserve">'''
 
-  circle_css = data['defaults']['circle_css']
-  rot1_css = data['defaults']['rot1_css']
-  rot1_css['transform'] = 'rotate({0}deg)'.format(degrees)
-
-  svg_css = '<style>circle {0} .rot1 {1}</style>'.format(css_string(circle_css),
-                                                         css_string(rot1_css))
-
-  # symbol = '<symbol id="whole-icon"> <g class="rot1">
-  # <circle cx="20" cy="20" r="17" id="ring"/>
-  # <path d="M20 7 L 27 30 L 20 26 L 13 30 L 20 7 z" id="arrow" /></g> </symbol>'
-  # raw_svg_footer = '<use xlink:href="#whole-icon"/></svg>'
-
-  svg_string = '{0}{1}{2}{3}'.format(svg_invocation.format(height=wcd['height'],
-                                                           width=wcd['width'],
-                                                           id_label=wcd['id_label'],
-                                                           viewbox=wcd['viewbox']),
-                                     svg_css, wcd['symbol'], wcd['raw_svg_footer'])
-    # print(svg_string)
-  return svg_string
+_COMPASS_TABLES = {}
+
+
+def compass_table(defaults):
+  """
+  The wind compass SVG for every whole-degree heading, 0-359, built once
+  per defaults dict from its wind_compass, circle_css and rot1_css entries
+  (which are only read, never changed).
+  """
+  cached = _COMPASS_TABLES.get(id(defaults))
+  if cached is not None and cached[0] is defaults:
+    return cached[1]
+
+  wcd = defaults['wind_compass']
+  head = COMPASS_OPEN.format(height=wcd['height'], width=wcd['width'],
+                             id_label=wcd['id_label'], viewbox=wcd['viewbox'])
+  tail = '{0}{1}'.format(wcd['symbol'], wcd['raw_svg_footer'])
+  circle = css_string(defaults['circle_css'])
+  table = []
+  for degrees in range(0, 360):
+    rot1_css = dict(defaults['rot1_css'])
+    rot1_css['transform'] = 'rotate({0}deg)'.format(degrees)
+    svg_css = '<style>circle {0} .rot1 {1}</style>'.format(circle, css_string(rot1_css))
+    table.append('{0}{1}{2}'.format(head, svg_css, tail))
+  _COMPASS_TABLES[id(defaults)] = (defaults, table)
+  return table
+
+
+def draw_compass_svg(degrees, data):
+  """
+  The wind compass SVG rotated to a heading (rounded to the whole degree),
+  looked up in the precomputed table. None if the heading is missing.
+  """
+  try:
+    index = int(round(float(degrees))) % 360
+  except (TypeError, ValueError):
+    logging.warn('No wind heading for the compass: %s', degrees)
+    return None
+  return compass_table(data['defaults'])[index]
 
 
 def wind_direction_icon(heading, sourcepath='static/icons/weather-icons-master/svg'):